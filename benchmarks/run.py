@@ -0,0 +1,185 @@
+"""
+Benchmarks for discovery, checksum validation, planning and apply throughput.
+
+Generates synthetic migration directories and times the code paths that grow
+with history size. Results are written as JSON so runs can be compared:
+
+    python -m benchmarks.run --sizes 1000,10000 --output before.json
+    git checkout my-branch
+    python -m benchmarks.run --sizes 1000,10000 --output after.json --compare before.json
+
+Database benchmarks use a scratch database on the server in
+BENCH_DATABASE_URL (or DATABASE_URL), created and dropped per size.
+"""
+import datetime
+import json
+import os
+import platform
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import click
+import psycopg2
+from src.commands import run_up, run_down, run_status
+from src.config import RunConfig
+from src.db import Database, create_database, drop_database, url_for_database
+from src.metadata import create_metadata
+from src.utils import ChecksumCache, MigrationManifest, get_migrations
+
+DEFAULT_SIZES = "1000,10000,50000"
+# Applying tens of thousands of migrations takes minutes; larger sizes only get file benchmarks
+DEFAULT_APPLY_LIMIT = 10000
+DEFAULT_THRESHOLD = 0.20
+
+def quiet(*args, **kwargs):
+    pass
+
+def generate(directory, count):
+    """Writes COUNT migration pairs, one table each, with increasing versions."""
+    os.makedirs(directory)
+    start = datetime.datetime(2020, 1, 1)
+    for i in range(count):
+        timestamp = (start + datetime.timedelta(minutes=i)).strftime("%Y%m%d%H%M%S")
+        base = os.path.join(directory, f"{timestamp}_{i % 10000:04d}_bench_{i}")
+        with open(f"{base}.up.sql", 'w') as f:
+            f.write(f"-- SQL for 'up' migration\nCREATE TABLE bench_{i} (id int);\n")
+        with open(f"{base}.down.sql", 'w') as f:
+            f.write(f"-- SQL for 'down' migration\nDROP TABLE bench_{i};\n")
+
+def timed(results, name, size, fn, repeat=1):
+    """Runs fn REPEAT times and records the best wall time."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    results.append({"name": name, "size": size, "seconds": round(best, 6),
+                    "per_migration_us": round(best / size * 1_000_000, 3)})
+    click.echo(f"  {name:<22} {size:>6}  {best:>9.3f}s  {best / size * 1_000_000:>10.1f} µs/migration", err=True)
+
+def bench_files(results, size, repeat):
+    paths = [m.up_path for m in get_migrations().values()]
+    timed(results, "scan", size, lambda: get_migrations(manifest=MigrationManifest("off")), repeat)
+
+    cache_path = os.path.join(".pgmigrate", "bench-checksums.json")
+    def cold():
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        ChecksumCache(cache_path).warm(paths)
+    timed(results, "checksum_cold", size, cold, repeat)
+
+    # Files modified within the racy window are never cached; wait them out so warm numbers are honest
+    time.sleep(2.1)
+    seeded = ChecksumCache(cache_path)
+    seeded.warm(paths)
+    seeded.save()
+    timed(results, "checksum_warm", size, lambda: ChecksumCache(cache_path).warm(paths), repeat)
+
+    manifest_path = os.path.join(".pgmigrate", "bench-manifest.json")
+    get_migrations(manifest=MigrationManifest(manifest_path))
+    timed(results, "scan_manifest", size, lambda: get_migrations(manifest=MigrationManifest(manifest_path)), repeat)
+
+def bench_database(results, size, server_url):
+    name = f"pgmigrate_bench_{secrets.token_hex(4)}"
+    url = url_for_database(server_url, name)
+    try:
+        create_database(server_url, name)
+        db = Database(url)
+        try:
+            create_metadata(db.get_conn())
+        finally:
+            db.close()
+        timed(results, "up", size, lambda: run_up(url, RunConfig(), quiet))
+        timed(results, "status", size, lambda: run_status(url, quiet), repeat=3)
+        timed(results, "up_noop_fast", size, lambda: run_up(url, RunConfig(), quiet), repeat=3)
+        timed(results, "up_noop_validate", size, lambda: run_up(url, RunConfig(fast_check=False), quiet), repeat=3)
+        timed(results, "down", size, lambda: run_down(url, RunConfig(), quiet))
+    finally:
+        drop_database(server_url, name)
+
+def environment(server_url):
+    info = {"python": platform.python_version(), "platform": platform.platform(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+    try:
+        info["commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                        text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        info["commit"] = None
+    if server_url:
+        conn = psycopg2.connect(server_url)
+        info["postgres"] = conn.server_version
+        conn.close()
+    return info
+
+def compare(results, baseline_path, threshold) -> int:
+    """Prints per-benchmark ratios against an earlier run; returns the number of regressions."""
+    with open(baseline_path, 'r') as f:
+        old = {(r["name"], r["size"]): r["seconds"] for r in json.load(f)["results"]}
+    regressions = 0
+    click.echo(f"\nCompared with {baseline_path} (regression threshold {threshold:.0%}):", err=True)
+    for r in results:
+        before = old.get((r["name"], r["size"]))
+        if not before:
+            continue
+        ratio = r["seconds"] / before
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- REGRESSION"
+            regressions += 1
+        click.echo(f"  {r['name']:<22} {r['size']:>6}  {before:>9.3f}s -> {r['seconds']:>9.3f}s  "
+                   f"x{ratio:.2f}{flag}", err=True)
+    return regressions
+
+@click.command()
+@click.option('--sizes', default=DEFAULT_SIZES, show_default=True, help="Comma-separated migration counts.")
+@click.option('--apply-limit', type=int, default=DEFAULT_APPLY_LIMIT, show_default=True,
+              help="Largest size that also gets database benchmarks.")
+@click.option('--no-db', is_flag=True, help="Only run file benchmarks.")
+@click.option('--repeat', type=int, default=3, show_default=True, help="Runs per file benchmark (best is kept).")
+@click.option('--output', type=click.Path(dir_okay=False), help="Write JSON results here (default: stdout).")
+@click.option('--compare', 'compare_path', type=click.Path(exists=True, dir_okay=False),
+              help="Earlier JSON results to compare against; exits 1 on regressions.")
+@click.option('--threshold', type=float, default=DEFAULT_THRESHOLD, show_default=True,
+              help="Slowdown ratio counted as a regression.")
+def main(sizes, apply_limit, no_db, repeat, output, compare_path, threshold):
+    """Runs the benchmark suite."""
+    server_url = None if no_db else (os.getenv("BENCH_DATABASE_URL") or os.getenv("DATABASE_URL"))
+    if not no_db and not server_url:
+        raise click.UsageError("Set BENCH_DATABASE_URL or DATABASE_URL, or pass --no-db.")
+    sizes = [int(s) for s in sizes.split(",") if s.strip()]
+    if output:
+        output = os.path.abspath(output)
+    if compare_path:
+        compare_path = os.path.abspath(compare_path)
+
+    report = {"environment": environment(server_url), "results": []}
+    cwd = os.getcwd()
+    for size in sizes:
+        workdir = tempfile.mkdtemp(prefix=f"pgmigrate-bench-{size}-")
+        click.echo(f"▶ {size} migrations", err=True)
+        try:
+            generate(os.path.join(workdir, "migrations"), size)
+            os.chdir(workdir)
+            bench_files(report["results"], size, repeat)
+            if server_url and size <= apply_limit:
+                bench_database(report["results"], size, server_url)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        click.echo(text)
+
+    if compare_path and compare(report["results"], compare_path, threshold):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
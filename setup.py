@@ -10,6 +10,10 @@ setup(
         'psycopg2-binary',
         'python-dotenv',
     ],
+    extras_require={
+        # .up.sql.zst migrations (Python 3.14+ reads them without it)
+        'zstd': ['zstandard'],
+    },
     entry_points={
         'console_scripts': [
             'pgmigrate = src.main:start', 
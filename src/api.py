@@ -0,0 +1,50 @@
+"""
+Python entry points for running migrations from application code, e.g. on boot:
+
+    from src.api import is_up_to_date, migrate
+
+    if not is_up_to_date(db_url):
+        migrate(db_url)
+
+migrate() already starts with the same lock-free check, so calling it
+unconditionally is cheap too.
+"""
+import os
+from typing import List, Optional
+from .commands import run_up
+from .config import RunConfig
+from .db import Database
+from .metadata import read_fingerprint
+from .utils import get_migrations, migration_fingerprint, checksum_cache
+
+def _resolve_url(db_url):
+    db_url = db_url or os.getenv("DATABASE_URL")
+    if not db_url:
+        raise Exception("No database URL given and DATABASE_URL is not set.")
+    return db_url
+
+def is_up_to_date(db_url: Optional[str] = None, migrations_dir: str = "migrations") -> bool:
+    """
+    True when the database has every local migration applied, decided by one
+    query against the fingerprint stored by the last run. Takes no lock.
+    False can also mean "not known yet" (e.g. before the first run with this version).
+    """
+    local_migrations = get_migrations(migrations_dir)
+    checksum_cache.warm(p for m in local_migrations.values() for p in m.checksum_paths())
+    fingerprint = migration_fingerprint(local_migrations)
+    checksum_cache.save()
+    db = Database(_resolve_url(db_url))
+    try:
+        return read_fingerprint(db.get_conn()) == fingerprint
+    finally:
+        db.close()
+
+def migrate(db_url: Optional[str] = None, migrations_dir: str = "migrations",
+            echo=None, **options) -> List[str]:
+    """
+    Applies pending migrations, like 'pgmigrate up'. Options are RunConfig
+    fields (e.g. lock_timeout='5s', single_transaction=True).
+    Returns the versions that were applied; raises on failure.
+    """
+    config = RunConfig.from_options(migrations_dir=migrations_dir, **options)
+    return run_up(_resolve_url(db_url), config, echo or (lambda *args, **kwargs: None))
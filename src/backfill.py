@@ -0,0 +1,164 @@
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+import psycopg2
+from psycopg2 import sql
+from .metadata import record_applied
+from .splitter import split_statements
+from .utils import parse_duration
+
+# One row per backfill that has started but not finished
+CHECKPOINT_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations_backfill (
+        version VARCHAR(255) PRIMARY KEY,
+        checksum VARCHAR(64) NOT NULL,
+        last_key TEXT,
+        rows_done BIGINT NOT NULL DEFAULT 0,
+        chunks INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+# Any '%' that is not one of the chunk placeholders is literal SQL (e.g. LIKE 'a%')
+LITERAL_PERCENT_REGEX = re.compile(r"%(?!\((?:start|end)\)s)")
+
+DEFAULT_BATCH_SIZE = 1000
+PROGRESS_INTERVAL = 5.0   # Seconds between progress lines
+
+@dataclass
+class BackfillSpec:
+    """
+    Parsed from '-- migration: backfill table=<table> key=<column> [batch-size=N] [sleep=100ms]'.
+    The body is a single statement using %(start)s and %(end)s, the inclusive
+    key range of the current chunk. Any other '%' is taken literally.
+    """
+    table: str
+    key: str
+    batch_size: int = DEFAULT_BATCH_SIZE
+    sleep_ms: int = 0
+
+    @classmethod
+    def from_directives(cls, directives) -> "BackfillSpec":
+        missing = [k for k in ("table", "key") if not directives.get(k)]
+        if missing:
+            raise ValueError(f"Backfill header is missing {', '.join(missing)}= "
+                             f"(e.g. '-- migration: backfill table=users key=id batch-size=1000')")
+        return cls(
+            table=directives["table"],
+            key=directives["key"],
+            batch_size=int(directives.get("batch-size") or DEFAULT_BATCH_SIZE),
+            sleep_ms=parse_duration(directives.get("sleep")) or 0,
+        )
+
+def _identifier(name):
+    """'schema.table' -> a safely quoted, possibly qualified identifier."""
+    return sql.Identifier(*name.split("."))
+
+def chunk_body(body: str) -> str:
+    """BODY ready for parameter substitution: literal '%' doubled, the chunk placeholders kept."""
+    return LITERAL_PERCENT_REGEX.sub("%%", body)
+
+def ensure_checkpoint_table(conn):
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations_backfill') AS checkpoints")
+            if not cur.fetchone()['checkpoints']:
+                cur.execute(CHECKPOINT_DDL)
+
+def run_backfill(conn, migration, script, batch_id, log, echo,
+                 sleep_ms: Optional[int] = None, lock_timeout_ms: Optional[int] = None) -> int:
+    """
+    Runs a backfill as keyset-paginated chunks, each in its own short transaction
+    together with its checkpoint. Resumes from the checkpoint of an interrupted run.
+    Returns the number of rows the body reported as affected.
+    """
+    spec = BackfillSpec.from_directives(script.directives)
+    statements = split_statements(script.sql)
+    if len(statements) != 1:
+        raise ValueError(f"Backfill {migration.version} must contain exactly one statement "
+                         f"(found {len(statements)}); each chunk runs in its own transaction.")
+    body = chunk_body(statements[0].sql)
+    if sleep_ms is None:
+        sleep_ms = spec.sleep_ms
+    ensure_checkpoint_table(conn)
+
+    next_chunk = sql.SQL("""
+        SELECT MIN(k)::text AS first_key, MAX(k)::text AS last_key, COUNT(*) AS n
+        FROM (
+            SELECT {key} AS k FROM {table}
+            WHERE %(after)s::text IS NULL OR {key} > %(after)s
+            ORDER BY {key}
+            LIMIT %(limit)s
+        ) chunk
+    """).format(key=_identifier(spec.key), table=_identifier(spec.table))
+
+    checksum = migration.up_checksum
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM schema_migrations_backfill WHERE version = %s", (migration.version,))
+            checkpoint = cur.fetchone()
+    if checkpoint and checkpoint['checksum'] != checksum:
+        raise Exception(
+            f"Backfill checkpoint for {migration.version} was made by a different version of the file. "
+            f"To restart it: DELETE FROM schema_migrations_backfill WHERE version = '{migration.version}'")
+
+    last_key = checkpoint['last_key'] if checkpoint else None
+    rows_done = checkpoint['rows_done'] if checkpoint else 0
+    chunks = checkpoint['chunks'] if checkpoint else 0
+    if checkpoint:
+        echo(f"   ↻ Resuming after {spec.key}={last_key} ({rows_done} rows, {chunks} chunks done)", fg="cyan")
+
+    started = time.monotonic()
+    last_report = started
+    rows_this_run = 0
+    while True:
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    if lock_timeout_ms:
+                        cur.execute("SET LOCAL lock_timeout = %s", (f"{lock_timeout_ms}ms",))
+                    if log.budget is not None:
+                        log.budget.cap(cur)
+                    cur.execute(next_chunk, {"after": last_key, "limit": spec.batch_size})
+                    chunk = cur.fetchone()
+                    if chunk['n'] == 0:
+                        # Done: record the migration and drop the checkpoint atomically
+                        record_applied(cur, [(migration.version, migration.name, checksum,
+                                              batch_id, log.elapsed_ms(), "backfill")],
+                                       log.lock_wait_ms, log.applied_by)
+                        cur.execute("DELETE FROM schema_migrations_backfill WHERE version = %s",
+                                    (migration.version,))
+                        break
+
+                    if log.budget is not None:
+                        log.budget.cap(cur)
+                    cur.execute(body, {"start": chunk['first_key'], "end": chunk['last_key']})
+                    affected = max(cur.rowcount, 0)
+                    cur.execute("""
+                        INSERT INTO schema_migrations_backfill (version, checksum, last_key, rows_done, chunks, updated_at)
+                        VALUES (%s, %s, %s, %s, %s, NOW())
+                        ON CONFLICT (version) DO UPDATE
+                        SET last_key = EXCLUDED.last_key, rows_done = EXCLUDED.rows_done,
+                            chunks = EXCLUDED.chunks, updated_at = NOW()
+                    """, (migration.version, checksum, chunk['last_key'], rows_done + affected, chunks + 1))
+        except psycopg2.Error as e:
+            raise Exception(f"Backfill chunk after {spec.key}={last_key} failed "
+                            f"(progress is saved, rerun 'up' to resume): {e.pgerror}")
+
+        last_key = chunk['last_key']
+        rows_done += affected
+        rows_this_run += affected
+        chunks += 1
+
+        now = time.monotonic()
+        if now - last_report >= PROGRESS_INTERVAL:
+            rate = rows_this_run / (now - started)
+            echo(f"   ↳ {rows_done} rows in {chunks} chunks, {spec.key}={last_key} ({rate:.0f} rows/s)")
+            last_report = now
+        if sleep_ms:
+            time.sleep(sleep_ms / 1000)
+        log.pace()
+
+    echo(f"   ✅ Backfilled {rows_done} rows in {chunks} chunks.")
+    return rows_done
@@ -0,0 +1,104 @@
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+import psycopg2
+from .executor import execute_script
+from .metadata import record_applied
+
+BASELINE_HEADER = "-- pgmigrate baseline"
+# "-- applied: <version> <checksum> <name>" lines list the migrations a baseline replaces
+APPLIED_REGEX = re.compile(r"^-- applied: (\S+) ([0-9a-f]{64}) (.+)$", re.MULTILINE)
+
+@dataclass
+class Baseline:
+    path: str
+    sql: str
+    covers: Dict[str, tuple] = field(default_factory=dict)   # version -> (checksum, name)
+
+    @property
+    def last_version(self) -> str:
+        return max(self.covers)
+
+def read_baseline(path) -> Optional[Baseline]:
+    """Loads a baseline written by 'squash', or returns None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        content = f.read()
+    if not content.startswith(BASELINE_HEADER):
+        raise Exception(f"{path} is not a pgmigrate baseline (missing '{BASELINE_HEADER}' header).")
+    covers = {m.group(1): (m.group(2), m.group(3)) for m in APPLIED_REGEX.finditer(content)}
+    if not covers:
+        raise Exception(f"Baseline {path} does not list any covered migrations.")
+    return Baseline(path, content, covers)
+
+def write_baseline(path, dump_sql, migrations):
+    """
+    Writes the schema snapshot with a header listing the covered migrations.
+    psql meta-commands (e.g. pg_dump's \\restrict) are dropped so the file can
+    be executed through a normal connection.
+    """
+    body = "\n".join(line for line in dump_sql.splitlines() if not line.startswith("\\"))
+    with open(path, 'w') as f:
+        f.write(f"{BASELINE_HEADER}\n")
+        f.write(f"-- Replaces {len(migrations)} migrations up to {migrations[-1].version}.\n")
+        f.write("-- Generated by 'pgmigrate squash'; do not edit by hand.\n")
+        for m in migrations:
+            f.write(f"-- applied: {m.version} {m.up_checksum} {m.name}\n")
+        f.write("\n")
+        f.write(body)
+        f.write("\n")
+
+def baseline_mismatches(baseline, local_migrations):
+    """Versions whose local file is missing or differs from what the baseline was built from."""
+    problems = []
+    for version, (checksum, _) in sorted(baseline.covers.items()):
+        local = local_migrations.get(version)
+        if local is None or not local.up_path:
+            problems.append(f"{version} (file missing)")
+        elif local.up_checksum != checksum:
+            problems.append(f"{version} (checksum changed)")
+    return problems
+
+def database_is_empty(conn) -> bool:
+    """True when the database has no relations besides pgmigrate's own bookkeeping."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(*) AS n
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')
+              AND n.nspname NOT LIKE 'pg_toast%'
+              AND n.nspname NOT LIKE 'pg_temp%'
+              AND c.relkind IN ('r', 'p', 'v', 'm', 'S', 'f')
+              AND c.relname NOT LIKE 'schema_migrations%'
+        """)
+        empty = cur.fetchone()['n'] == 0
+    conn.commit()
+    return empty
+
+def load_baseline(conn, baseline, local_migrations, batch_id, log):
+    """
+    Executes the snapshot and marks every covered version as applied,
+    all in one transaction.
+    """
+    versions = sorted(baseline.covers)
+    log.begin(baseline.last_version, "up", "baseline")
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                execute_script(cur, baseline.sql, log)
+                # pg_dump output empties search_path for the session; put it back
+                cur.execute("RESET search_path")
+                rows = []
+                for version in versions:
+                    m = local_migrations[version]
+                    rows.append((m.version, m.name, m.up_checksum, batch_id, 0, "baseline"))
+                # The whole load is attributed to the last covered migration
+                rows[-1] = rows[-1][:4] + (log.elapsed_ms(), "baseline")
+                record_applied(cur, rows, log.lock_wait_ms, log.applied_by)
+    except psycopg2.Error as e:
+        raise Exception(f"Loading baseline {baseline.path} failed: {e.pgerror}")
+    log.end({baseline.last_version})
+    return versions
@@ -0,0 +1,175 @@
+"""
+Pre-flight blocker detection: before a migration takes its table locks, look
+for sessions holding (or queued for) conflicting locks on those tables, and
+for old transactions a CREATE INDEX CONCURRENTLY would have to wait out.
+DDL queued behind such a session blocks every later query on the table.
+"""
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+from .lint import lock_requirements, CONCURRENTLY_REGEX, LOCK_MODES
+
+BLOCKER_POLICIES = ["off", "warn", "wait", "abort", "terminate"]
+POLL_INTERVAL = 1.0   # Seconds between checks while waiting
+
+# Which held modes each requested mode conflicts with (PostgreSQL "Conflicting Lock Modes" table)
+LOCK_CONFLICTS = {
+    "AccessShareLock": {"AccessExclusiveLock"},
+    "RowShareLock": {"ExclusiveLock", "AccessExclusiveLock"},
+    "RowExclusiveLock": {"ShareLock", "ShareRowExclusiveLock", "ExclusiveLock", "AccessExclusiveLock"},
+    "ShareUpdateExclusiveLock": {"ShareUpdateExclusiveLock", "ShareLock", "ShareRowExclusiveLock",
+                                 "ExclusiveLock", "AccessExclusiveLock"},
+    "ShareLock": {"RowExclusiveLock", "ShareUpdateExclusiveLock", "ShareRowExclusiveLock",
+                  "ExclusiveLock", "AccessExclusiveLock"},
+    "ShareRowExclusiveLock": {"RowExclusiveLock", "ShareUpdateExclusiveLock", "ShareLock",
+                              "ShareRowExclusiveLock", "ExclusiveLock", "AccessExclusiveLock"},
+    "ExclusiveLock": {"RowShareLock", "RowExclusiveLock", "ShareUpdateExclusiveLock", "ShareLock",
+                      "ShareRowExclusiveLock", "ExclusiveLock", "AccessExclusiveLock"},
+    "AccessExclusiveLock": {"AccessShareLock", "RowShareLock", "RowExclusiveLock", "ShareUpdateExclusiveLock",
+                            "ShareLock", "ShareRowExclusiveLock", "ExclusiveLock", "AccessExclusiveLock"},
+}
+
+# Other sessions' locks on the given tables. Our own connections share our application_name;
+# background processes (autovacuum, walsenders, parallel workers) are not ours to wait out or terminate.
+LOCK_HOLDERS_QUERY = """
+    SELECT l.relation AS oid, l.pid, l.relation::regclass::text AS relation, l.mode, l.granted,
+           a.state, a.usename, a.application_name,
+           EXTRACT(EPOCH FROM clock_timestamp() - COALESCE(a.xact_start, a.query_start)) AS age_s,
+           left(regexp_replace(a.query, '\\s+', ' ', 'g'), 200) AS query
+    FROM pg_locks l
+    JOIN pg_stat_activity a ON a.pid = l.pid
+    WHERE l.locktype = 'relation'
+      AND l.database = (SELECT oid FROM pg_database WHERE datname = current_database())
+      AND l.relation = ANY(%(oids)s::oid[])
+      AND l.pid <> pg_backend_pid()
+      AND a.backend_type = 'client backend'
+      AND a.application_name IS DISTINCT FROM current_setting('application_name')
+"""
+
+# Transactions CREATE INDEX CONCURRENTLY waits for, whatever they touch. It doesn't wait for
+# (non-FULL) VACUUM, so a client running one is left out like autovacuum is.
+OLD_TRANSACTIONS_QUERY = """
+    SELECT a.pid, NULL AS relation, NULL AS mode, TRUE AS granted,
+           a.state, a.usename, a.application_name,
+           EXTRACT(EPOCH FROM clock_timestamp() - a.xact_start) AS age_s,
+           left(regexp_replace(a.query, '\\s+', ' ', 'g'), 200) AS query
+    FROM pg_stat_activity a
+    WHERE a.datname = current_database()
+      AND a.xact_start IS NOT NULL
+      AND (a.backend_xid IS NOT NULL OR a.backend_xmin IS NOT NULL)
+      AND a.pid <> pg_backend_pid()
+      AND a.backend_type = 'client backend'
+      AND NOT (a.query ~* '^\\s*vacuum\\M' AND a.query !~* '\\mfull\\M')
+      AND a.application_name IS DISTINCT FROM current_setting('application_name')
+"""
+
+class BlockerError(Exception):
+    """Conflicting sessions were found and the policy does not allow proceeding."""
+
+@dataclass
+class Blocker:
+    pid: int
+    relation: Optional[str]   # None: an old transaction a CONCURRENTLY build would wait for
+    mode: Optional[str]
+    granted: bool             # False: queued ahead of us for the lock
+    state: Optional[str]
+    usename: Optional[str]
+    application_name: Optional[str]
+    age_s: float
+    query: Optional[str]
+
+    def describe(self) -> str:
+        what = (f"{'holds' if self.granted else 'waits for'} {self.mode} on {self.relation}"
+                if self.relation else "old transaction")
+        query = (self.query or "").strip()
+        query = query if len(query) <= 80 else query[:77] + "..."
+        return (f"pid {self.pid} ({self.usename or '?'}, {self.application_name or '-'}) {what}, "
+                f"{self.state or '?'} for {self.age_s:.0f}s: {query}")
+
+def find_blockers(conn, needed: Dict[str, str], concurrent: bool, min_age_ms: int = 0) -> List[Blocker]:
+    """Sessions in the way of taking NEEDED ({table: mode}) locks, older than MIN_AGE_MS."""
+    blockers = []
+    with conn:
+        with conn.cursor() as cur:
+            oids = {}
+            for table in needed:
+                cur.execute("SELECT to_regclass(%s)::oid AS oid", (table,))
+                oid = cur.fetchone()['oid']
+                if oid:
+                    oids[oid] = table
+            if oids:
+                cur.execute(LOCK_HOLDERS_QUERY, {"oids": list(oids)})
+                for row in cur.fetchall():
+                    wanted = needed[oids[row.pop('oid')]]
+                    if row['mode'] in LOCK_CONFLICTS[wanted]:
+                        blockers.append(Blocker(**row))
+            if concurrent:
+                cur.execute(OLD_TRANSACTIONS_QUERY)
+                blockers.extend(Blocker(**row) for row in cur.fetchall())
+
+    seen, unique = set(), []
+    for b in blockers:
+        b.age_s = float(b.age_s or 0)
+        key = (b.pid, b.relation)
+        if b.age_s * 1000 >= min_age_ms and key not in seen:
+            seen.add(key)
+            unique.append(b)
+    return unique
+
+def terminate(conn, pids) -> List[int]:
+    """pg_terminate_backend for each pid; returns the ones that were signalled."""
+    done = []
+    with conn:
+        with conn.cursor() as cur:
+            for pid in pids:
+                cur.execute("SELECT pg_terminate_backend(%s) AS ok", (pid,))
+                if cur.fetchone()['ok']:
+                    done.append(pid)
+    return done
+
+def preflight(conn, scripts, policy: str, log, min_age_ms: int = 0, timeout_ms: Optional[int] = None):
+    """
+    Checks for sessions that would block SCRIPTS' locks and applies POLICY:
+    warn (report and go on), wait (until they are gone, at most TIMEOUT_MS),
+    abort, or terminate them.
+    """
+    if policy == "off":
+        return
+    needed = {}
+    for script in scripts:
+        for table, mode in lock_requirements(script).items():
+            if table not in needed or LOCK_MODES.index(mode) > LOCK_MODES.index(needed[table]):
+                needed[table] = mode
+    concurrent = any(script.no_transaction and CONCURRENTLY_REGEX.search(script.sql) for script in scripts)
+    if not needed and not concurrent:
+        return
+
+    blockers = find_blockers(conn, needed, concurrent, min_age_ms)
+    if not blockers:
+        return
+    versions = ", ".join(script.version for script in scripts)
+    log.line(f"   🚧 {len(blockers)} session(s) would block {versions}:", fg="yellow")
+    for b in blockers:
+        log.line(f"      {b.describe()}", fg="yellow")
+    log.emit("blockers", versions=[s.version for s in scripts], policy=policy,
+             blockers=[asdict(b) for b in blockers])
+
+    if policy == "warn":
+        return
+    if policy == "abort":
+        raise BlockerError(f"Aborting before {versions}: blocked by pid "
+                           f"{', '.join(str(p) for p in sorted({b.pid for b in blockers}))} (--blockers abort).")
+    if policy == "terminate":
+        for pid in terminate(conn, sorted({b.pid for b in blockers})):
+            log.line(f"   🔪 Terminated pid {pid}.", fg="red")
+
+    started = time.monotonic()
+    while blockers:
+        waited_ms = (time.monotonic() - started) * 1000
+        if timeout_ms and waited_ms >= timeout_ms:
+            raise BlockerError(f"Still blocked after {waited_ms / 1000:.0f}s before {versions}: pid "
+                               f"{', '.join(str(p) for p in sorted({b.pid for b in blockers}))}.")
+        time.sleep(POLL_INTERVAL)
+        blockers = find_blockers(conn, needed, concurrent, min_age_ms)
+    if policy == "wait":
+        log.line(f"   ✅ Blockers cleared after {(time.monotonic() - started):.1f}s.")
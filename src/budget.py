@@ -0,0 +1,147 @@
+"""
+Time-budgeted runs (up --budget / --window): pending migrations are applied
+only while their estimated durations fit in the time left, the run stops
+between migrations once the next one no longer fits, and statement_timeout,
+set afresh before every statement, keeps any of them from running past the deadline.
+
+Estimates are durations pgmigrate recorded for the same migration before:
+in this database's history (e.g. an earlier up that was reverted), in other
+environments' databases, or in --report / rehearse JSON reports.
+"""
+import datetime
+import json
+import os
+import re
+import time
+from typing import Dict, Iterable, Optional, Tuple
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+DEFAULT_ESTIMATE_MS = 60000   # For migrations with no recorded duration anywhere
+
+WINDOW_REGEX = re.compile(r'^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$')
+
+RECORDED_DURATIONS_QUERY = """
+    SELECT version, MAX(duration_ms) AS duration_ms
+    FROM schema_migrations_history
+    WHERE direction = 'up' AND duration_ms IS NOT NULL
+    GROUP BY version
+"""
+
+class BudgetExhausted(Exception):
+    """The next migration does not fit in the time left; the run stops before it."""
+
+def parse_window(text: str) -> Tuple[datetime.time, datetime.time]:
+    """'02:00-04:00' -> (02:00, 04:00), local time. The end may be past midnight ('22:00-02:00')."""
+    match = WINDOW_REGEX.match(text or "")
+    if not match:
+        raise ValueError(f"Invalid window: '{text}' (expected HH:MM-HH:MM, e.g. 02:00-04:00)")
+    h1, m1, h2, m2 = (int(g) for g in match.groups())
+    if h1 > 23 or h2 > 23 or m1 > 59 or m2 > 59 or (h1, m1) == (h2, m2):
+        raise ValueError(f"Invalid window: '{text}'")
+    return datetime.time(h1, m1), datetime.time(h2, m2)
+
+def window_seconds_left(window: str, now: Optional[datetime.datetime] = None) -> float:
+    """Seconds until WINDOW ends, or 0 when NOW is outside it."""
+    start, end = parse_window(window)
+    now = now or datetime.datetime.now()
+    today_start = datetime.datetime.combine(now.date(), start)
+    today_end = datetime.datetime.combine(now.date(), end)
+    if start < end:
+        inside, ends = today_start <= now < today_end, today_end
+    elif now >= today_start:
+        inside, ends = True, today_end + datetime.timedelta(days=1)
+    else:
+        inside, ends = now < today_end, today_end
+    return (ends - now).total_seconds() if inside else 0.0
+
+def time_left(budget_ms: Optional[int], window: Optional[str]) -> Optional[float]:
+    """Seconds this run may take: the budget, cut short by the end of the window. None: unlimited."""
+    limits = []
+    if budget_ms is not None:
+        limits.append(budget_ms / 1000)
+    if window:
+        limits.append(window_seconds_left(window))
+    return min(limits) if limits else None
+
+def recorded_durations(conn) -> Dict[str, float]:
+    """{version: longest recorded 'up' duration in ms} from a database's schema_migrations_history."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_migrations_history') IS NOT NULL AS present")
+        if not cur.fetchone()['present']:
+            return {}
+        cur.execute(RECORDED_DURATIONS_QUERY)
+        return {row['version']: float(row['duration_ms']) for row in cur.fetchall()}
+
+def report_durations(path: str) -> Dict[str, float]:
+    """{version: duration in ms} of the successful 'up' migrations in a JSON run report."""
+    with open(path) as f:
+        report = json.load(f)
+    return {m["version"]: float(m["duration_ms"]) for m in report.get("migrations", [])
+            if m.get("direction") == "up" and m.get("status") == "ok"}
+
+def load_estimates(conn, sources: Iterable[str] = ()) -> Dict[str, float]:
+    """
+    Recorded durations from this database (CONN) and each of SOURCES: a JSON
+    report file, or the URL of another environment's database. The longest wins.
+    """
+    estimates = {}
+
+    def merge(durations):
+        for version, ms in durations.items():
+            estimates[version] = max(ms, estimates.get(version, 0.0))
+
+    merge(recorded_durations(conn))
+    conn.rollback()
+    for source in sources:
+        if os.path.isfile(source):
+            merge(report_durations(source))
+            continue
+        other = psycopg2.connect(source, cursor_factory=RealDictCursor)
+        try:
+            merge(recorded_durations(other))
+        finally:
+            other.close()
+    return estimates
+
+class Budget:
+    """The time left for a run and what each pending step is expected to cost."""
+    def __init__(self, seconds: float, estimates: Dict[str, float], default_ms: int = DEFAULT_ESTIMATE_MS,
+                 statement_timeout: bool = True, started: Optional[float] = None):
+        self.deadline = (started or time.monotonic()) + seconds
+        self.estimates = estimates
+        self.default_ms = default_ms
+        self.statement_timeout = statement_timeout   # Session SETs; off behind a transaction pooler, where they leak
+
+    def remaining_ms(self) -> float:
+        return max(0.0, (self.deadline - time.monotonic()) * 1000)
+
+    def estimate_ms(self, step) -> float:
+        return sum(self.estimates.get(script.version, self.default_ms) for script in step)
+
+    def fitting(self, steps) -> int:
+        """How many of STEPS, in order, fit in the time left."""
+        left = self.remaining_ms()
+        for i, step in enumerate(steps):
+            left -= self.estimate_ms(step)
+            if left < 0:
+                return i
+        return len(steps)
+
+    def admit(self, step):
+        """Raises BudgetExhausted if STEP no longer fits in the time left."""
+        remaining, estimate = self.remaining_ms(), self.estimate_ms(step)
+        if estimate > remaining:
+            raise BudgetExhausted(f"Stopping before {step[0].version}: estimated {estimate / 1000:.1f}s, "
+                                  f"{remaining / 1000:.1f}s left. Rerun 'up' to continue.")
+
+    def cap(self, cur):
+        """
+        Caps the next statement on CUR at the time left (at least 1ms: 0 would mean no limit).
+        SET LOCAL inside a transaction; a session SET in autocommit, unless that would leak.
+        """
+        timeout = f"{max(1, int(self.remaining_ms()))}ms"
+        if not cur.connection.autocommit:
+            cur.execute("SET LOCAL statement_timeout = %s", (timeout,))
+        elif self.statement_timeout:
+            cur.execute("SET statement_timeout = %s", (timeout,))
@@ -0,0 +1,254 @@
+import difflib
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# Native schema introspection: a handful of bulk pg_catalog queries instead of pg_dump.
+# Privileges, ownership, comments, statistics and composite types are not captured.
+
+DUMP_HEADER = "-- pgmigrate schema dump"
+OBJECT_HEADER_REGEX = re.compile(r"^-- object: (\S+) (.+)$", re.MULTILINE)
+
+# Order of sections in a dump; within a section objects are sorted by name
+KIND_ORDER = ["extension", "schema", "type", "domain", "sequence", "table", "function",
+              "view", "materialized-view", "constraint", "index", "trigger"]
+
+# pgmigrate's own bookkeeping is not part of the application schema
+EXCLUDED_TABLE_PATTERN = "^schema_migrations"
+
+@dataclass
+class SchemaObject:
+    kind: str
+    name: str
+    ddl: str
+
+Snapshot = Dict[Tuple[str, str], SchemaObject]
+
+def _not_extension_member(catalog, column):
+    return (f"NOT EXISTS (SELECT 1 FROM pg_depend dep WHERE dep.classid = '{catalog}'::regclass "
+            f"AND dep.objid = {column} AND dep.deptype = 'e')")
+
+NAMESPACE_FILTER = ("n.nspname <> 'information_schema' AND n.nspname !~ '^pg_' "
+                    "AND (%(schemas)s::text[] IS NULL OR n.nspname = ANY(%(schemas)s::text[]))")
+
+def _query(cur, query, params):
+    cur.execute(query, params)
+    return cur.fetchall()
+
+def introspect(conn, schemas: Optional[List[str]] = None) -> Snapshot:
+    """Reads the schema of the connected database into {(kind, name): SchemaObject}."""
+    params = {"schemas": list(schemas) if schemas else None, "excluded": EXCLUDED_TABLE_PATTERN}
+    objects: Snapshot = {}
+
+    def add(kind, name, ddl):
+        objects[(kind, name)] = SchemaObject(kind, name, ddl.strip().rstrip(";").strip())
+
+    with conn.cursor() as cur:
+        # With an empty search_path every name the catalog functions print is schema-qualified
+        cur.execute("SET LOCAL search_path = ''")
+        for row in _query(cur, """
+            SELECT quote_ident(e.extname) AS name, quote_ident(n.nspname) AS schema
+            FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace
+            WHERE e.extname <> 'plpgsql'
+        """, params):
+            add("extension", row['name'], f"CREATE EXTENSION IF NOT EXISTS {row['name']} WITH SCHEMA {row['schema']}")
+
+        for row in _query(cur, f"""
+            SELECT quote_ident(n.nspname) AS name FROM pg_namespace n
+            WHERE {NAMESPACE_FILTER} AND n.nspname <> 'public' AND {_not_extension_member('pg_namespace', 'n.oid')}
+        """, params):
+            add("schema", row['name'], f"CREATE SCHEMA {row['name']}")
+
+        for row in _query(cur, f"""
+            SELECT format('%%I.%%I', n.nspname, t.typname) AS name, t.typtype,
+                   (SELECT string_agg(quote_literal(e.enumlabel), ', ' ORDER BY e.enumsortorder)
+                    FROM pg_enum e WHERE e.enumtypid = t.oid) AS labels,
+                   format_type(t.typbasetype, t.typtypmod) AS base, t.typnotnull, t.typdefault,
+                   (SELECT string_agg(format('CONSTRAINT %%I %%s', con.conname, pg_get_constraintdef(con.oid)),
+                                      ' ' ORDER BY con.conname)
+                    FROM pg_constraint con WHERE con.contypid = t.oid) AS checks
+            FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace
+            WHERE t.typtype IN ('e', 'd') AND {NAMESPACE_FILTER} AND {_not_extension_member('pg_type', 't.oid')}
+        """, params):
+            if row['typtype'] == 'e':
+                add("type", row['name'], f"CREATE TYPE {row['name']} AS ENUM ({row['labels'] or ''})")
+            else:
+                ddl = f"CREATE DOMAIN {row['name']} AS {row['base']}"
+                if row['typdefault'] is not None:
+                    ddl += f" DEFAULT {row['typdefault']}"
+                if row['typnotnull']:
+                    ddl += " NOT NULL"
+                if row['checks']:
+                    ddl += f" {row['checks']}"
+                add("domain", row['name'], ddl)
+
+        for row in _query(cur, f"""
+            SELECT format('%%I.%%I', n.nspname, c.relname) AS name, format_type(s.seqtypid, NULL) AS type,
+                   s.seqstart, s.seqincrement, s.seqmin, s.seqmax, s.seqcache, s.seqcycle
+            FROM pg_sequence s
+            JOIN pg_class c ON c.oid = s.seqrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE {NAMESPACE_FILTER} AND c.relname !~ %(excluded)s
+              AND NOT EXISTS (SELECT 1 FROM pg_depend dep WHERE dep.classid = 'pg_class'::regclass
+                              AND dep.objid = c.oid AND dep.deptype IN ('i', 'e'))
+        """, params):
+            add("sequence", row['name'],
+                f"CREATE SEQUENCE {row['name']} AS {row['type']} START WITH {row['seqstart']} "
+                f"INCREMENT BY {row['seqincrement']} MINVALUE {row['seqmin']} MAXVALUE {row['seqmax']} "
+                f"CACHE {row['seqcache']}{' CYCLE' if row['seqcycle'] else ''}")
+
+        tables = _query(cur, f"""
+            SELECT c.oid, format('%%I.%%I', n.nspname, c.relname) AS name, c.relkind, c.relpersistence,
+                   c.relispartition, pg_get_partkeydef(c.oid) AS partkey,
+                   pg_get_expr(c.relpartbound, c.oid) AS bound,
+                   (SELECT format('%%I.%%I', pn.nspname, p.relname)
+                    FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhparent
+                    JOIN pg_namespace pn ON pn.oid = p.relnamespace
+                    WHERE i.inhrelid = c.oid AND c.relispartition) AS parent
+            FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'p') AND {NAMESPACE_FILTER} AND c.relname !~ %(excluded)s
+              AND {_not_extension_member('pg_class', 'c.oid')}
+        """, params)
+        oids = [t['oid'] for t in tables]
+        params["oids"] = oids
+
+        columns = {}
+        for row in _query(cur, """
+            SELECT a.attrelid, quote_ident(a.attname) AS name, format_type(a.atttypid, a.atttypmod) AS type,
+                   a.attnotnull, a.attidentity, a.attgenerated, pg_get_expr(d.adbin, d.adrelid) AS default_expr,
+                   CASE WHEN a.attcollation <> t.typcollation THEN
+                       (SELECT format('%%I.%%I', cn.nspname, co.collname) FROM pg_collation co
+                        JOIN pg_namespace cn ON cn.oid = co.collnamespace WHERE co.oid = a.attcollation)
+                   END AS collation
+            FROM pg_attribute a
+            JOIN pg_type t ON t.oid = a.atttypid
+            LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+            WHERE a.attrelid = ANY(%(oids)s::oid[]) AND a.attnum > 0 AND NOT a.attisdropped AND a.attislocal
+            ORDER BY a.attrelid, a.attnum
+        """, params):
+            line = f"{row['name']} {row['type']}"
+            if row['collation']:
+                line += f" COLLATE {row['collation']}"
+            if row['attgenerated'] == 's':
+                line += f" GENERATED ALWAYS AS ({row['default_expr']}) STORED"
+            elif row['default_expr'] is not None:
+                line += f" DEFAULT {row['default_expr']}"
+            if row['attidentity']:
+                line += f" GENERATED {'ALWAYS' if row['attidentity'] == 'a' else 'BY DEFAULT'} AS IDENTITY"
+            if row['attnotnull']:
+                line += " NOT NULL"
+            columns.setdefault(row['attrelid'], []).append(line)
+
+        for table in tables:
+            unlogged = "UNLOGGED " if table['relpersistence'] == 'u' else ""
+            if table['relispartition'] and table['parent']:
+                ddl = f"CREATE {unlogged}TABLE {table['name']} PARTITION OF {table['parent']} {table['bound']}"
+            else:
+                body = ",\n".join(f"    {c}" for c in columns.get(table['oid'], []))
+                ddl = f"CREATE {unlogged}TABLE {table['name']} (\n{body}\n)"
+            if table['partkey']:
+                ddl += f" PARTITION BY {table['partkey']}"
+            add("table", table['name'], ddl)
+
+        for row in _query(cur, """
+            SELECT format('%%I.%%I', n.nspname, c.relname) AS tbl, quote_ident(con.conname) AS name,
+                   pg_get_constraintdef(con.oid) AS def
+            FROM pg_constraint con
+            JOIN pg_class c ON c.oid = con.conrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE con.conrelid = ANY(%(oids)s::oid[]) AND con.contype <> 'n' AND con.conparentid = 0
+              AND con.coninhcount = 0
+        """, params):
+            add("constraint", f"{row['tbl']}.{row['name']}",
+                f"ALTER TABLE ONLY {row['tbl']} ADD CONSTRAINT {row['name']} {row['def']}")
+
+        for row in _query(cur, """
+            SELECT format('%%I.%%I', n.nspname, ic.relname) AS name, pg_get_indexdef(i.indexrelid) AS def
+            FROM pg_index i
+            JOIN pg_class ic ON ic.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = ic.relnamespace
+            WHERE i.indrelid = ANY(%(oids)s::oid[]) AND NOT ic.relispartition
+              AND NOT EXISTS (SELECT 1 FROM pg_constraint con
+                              WHERE con.conindid = i.indexrelid AND con.contype IN ('p', 'u', 'x'))
+        """, params):
+            add("index", row['name'], row['def'])
+
+        for row in _query(cur, """
+            SELECT format('%%I.%%I.%%I', n.nspname, c.relname, t.tgname) AS name, pg_get_triggerdef(t.oid) AS def
+            FROM pg_trigger t
+            JOIN pg_class c ON c.oid = t.tgrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE t.tgrelid = ANY(%(oids)s::oid[]) AND NOT t.tgisinternal AND t.tgparentid = 0
+        """, params):
+            add("trigger", row['name'], row['def'])
+
+        for row in _query(cur, f"""
+            SELECT format('%%I.%%I', n.nspname, c.relname) AS name, c.relkind, pg_get_viewdef(c.oid) AS def
+            FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('v', 'm') AND {NAMESPACE_FILTER} AND {_not_extension_member('pg_class', 'c.oid')}
+        """, params):
+            body = row['def'].strip().rstrip(";")
+            if row['relkind'] == 'v':
+                add("view", row['name'], f"CREATE VIEW {row['name']} AS\n{body}")
+            else:
+                add("materialized-view", row['name'], f"CREATE MATERIALIZED VIEW {row['name']} AS\n{body}\nWITH NO DATA")
+
+        for row in _query(cur, f"""
+            SELECT format('%%I.%%I(%%s)', n.nspname, p.proname, pg_get_function_identity_arguments(p.oid)) AS name,
+                   pg_get_functiondef(p.oid) AS def
+            FROM pg_proc p JOIN pg_namespace n ON n.oid = p.pronamespace
+            WHERE p.prokind IN ('f', 'p') AND {NAMESPACE_FILTER} AND {_not_extension_member('pg_proc', 'p.oid')}
+        """, params):
+            add("function", row['name'], row['def'])
+    conn.commit()
+    return objects
+
+def _sort_key(key):
+    kind, name = key
+    return (KIND_ORDER.index(kind) if kind in KIND_ORDER else len(KIND_ORDER), name)
+
+def render(objects: Snapshot) -> str:
+    """Deterministic dump text: sections in KIND_ORDER, objects sorted by name."""
+    parts = [f"{DUMP_HEADER}\n-- Generated by 'pgmigrate dump'. Objects are sorted by kind, then name.\n"]
+    for key in sorted(objects, key=_sort_key):
+        obj = objects[key]
+        parts.append(f"-- object: {obj.kind} {obj.name}\n{obj.ddl};\n")
+    return "\n".join(parts)
+
+def is_native_dump(text: str) -> bool:
+    return text.startswith(DUMP_HEADER)
+
+def parse_dump(text: str) -> Snapshot:
+    """Reads a file written by render() back into objects."""
+    objects: Snapshot = {}
+    headers = list(OBJECT_HEADER_REGEX.finditer(text))
+    for i, match in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        ddl = text[match.end():end].strip().rstrip(";").strip()
+        objects[(match.group(1), match.group(2))] = SchemaObject(match.group(1), match.group(2), ddl)
+    return objects
+
+def _normalize(ddl: str) -> str:
+    return re.sub(r"\s+", " ", ddl).strip()
+
+@dataclass
+class Drift:
+    kind: str
+    name: str
+    change: str                    # 'added' (only in database), 'removed' (only in file), 'changed'
+    diff: Optional[List[str]] = None
+
+def diff_snapshots(expected: Snapshot, actual: Snapshot) -> List[Drift]:
+    """Object-by-object differences between a snapshot (EXPECTED) and the live database (ACTUAL)."""
+    drift = []
+    for key in sorted(set(expected) | set(actual), key=_sort_key):
+        before, after = expected.get(key), actual.get(key)
+        if before is None:
+            drift.append(Drift(*key, "added"))
+        elif after is None:
+            drift.append(Drift(*key, "removed"))
+        elif _normalize(before.ddl) != _normalize(after.ddl):
+            lines = list(difflib.unified_diff(before.ddl.splitlines(), after.ddl.splitlines(),
+                                              "file", "database", lineterm="", n=1))
+            drift.append(Drift(*key, "changed", lines[2:]))
+    return drift
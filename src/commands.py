@@ -4,9 +4,31 @@ import sys
 import click
 import datetime
 import secrets
+import random
+import time
+import dataclasses
 import psycopg2
-from .db import Database
-from .utils import get_migrations
+from .config import RunConfig, DEFAULT_LOCK_RETRIES, LOCK_RETRY_BASE_DELAY, LOCK_RETRY_MAX_DELAY
+from .db import Database, LOCK_MODES, url_for_database, create_database, drop_database
+from .backfill import run_backfill
+from .catalog import introspect, render, is_native_dump, parse_dump, diff_snapshots
+from .lint import lint_scripts, print_findings, format_bytes
+from .progress import (INVALID_INDEX_POLICIES, load_progress, save_progress,
+                       clear_progress, invalid_indexes, repair_invalid_index)
+from .scheduler import plan_dependencies, run_graph, DependencyError
+from .baseline import read_baseline, write_baseline, baseline_mismatches, database_is_empty, load_baseline
+from .executor import ExecutionLog, execute_script, error_location
+from .monitor import EventStream
+from .throttle import ReplicationThrottle, format_lag
+from .blockers import BLOCKER_POLICIES, preflight
+from .splitter import split_statements
+from .metadata import (SCHEMA_MIGRATIONS_DDL, create_metadata, upgrade_metadata, record_applied, record_reverted,
+                       read_fingerprint, read_applied_versions, save_fingerprint, clear_fingerprint)
+from .fanout import load_targets, run_targets, print_report, target_label
+from .tenants import expand_tenants, ensure_tenant_metadata
+from .budget import Budget, BudgetExhausted, load_estimates, time_left
+from .rehearsal import RehearsalLog, clone_with_template, clone_with_dump, describe_size_change, short_mode
+from .utils import get_migrations, checksum_cache, strip_transaction_wrapper, migration_fingerprint, BASELINE_FILENAME
 
 # Helper to get DB URL from env
 def get_db_url():
@@ -36,20 +58,13 @@ def init():
         with conn:
             with conn.cursor() as cur:
                 click.echo("Checking database connection...")
-                cur.execute("SELECT to_regclass('public.schema_migrations');")
+                cur.execute("SELECT to_regclass('schema_migrations');")
                 if cur.fetchone()['to_regclass']:
                     click.echo("ℹ️  Table 'schema_migrations' already exists.")
                 else:
-                    cur.execute("""
-                        CREATE TABLE schema_migrations (
-                            version VARCHAR(255) PRIMARY KEY,
-                            name VARCHAR(255) NOT NULL,
-                            checksum VARCHAR(64) NOT NULL,
-                            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            batch INTEGER NOT NULL DEFAULT 1
-                        );
-                    """)
+                    cur.execute(SCHEMA_MIGRATIONS_DDL)
                     click.echo("✅ Created table 'schema_migrations'.")
+        upgrade_metadata(conn, click.echo)
     except Exception as e:
         click.secho(f"❌ Error: {e}", fg="red")
     finally:
@@ -57,15 +72,18 @@ def init():
 
 @cli.command()
 @click.argument('name')
-def make(name):
+@click.option('--subdir', default=None, help="Folder under migrations/ to create the pair in (e.g. 2025).")
+def make(name, subdir):
     """Generates a new migration file pair."""
     timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d%H%M%S")
     suffix = secrets.token_hex(2)
     safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_")
     base_filename = f"{timestamp}_{suffix}_{safe_name}"
     
-    up_file = os.path.join("migrations", f"{base_filename}.up.sql")
-    down_file = os.path.join("migrations", f"{base_filename}.down.sql")
+    directory = os.path.join("migrations", subdir) if subdir else "migrations"
+    os.makedirs(directory, exist_ok=True)
+    up_file = os.path.join(directory, f"{base_filename}.up.sql")
+    down_file = os.path.join(directory, f"{base_filename}.down.sql")
     
     with open(up_file, 'w') as f:
         f.write("-- SQL for 'up' migration\n")
@@ -89,6 +107,9 @@ def list_files():
         return
 
     sorted_keys = sorted(migrations.keys())
+    checksum_cache.warm(p for m in migrations.values() for p in m.checksum_paths())
+    checksum_cache.save()
+
     print(f"{'VERSION':<25} | {'STATUS':<10} | {'CHECKSUM (UP)':<15}")
     print("-" * 65)
     for version in sorted_keys:
@@ -99,16 +120,208 @@ def list_files():
         short_hash = m.up_checksum[:8] if m.up_checksum else "------"
         print(f"{version:<25} | {status:<10} | {short_hash}")
 
+def target_options(f):
+    """Adds the multi-database and tenant options shared by up, down and status."""
+    f = click.option('--tenant-query', default=None,
+                     help="Tenant mode: SQL returning one tenant schema name per row.")(f)
+    f = click.option('--tenants', 'tenant_pattern', default=None,
+                     help="Tenant mode: run once per schema matching this LIKE pattern (e.g. 'tenant_%'), "
+                          "with search_path set to it and its own schema_migrations.")(f)
+    f = click.option('--parallel', '-j', type=int, default=None,
+                     help="Max targets processed at once (default: min(8, targets)).")(f)
+    f = click.option('--targets-file', type=click.Path(exists=True, dir_okay=False),
+                     help="File with one database URL per line.")(f)
+    f = click.option('--target', 'targets', multiple=True,
+                     help="Database URL to run against (repeatable). Defaults to DATABASE_URL.")(f)
+    return f
+
+def run_for_targets(task, targets, targets_file, parallel, tenant_pattern=None, tenant_query=None):
+    """
+    Runs task(db_url, echo) against DATABASE_URL, or fans it out
+    concurrently when one or more targets (or tenant schemas) were given.
+    """
+    urls = load_targets(targets, targets_file)
+    tenant_mode = bool(tenant_pattern or tenant_query)
+    if tenant_mode:
+        try:
+            urls = expand_tenants(urls or [get_db_url()], tenant_pattern, tenant_query)
+        except psycopg2.Error as e:
+            raise click.ClickException(f"Could not list tenant schemas: {e}")
+        if not urls:
+            click.echo("ℹ️  No tenant schemas matched.")
+            return
+    elif not urls:
+        try:
+            task(get_db_url(), click.secho)
+        except click.UsageError:
+            raise
+        except Exception as e:
+            click.secho(f"\n❌ Error: {e}", fg="red")
+            sys.exit(1)
+        return
+
+    click.echo(f"🌐 Running against {len(urls)} {'tenant schemas' if tenant_mode else 'targets'}...")
+    started = time.monotonic()
+    results = run_targets(urls, task, parallel)
+    # Thousands of tenants: list the failures, not every success
+    print_report(results, time.monotonic() - started, failures_only=tenant_mode)
+    if not all(r.ok for r in results):
+        sys.exit(1)
+
+def lock_options(f):
+    """Adds the lock timeout, lock mode and blocker options shared by up and down."""
+    f = click.option('--lock-mode', type=click.Choice(LOCK_MODES), default=None,
+                     help="session: advisory lock, needs a direct or session-pooled connection (default). "
+                          "lease: heartbeated lease row, works through transaction poolers like PgBouncer "
+                          "(env: PGMIGRATE_LOCK_MODE).")(f)
+    f = click.option('--blocker-timeout', default="60s", show_default=True,
+                     help="How long --blockers wait/terminate wait for blockers to go away (0: forever).")(f)
+    f = click.option('--blocker-min-age', default="5s", show_default=True,
+                     help="Only count sessions whose transaction (or query) is at least this old as blockers.")(f)
+    f = click.option('--blockers', 'blocker_policy', type=click.Choice(BLOCKER_POLICIES), default="warn",
+                     show_default=True,
+                     help="Before each migration, look for sessions holding or queued for conflicting locks "
+                          "on its tables and warn, wait for them, abort, or terminate them.")(f)
+    f = click.option('--lock-retries', type=int, default=DEFAULT_LOCK_RETRIES, show_default=True,
+                     help="Retries (with jittered exponential backoff) after a lock timeout.")(f)
+    f = click.option('--lock-timeout', default=None,
+                     help="lock_timeout for migration SQL, e.g. 2s (env: PGMIGRATE_LOCK_TIMEOUT). "
+                          "Overridden per file by '-- migration: lock-timeout=...'.")(f)
+    return f
+
+def throttle_options(f):
+    """Adds the replication lag options shared by up and down."""
+    f = click.option('--replica-lag-timeout', default=None,
+                     help="Fail if lag stays above --max-replica-lag this long (default: wait indefinitely).")(f)
+    f = click.option('--replica', 'replicas', multiple=True,
+                     help="Standby URL to measure lag on directly (repeatable). "
+                          "Default: pg_stat_replication on the primary.")(f)
+    f = click.option('--max-replica-lag', default=None,
+                     help="Pause between migrations, committed statements and backfill chunks "
+                          "while replica replay lag is above this, e.g. 5s.")(f)
+    return f
+
+def report_options(f):
+    """Adds the statement timing and progress options shared by up and down."""
+    f = click.option('--events', 'events_path', type=click.Path(dir_okay=False),
+                     help="Append a JSON-lines event stream (migration/statement/progress events) to this file.")(f)
+    f = click.option('--progress-interval', default="5s", show_default=True,
+                     help="How often to report live progress of a running statement (0 to turn off).")(f)
+    f = click.option('--report', 'report_path', type=click.Path(dir_okay=False),
+                     help="Write a JSON run report with per-statement timings. "
+                          "Use '{target}' in the path when running against several targets.")(f)
+    f = click.option('--verbose', '-v', is_flag=True,
+                     help="Show each statement's timing and row count as it runs.")(f)
+    return f
+
+def build_config(**options):
+    try:
+        return RunConfig.from_options(**options)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
 @cli.command()
 @click.option('--dry-run', is_flag=True, help="Simulate without running SQL.")
-def up(dry_run):
+@click.option('--single-transaction', is_flag=True,
+              help="Apply consecutive transactional migrations in one transaction.")
+@click.option('--backfill-sleep', default=None,
+              help="Pause between backfill chunks, e.g. 200ms (overrides the file's sleep=).")
+@click.option('--no-baseline', is_flag=True,
+              help="Replay every migration even if a squashed baseline exists.")
+@click.option('--no-fast-check', is_flag=True,
+              help="Always take the lock and compare every migration, even if the stored fingerprint matches.")
+@click.option('--invalid-index', type=click.Choice(INVALID_INDEX_POLICIES), default="drop", show_default=True,
+              help="What to do with an INVALID index left by a failed CREATE INDEX CONCURRENTLY before resuming.")
+@click.option('--concurrency', type=click.IntRange(min=1), default=1, show_default=True,
+              help="Max no-transaction migrations applied at once, each on its own connection. "
+                   "Order is taken from '-- depends-on:' headers.")
+@click.option('--budget', default=None,
+              help="Only apply the migrations whose estimated durations fit in this much time, e.g. 30m.")
+@click.option('--window', default=None,
+              help="Maintenance window in local time, e.g. 02:00-04:00. Outside it nothing is applied; "
+                   "inside it the run must finish by its end.")
+@click.option('--estimates-from', 'estimate_sources', multiple=True,
+              help="JSON run report (--report, rehearse) or database URL of another environment whose "
+                   "recorded durations estimate pending migrations (repeatable).")
+@click.option('--default-estimate', default="1m", show_default=True,
+              help="Estimate for migrations with no recorded duration.")
+@lock_options
+@throttle_options
+@report_options
+@target_options
+def up(dry_run, single_transaction, backfill_sleep, no_baseline, no_fast_check, invalid_index, concurrency,
+       budget, window, estimate_sources, default_estimate,
+       lock_timeout, lock_retries, lock_mode, blocker_policy, blocker_min_age, blocker_timeout,
+       max_replica_lag, replicas, replica_lag_timeout,
+       verbose, report_path, progress_interval, events_path,
+       targets, targets_file, parallel, tenant_pattern, tenant_query):
     """Applies all pending migrations."""
-    db = Database(get_db_url())
+    config = build_config(dry_run=dry_run, single_transaction=single_transaction,
+                          backfill_sleep=backfill_sleep, use_baseline=not no_baseline,
+                          fast_check=not no_fast_check, concurrency=concurrency, invalid_index=invalid_index,
+                          budget=budget, window=window, estimate_sources=estimate_sources,
+                          default_estimate=default_estimate,
+                          lock_timeout=lock_timeout, lock_retries=lock_retries,
+                          lock_mode=lock_mode, blocker_policy=blocker_policy, blocker_min_age=blocker_min_age,
+                          blocker_timeout=blocker_timeout,
+                          max_replica_lag=max_replica_lag, replica_urls=replicas,
+                          replica_lag_timeout=replica_lag_timeout,
+                          verbose=verbose, report_path=report_path,
+                          progress_interval=progress_interval, events_path=events_path)
+    tenant_mode = bool(tenant_pattern or tenant_query)
+    if tenant_mode:
+        # A squashed baseline is a pg_dump of public; tenants always replay migrations
+        config = dataclasses.replace(config, use_baseline=False)
+
+    def task(url, echo):
+        # New tenants have no schema_migrations yet
+        if tenant_mode and not dry_run:
+            ensure_tenant_metadata(url)
+        return run_up(url, config, echo)
+
+    run_for_targets(task, targets, targets_file, parallel, tenant_pattern, tenant_query)
+
+def run_up(db_url, config=None, echo=click.secho, log=None):
+    """
+    Applies all pending migrations to one database. Raises on failure.
+    Returns the versions that were applied. LOG replaces the run's own
+    ExecutionLog, e.g. to measure each migration (see rehearse).
+    """
+    config = config or RunConfig()
+    dry_run = config.dry_run
+    log = log or open_log(db_url, config, echo, "up")
+    error = None
+    db = Database(db_url, config.lock_mode)
     try:
+        local_migrations = get_migrations(config.migrations_dir)
+        # Pending scripts read for their checksum keep their text for load(), so each is read once.
+        # Which are pending is settled under the lock; a stale guess only costs a second read.
+        applied = read_applied_versions(db.get_conn())
+        checksum_cache.warm((p for m in local_migrations.values() for p in m.checksum_paths()),
+                            scripts=[m.up_path for v, m in local_migrations.items() if v not in applied])
+        fingerprint = migration_fingerprint(local_migrations)
+
+        # Fast path: one lock-free query answers "nothing to do" for most runs
+        if config.fast_check and not dry_run and read_fingerprint(db.get_conn()) == fingerprint:
+            echo("✅ Database is up to date.")
+            return []
+
+        # --budget / --window: the clock starts before waiting for the lock
+        started = time.monotonic()
+        seconds = time_left(config.budget_ms, config.window)
+        if config.window and seconds == 0:
+            echo(f"🌙 Outside the maintenance window {config.window} (local time); nothing applied.", fg="yellow")
+            return []
+
         if not dry_run:
             db.acquire_lock()
+            log.lock_wait_ms = db.lock_wait_ms
+            log.lease = db.lease
+            if config.fast_check and read_fingerprint(db.get_conn()) == fingerprint:
+                echo("✅ Database is up to date (migrated by another process while waiting for the lock).")
+                return []
+            upgrade_metadata(db.get_conn(), echo)
         conn = db.get_conn()
-        local_migrations = get_migrations()
         
         applied_migrations = {}
         max_applied_batch = 0
@@ -125,7 +338,7 @@ def up(dry_run):
             if version not in local_migrations:
                 raise click.ClickException(f"❌ Missing file for applied migration: {version}")
             if local_migrations[version].up_checksum != row['checksum']:
-                click.echo(f"❌ FATAL: Checksum mismatch for {version}")
+                echo(f"❌ FATAL: Checksum mismatch for {version}")
                 raise click.ClickException("Migration history has been altered. Aborting.")
 
         # Planning
@@ -134,57 +347,157 @@ def up(dry_run):
         last_applied_version = list(applied_migrations.keys())[-1] if applied_migrations else ""
         
         for version in all_local_versions:
+            if config.stop_before and version >= config.stop_before:
+                break
             if version not in applied_migrations:
                 if version < last_applied_version:
-                    click.secho(f"⚠️  Warning: Detected out-of-order migration: {version}", fg="yellow")
+                    echo(f"⚠️  Warning: Detected out-of-order migration: {version}", fg="yellow")
                 pending.append(local_migrations[version])
 
         if not pending:
-            click.echo("✅ Database is up to date.")
-            return
+            if not dry_run:
+                save_fingerprint(conn)
+            echo("✅ Database is up to date.")
+            return []
 
         next_batch = max_applied_batch + 1
-        click.echo(f"🚀 Found {len(pending)} pending migrations. Batch ID: {next_batch}")
+        echo(f"🚀 Found {len(pending)} pending migrations. Batch ID: {next_batch}")
+        if not dry_run:
+            clear_fingerprint(conn)
+
+        # Fresh databases can skip replaying history by loading a squashed baseline
+        baseline = None
+        if config.use_baseline and not applied_migrations:
+            baseline = usable_baseline(conn, local_migrations, config, echo)
+        if baseline:
+            if dry_run:
+                echo(f"[Dry Run] Would load baseline covering {len(baseline.covers)} migrations "
+                     f"(up to {baseline.last_version})", fg="cyan")
+            else:
+                log.announce(f"Loading baseline ({len(baseline.covers)} migrations up to {baseline.last_version})...")
+                load_baseline(conn, baseline, local_migrations, next_batch, log)
+                log.conclude(" Done.")
+            pending = [m for m in pending if m.version not in baseline.covers]
 
+        steps = []  # Each step is a list of MigrationScripts applied together
         for migration in pending:
             if not migration.up_path:
                  raise click.ClickException(f"Missing .up.sql for {migration.version}")
+            steps.append([migration.load("up")])
 
-            with open(migration.up_path, 'r') as f:
-                sql_content = f.read()
+        if config.single_transaction:
+            steps = group_single_transaction(steps, echo)
+        if seconds is not None:
+            log.budget = Budget(seconds, load_estimates(conn, config.estimate_sources), config.default_estimate_ms,
+                                statement_timeout=config.lock_mode == "session", started=started)
+            steps = plan_budget(steps, log.budget, echo)
+            if not steps:
+                if not dry_run:
+                    save_fingerprint(conn)
+                return []
+        try:
+            deps = plan_dependencies(steps, applied_migrations)
+        except DependencyError as e:
+            raise click.ClickException(str(e))
 
-            no_transaction_mode = "-- migration: no-transaction" in sql_content.lower()
+        if dry_run:
+            for step in steps:
+                describe_step(step, echo)
+            findings = lint_scripts([script for step in steps for script in step], conn)
+            if findings:
+                echo(f"🔍 Lint found {len(findings)} issue(s) in pending migrations:")
+                print_findings(findings, echo)
+            errors = [f for f in findings if f.severity == "error"]
+            if errors:
+                raise click.ClickException(f"{len(errors)} pending migration statement(s) will fail.")
+        elif config.concurrency > 1:
+            # Close the planning transaction: CREATE INDEX CONCURRENTLY on the
+            # worker connections would otherwise wait for it forever
+            conn.commit()
 
-            if dry_run:
-                click.secho(f"[Dry Run] Would apply: {migration.version} ({'No-Tx' if no_transaction_mode else 'Tx'})", fg="cyan")
-                continue
+            def run_parallel(step):
+                script = step[0]
+                worker_echo = lambda message="", fg=None, nl=True: echo(f"   [{script.version}] {message}", fg=fg)
+                worker_log = log.fork(worker_echo)
+                worker_log.pace()
+                worker = Database(db_url)
+                try:
+                    if worker_log.budget is not None:
+                        worker_log.budget.admit(step)
+                    echo(f"⇉ Applying {script.version} on its own connection...")
+                    check_blockers(worker.get_conn(), [script], config, worker_log)
+                    apply_no_transaction(worker.get_conn(), local_migrations[script.version], script.sql,
+                                         next_batch, session_lock_timeout(script, config, worker_log), worker_log,
+                                         config.invalid_index)
+                finally:
+                    worker.close()
+                echo(f"✅ {script.version} done in {format_ms(worker_log.records_for(script.version).duration_ms)}.")
 
-            print(f"Applying {migration.version}...", end=" ", flush=True)
-            if no_transaction_mode:
-                apply_no_transaction(conn, migration, sql_content, next_batch)
-            else:
-                apply_standard(conn, migration, sql_content, next_batch)
-            print("Done.")
+            try:
+                run_graph(steps, deps, config.concurrency, runs_in_parallel,
+                          lambda step: apply_step(conn, step, local_migrations, next_batch, config, log, echo),
+                          run_parallel)
+            except BudgetExhausted as e:
+                log.line(f"⏳ {e}", fg="yellow")
+        else:
+            try:
+                for step in steps:
+                    apply_step(conn, step, local_migrations, next_batch, config, log, echo)
+            except BudgetExhausted as e:
+                log.line(f"⏳ {e}", fg="yellow")
+
+        if not dry_run:
+            save_fingerprint(conn)
+        report_run_summary(log)
+        return [r.version for r in log.records if r.direction == "up" and r.status == "ok"]
 
     except Exception as e:
-        click.secho(f"\n❌ Error: {e}", fg="red")
-        sys.exit(1)
+        error = e
+        log.fail_running(e)
+        raise
     finally:
         if not dry_run:
             try: db.release_lock()
             except: pass
         db.close()
+        checksum_cache.save()
+        close_log(log, config, db_url, error)
 
 @cli.command()
 @click.option('--dry-run', is_flag=True, help="Simulate without running SQL.")
-def down(dry_run):
+@lock_options
+@throttle_options
+@report_options
+@target_options
+def down(dry_run, lock_timeout, lock_retries, lock_mode, blocker_policy, blocker_min_age, blocker_timeout,
+         max_replica_lag, replicas, replica_lag_timeout,
+         verbose, report_path, progress_interval, events_path,
+         targets, targets_file, parallel, tenant_pattern, tenant_query):
     """Reverts the last batch of migrations."""
-    db = Database(get_db_url())
+    config = build_config(dry_run=dry_run, lock_timeout=lock_timeout, lock_retries=lock_retries,
+                          lock_mode=lock_mode, blocker_policy=blocker_policy, blocker_min_age=blocker_min_age,
+                          blocker_timeout=blocker_timeout, max_replica_lag=max_replica_lag, replica_urls=replicas,
+                          replica_lag_timeout=replica_lag_timeout,
+                          verbose=verbose, report_path=report_path,
+                          progress_interval=progress_interval, events_path=events_path)
+    run_for_targets(lambda url, echo: run_down(url, config, echo), targets, targets_file, parallel,
+                    tenant_pattern, tenant_query)
+
+def run_down(db_url, config=None, echo=click.secho):
+    """Reverts the last batch of migrations on one database. Raises on failure."""
+    config = config or RunConfig()
+    dry_run = config.dry_run
+    log = open_log(db_url, config, echo, "down")
+    error = None
+    db = Database(db_url, config.lock_mode)
     try:
         if not dry_run:
             db.acquire_lock()
+            log.lock_wait_ms = db.lock_wait_ms
+            log.lease = db.lease
+            upgrade_metadata(db.get_conn(), echo)
         conn = db.get_conn()
-        local_migrations = get_migrations()
+        local_migrations = get_migrations(config.migrations_dir)
         
         # 1. Identify what to revert (Last Batch)
         to_revert = []
@@ -196,7 +509,7 @@ def down(dry_run):
             current_batch = res['max'] if res and res['max'] else 0
             
             if current_batch == 0:
-                click.echo("Nothing to revert (database is empty).")
+                echo("Nothing to revert (database is empty).")
                 return
 
             cur.execute("""
@@ -207,195 +520,498 @@ def down(dry_run):
             """, (current_batch,))
             to_revert = cur.fetchall()
 
-        click.echo(f"📉 Reverting Batch {current_batch} ({len(to_revert)} migrations)")
+        echo(f"📉 Reverting Batch {current_batch} ({len(to_revert)} migrations)")
+        if not dry_run:
+            clear_fingerprint(conn)
 
         # 2. Revert Loop
         for row in to_revert:
             version = row['version']
             if version not in local_migrations:
-                click.secho(f"❌ Error: Cannot revert {version}. File not found locally.", fg="red")
-                raise click.Abort()
+                raise click.ClickException(f"Cannot revert {version}. File not found locally.")
                 
             migration = local_migrations[version]
             if not migration.down_path:
-                click.secho(f"❌ Error: Migration {version} has no .down.sql file.", fg="red")
-                raise click.Abort()
+                raise click.ClickException(f"Migration {version} has no .down.sql file.")
 
-            with open(migration.down_path, 'r') as f:
-                sql_content = f.read()
-                
-            no_transaction_mode = "-- migration: no-transaction" in sql_content.lower()
+            script = migration.load("down")
             
             if dry_run:
-                click.secho(f"[Dry Run] Would revert: {version} ({'No-Tx' if no_transaction_mode else 'Tx'})", fg="cyan")
+                echo(f"[Dry Run] Would revert: {version} ({'No-Tx' if script.no_transaction else 'Tx'})", fg="cyan")
                 continue
 
-            print(f"Reverting {version}...", end=" ", flush=True)
-            if no_transaction_mode:
-                revert_no_transaction(conn, version, sql_content)
+            log.pace()
+            check_blockers(conn, [script], config, log)
+            log.announce(f"Reverting {version}...")
+            timeout_ms = script.lock_timeout_ms or config.lock_timeout_ms
+            if script.no_transaction:
+                revert_no_transaction(conn, version, script.sql, session_lock_timeout(script, config, log), log)
+                tries = 1
             else:
-                revert_standard(conn, version, sql_content)
-            print("Done.")
+                tries = with_lock_retries(
+                    lambda: revert_standard(conn, version, script.sql, timeout_ms, log), config, log)
+            log.conclude(done_message(tries))
+
+        if not dry_run:
+            save_fingerprint(conn)
+        report_run_summary(log)
 
     except Exception as e:
-        click.secho(f"\n❌ Error: {e}", fg="red")
-        sys.exit(1)
+        error = e
+        log.fail_running(e)
+        raise
     finally:
         if not dry_run:
             try: db.release_lock()
             except: pass
         db.close()
+        close_log(log, config, db_url, error)
 
 # --- Helpers ---
 
-def apply_standard(conn, migration, sql_content, batch_id):
+class LockTimeoutError(Exception):
+    """Migration SQL gave up waiting for a lock (SQLSTATE 55P03)."""
+
+def set_lock_timeout(cur, timeout_ms, local=True):
+    """Applies lock_timeout to the current transaction (or the session if local=False)."""
+    if timeout_ms:
+        scope = "LOCAL " if local else ""
+        cur.execute(f"SET {scope}lock_timeout = %s", (f"{timeout_ms}ms",))
+
+def session_lock_timeout(script, config, log):
+    """
+    lock_timeout for a no-transaction script, which has to be SET for the session.
+    Behind a transaction pooler (--lock-mode lease) that SET would stick to
+    whichever backend served it, so it is left out there.
+    """
+    timeout_ms = script.lock_timeout_ms or config.lock_timeout_ms
+    if timeout_ms and config.lock_mode == "lease":
+        log.line(f"   ⚠️  lock-timeout is not applied to no-transaction {script.version} with --lock-mode lease; "
+                 f"set lock_timeout on the database role instead.", fg="yellow")
+        return None
+    return timeout_ms
+
+def with_lock_retries(apply_fn, config, log):
+    """
+    Calls apply_fn, retrying with full-jitter exponential backoff while it
+    fails on lock_timeout. Returns the number of attempts it took.
+    """
+    attempt = 1
+    while True:
+        try:
+            apply_fn()
+            return attempt
+        except LockTimeoutError as e:
+            if attempt > config.lock_retries:
+                raise Exception(f"{e} (gave up after {attempt} attempts)")
+            delay = random.uniform(0, min(LOCK_RETRY_MAX_DELAY, LOCK_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+            log.announce(f" lock timeout, retrying in {delay:.1f}s...")
+            time.sleep(delay)
+            attempt += 1
+
+def done_message(attempts):
+    return " Done." if attempts == 1 else f" Done ({attempts} attempts)."
+
+def report_run_summary(log):
+    """Summarizes lock retries, replica lag pauses and, when verbose, the slowest statements of the run."""
+    retried = [r for r in log.records if r.attempts > 1]
+    if retried:
+        log.echo(f"🔁 {len(retried)} migration(s) needed lock retries:", fg="yellow")
+        for record in retried:
+            log.echo(f"   {record.version}: {record.attempts} attempts", fg="yellow")
+
+    throttle = log.throttle
+    if throttle is not None and throttle.pauses:
+        log.echo(f"⏸  Paused {throttle.pauses} time(s) for {format_ms(throttle.paused_ms)} waiting for replicas "
+                 f"(max lag seen {format_lag(throttle.max_seen_ms)}).", fg="yellow")
+    elif throttle is not None and log.verbose:
+        log.echo(f"↔️  Max replica lag seen: {format_lag(throttle.max_seen_ms)}.")
+
+    if log.verbose and log.records:
+        log.echo("🐢 Slowest statements:")
+        for duration_ms, version, stmt in log.slowest_statements():
+            log.echo(f"   {duration_ms:>9.1f} ms  {version} line {stmt.line}: {stmt.sql}")
+
+def open_log(db_url, config, echo, command):
+    """The ExecutionLog for one run, wired to live progress and the --events stream."""
+    log = ExecutionLog(echo, config.verbose)
+    log.target = target_label(db_url)
+    if not config.dry_run:
+        log.monitor_url = db_url
+        log.progress_interval_ms = config.progress_interval_ms
+        if config.events_path:
+            log.events = EventStream(config.events_path)
+        if config.max_replica_lag_ms is not None:
+            log.throttle = ReplicationThrottle(db_url, config.max_replica_lag_ms, config.replica_urls,
+                                               config.replica_lag_timeout_ms)
+    log.emit("run_started", command=command)
+    return log
+
+def close_log(log, config, db_url, error=None):
+    """Writes the run report and the final event."""
+    if config.report_path and not config.dry_run:
+        write_report(log, config.report_path, db_url, error)
+    log.emit("run_finished", status="failed" if error else "ok", error=str(error) if error else None,
+             applied=[r.version for r in log.records if r.status == "ok"])
+    if log.events is not None:
+        log.events.close()
+    if log.throttle is not None:
+        log.throttle.close()
+
+def write_report(log, path, db_url, error=None):
+    """Writes the JSON run report. '{target}' in the path is replaced per database."""
+    label = target_label(db_url)
+    safe_label = "".join(c if c.isalnum() else "_" for c in label).strip("_")
+    log.write(path.replace("{target}", safe_label), target=label, error=error)
+
+def apply_standard(conn, migration, sql_content, batch_id, lock_timeout_ms=None, log=None):
+    log = log or ExecutionLog()
+    log.begin(migration.version, "up", "tx")
     try:
         with conn:
             with conn.cursor() as cur:
-                cur.execute(sql_content)
-                cur.execute("""
-                    INSERT INTO schema_migrations (version, name, checksum, applied_at, batch)
-                    VALUES (%s, %s, %s, NOW(), %s)
-                """, (migration.version, migration.name, migration.up_checksum, batch_id))
+                set_lock_timeout(cur, lock_timeout_ms)
+                execute_script(cur, sql_content, log, data_dir=migration.data_path)
+                record_applied(cur, [(migration.version, migration.name, migration.up_checksum,
+                                      batch_id, log.elapsed_ms(), "tx")],
+                               log.lock_wait_ms, log.applied_by)
+    except psycopg2.errors.LockNotAvailable as e:
+        raise LockTimeoutError(f"Lock timeout in {migration.version}{error_location(e)}: {e.pgerror}")
     except psycopg2.Error as e:
-        raise Exception(f"Migration failed in transaction: {e.pgerror}")
+        raise Exception(f"Migration failed in transaction{error_location(e)}: {e.pgerror}")
+    log.end({migration.version})
+
+def describe_step(step, echo):
+    """Dry-run line for one step."""
+    if len(step) > 1:
+        echo(f"[Dry Run] Would apply in one transaction: {', '.join(script.version for script in step)}", fg="cyan")
+        return
+    script = step[0]
+    mode = 'Backfill' if script.backfill else 'No-Tx' if script.no_transaction else 'Tx'
+    after = f", after {', '.join(script.depends_on)}" if script.depends_on else ""
+    echo(f"[Dry Run] Would apply: {script.version} ({mode}{after})", fg="cyan")
+
+def check_blockers(conn, scripts, config, log):
+    """Pre-flight check for sessions in the way of SCRIPTS' locks, per --blockers."""
+    preflight(conn, scripts, config.blocker_policy, log, config.blocker_min_age_ms, config.blocker_timeout_ms)
+
+def plan_budget(steps, budget, echo):
+    """The leading STEPS whose estimates fit in the time left; reports what is deferred."""
+    fit = budget.fitting(steps)
+    planned = sum(budget.estimate_ms(step) for step in steps[:fit])
+    left = format_ms(budget.remaining_ms())
+    if fit == len(steps):
+        echo(f"⏳ Estimated {format_ms(planned)} for {len(steps)} step(s), {left} left.")
+    else:
+        deferred = steps[fit]
+        echo(f"⏳ Estimated {format_ms(planned)} for {fit} of {len(steps)} step(s), {left} left. Deferring "
+             f"{deferred[0].version} (est. {format_ms(budget.estimate_ms(deferred))}) and later to another run.",
+             fg="yellow")
+    return steps[:fit]
+
+def runs_in_parallel(step):
+    """Only standalone no-transaction migrations may overlap with others."""
+    return len(step) == 1 and step[0].no_transaction and not step[0].backfill
+
+def apply_step(conn, step, local_migrations, next_batch, config, log, echo):
+    """Applies one step on the run's main connection."""
+    log.pace()
+    if log.budget is not None:
+        log.budget.admit(step)
+    if not step[0].backfill:
+        check_blockers(conn, step, config, log)
+    if len(step) > 1:
+        versions = [script.version for script in step]
+        log.announce(f"Applying {len(step)} migrations in one transaction ({versions[0]} .. {versions[-1]})...")
+        tries = with_lock_retries(
+            lambda: apply_single_transaction(conn, step, local_migrations, next_batch, config, log), config, log)
+        log.conclude(done_message(tries))
+        return
+
+    script = step[0]
+    migration = local_migrations[script.version]
+    timeout_ms = script.lock_timeout_ms or config.lock_timeout_ms
+    if script.backfill:
+        echo(f"Backfilling {script.version} in chunks...")
+        log.begin(script.version, "up", "backfill")
+        run_backfill(conn, migration, script, next_batch, log, echo,
+                     config.backfill_sleep_ms, timeout_ms)
+        log.end({script.version})
+        return
+
+    log.announce(f"Applying {script.version}...")
+    if script.no_transaction:
+        apply_no_transaction(conn, migration, script.sql, next_batch, session_lock_timeout(script, config, log), log,
+                             config.invalid_index)
+        tries = 1
+    else:
+        tries = with_lock_retries(
+            lambda: apply_standard(conn, migration, script.sql, next_batch, timeout_ms, log), config, log)
+    log.conclude(done_message(tries))
+
+def usable_baseline(conn, local_migrations, config, echo):
+    """Returns the squashed baseline if it can bootstrap this database, else None."""
+    baseline = read_baseline(os.path.join(config.migrations_dir, BASELINE_FILENAME))
+    if baseline is None:
+        return None
+    if config.stop_before and baseline.last_version >= config.stop_before:
+        return None
+    problems = baseline_mismatches(baseline, local_migrations)
+    if problems:
+        echo(f"⚠️  Ignoring stale baseline, replaying history instead: {', '.join(problems[:3])}"
+             f"{' ...' if len(problems) > 3 else ''}", fg="yellow")
+        return None
+    if not database_is_empty(conn):
+        echo("ℹ️  Database is not empty; replaying migrations instead of loading the baseline.")
+        return None
+    return baseline
+
+def group_single_transaction(steps, echo):
+    """
+    Merges consecutive transactional migrations into shared steps.
+    No-transaction migrations, and files with transaction control beyond a
+    BEGIN/COMMIT wrapper, split the batch and are applied on their own.
+    """
+    grouped = []
+    current = []
+    for step in steps:
+        script = step[0]
+        standalone = script.no_transaction or script.backfill
+        stripped = None if standalone else strip_transaction_wrapper(script.sql)
+        if stripped is None:
+            if not standalone:
+                echo(f"⚠️  {script.version} manages its own transaction; applying it separately.", fg="yellow")
+            if current:
+                grouped.append(current)
+                current = []
+            grouped.append(step)
+            continue
+        current.append(dataclasses.replace(script, sql=stripped))
+    if current:
+        grouped.append(current)
+    return grouped
+
+def apply_single_transaction(conn, group, local_migrations, batch_id, config, log=None):
+    """Applies several migrations and their metadata rows atomically."""
+    log = log or ExecutionLog()
+    current = None
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                rows = []
+                for script in group:
+                    current = script.version
+                    log.begin(script.version, "up", "batch")
+                    # SET LOCAL can be changed mid-transaction, so each file gets its own timeout
+                    set_lock_timeout(cur, script.lock_timeout_ms or config.lock_timeout_ms)
+                    m = local_migrations[script.version]
+                    execute_script(cur, script.sql, log, data_dir=m.data_path)
+                    rows.append((m.version, m.name, m.up_checksum, batch_id, log.elapsed_ms(), "batch"))
+                current = None
+                record_applied(cur, rows, log.lock_wait_ms, log.applied_by)
+    except psycopg2.errors.LockNotAvailable as e:
+        raise LockTimeoutError(f"Lock timeout in {current}{error_location(e)}, batch rolled back: {e.pgerror}")
+    except psycopg2.Error as e:
+        where = f" (in {current}, {error_location(e).strip(' ()')})" if current else ""
+        raise Exception(f"Batch failed and was rolled back{where}: {e.pgerror}")
+    log.end({script.version for script in group})
+
+def apply_no_transaction(conn, migration, sql_content, batch_id, lock_timeout_ms=None, log=None,
+                         invalid_index="drop"):
+    # Not retried: statements before a lock timeout have already been committed.
+    # Instead every committed statement is checkpointed and a rerun resumes after it.
+    log = log or ExecutionLog()
+    checksum = migration.up_checksum
+    done = load_progress(conn, migration.version, checksum)
+    statements = split_statements(sql_content)
+    log.begin(migration.version, "up", "no-tx")
+    if done:
+        log.echo(f"   ↻ Resuming {migration.version} at statement {done + 1}/{len(statements)}", fg="cyan")
+
+    def checkpoint(cur, statements_done):
+        save_progress(cur, migration.version, checksum, statements_done)
+
+    def after_statement(cur, stmt):
+        checkpoint(cur, stmt.index)
+        # Each statement is committed, so waiting for replicas here holds no locks
+        log.pace()
 
-def apply_no_transaction(conn, migration, sql_content, batch_id):
     old_isolation = conn.isolation_level
     conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
     try:
         with conn.cursor() as cur:
-            cur.execute(sql_content)
+            # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind
+            for stmt, name in invalid_indexes(cur, statements[done:done + 1]):
+                if invalid_index == "fail":
+                    raise Exception(f"INVALID index {name} was left by an earlier attempt of {migration.version}. "
+                                    f"Drop it, or rerun with --invalid-index drop|reindex.")
+                log.echo(f"   🧹 {'Rebuilding' if invalid_index == 'reindex' else 'Dropping'} INVALID index "
+                         f"{name} left by an earlier attempt", fg="yellow")
+                repair_invalid_index(cur, name, invalid_index)
+                if invalid_index == "reindex":
+                    # The rebuilt index is exactly what the statement would have created
+                    done = stmt.index
+                    checkpoint(cur, done)
+
+            set_lock_timeout(cur, lock_timeout_ms, local=False)
+            try:
+                execute_script(cur, sql_content, log, skip=done,
+                               after_statement=lambda stmt: after_statement(cur, stmt),
+                               data_dir=migration.data_path)
+            finally:
+                if lock_timeout_ms:
+                    cur.execute("RESET lock_timeout")
     except psycopg2.Error as e:
+        raise Exception(f"FATAL: No-Transaction migration failed{error_location(e)}. "
+                        f"Error: {(e.pgerror or str(e)).strip()}\n"
+                        f"Completed statements are checkpointed; rerun 'up' to resume from the failed one.")
+    finally:
         conn.set_isolation_level(old_isolation)
-        raise Exception(f"FATAL: No-Transaction migration failed. Error: {e.pgerror}")
 
-    conn.set_isolation_level(old_isolation)
     try:
         with conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO schema_migrations (version, name, checksum, applied_at, batch)
-                    VALUES (%s, %s, %s, NOW(), %s)
-                """, (migration.version, migration.name, migration.up_checksum, batch_id))
+                record_applied(cur, [(migration.version, migration.name, checksum,
+                                      batch_id, log.elapsed_ms(), "no-tx")],
+                               log.lock_wait_ms, log.applied_by)
+                clear_progress(cur, migration.version)
     except Exception as e:
          raise Exception(f"Migration succeeded, but saving metadata failed! Error: {e}")
+    log.end({migration.version})
 
-def revert_standard(conn, version, sql_content):
+def revert_standard(conn, version, sql_content, lock_timeout_ms=None, log=None):
+    log = log or ExecutionLog()
+    log.begin(version, "down", "tx")
     try:
         with conn:
             with conn.cursor() as cur:
-                cur.execute(sql_content)
-                cur.execute("DELETE FROM schema_migrations WHERE version = %s", (version,))
+                set_lock_timeout(cur, lock_timeout_ms)
+                execute_script(cur, sql_content, log)
+                record_reverted(cur, version, log.elapsed_ms(), log.lock_wait_ms, log.applied_by, "tx")
+    except psycopg2.errors.LockNotAvailable as e:
+        raise LockTimeoutError(f"Lock timeout in {version}{error_location(e)}: {e.pgerror}")
     except psycopg2.Error as e:
-        raise Exception(f"Revert failed in transaction: {e.pgerror}")
+        raise Exception(f"Revert failed in transaction{error_location(e)}: {e.pgerror}")
+    log.end({version})
 
-def revert_no_transaction(conn, version, sql_content):
+def revert_no_transaction(conn, version, sql_content, lock_timeout_ms=None, log=None):
+    log = log or ExecutionLog()
+    log.begin(version, "down", "no-tx")
     old_isolation = conn.isolation_level
     conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
     try:
         with conn.cursor() as cur:
-            cur.execute(sql_content)
+            set_lock_timeout(cur, lock_timeout_ms, local=False)
+            try:
+                execute_script(cur, sql_content, log)
+            finally:
+                if lock_timeout_ms:
+                    cur.execute("RESET lock_timeout")
     except psycopg2.Error as e:
         conn.set_isolation_level(old_isolation)
-        raise Exception(f"FATAL: No-Transaction revert failed. Error: {e.pgerror}")
+        raise Exception(f"FATAL: No-Transaction revert failed{error_location(e)}. Error: {e.pgerror}")
 
     conn.set_isolation_level(old_isolation)
     try:
         with conn:
             with conn.cursor() as cur:
-                cur.execute("DELETE FROM schema_migrations WHERE version = %s", (version,))
+                record_reverted(cur, version, log.elapsed_ms(), log.lock_wait_ms, log.applied_by, "no-tx")
     except Exception as e:
          raise Exception(f"Revert succeeded, but cleaning metadata failed! Error: {e}")
+    log.end({version})
 
 @cli.command()
-def status():
+@target_options
+def status(targets, targets_file, parallel, tenant_pattern, tenant_query):
     """Shows the status of all migrations (Applied vs Pending)."""
-    db = Database(get_db_url())
+    run_for_targets(run_status, targets, targets_file, parallel, tenant_pattern, tenant_query)
+
+def run_status(db_url, echo=click.secho):
+    """Prints the applied/pending dashboard for one database. Raises if it can't be read."""
+    db = Database(db_url)
     
+    # 1. Get Local State
+    local_migrations = get_migrations()
+    all_versions = set(local_migrations.keys())
+    
+    # 2. Get DB State
+    db_state = {}
     try:
-        # 1. Get Local State
-        local_migrations = get_migrations()
-        all_versions = set(local_migrations.keys())
-        
-        # 2. Get DB State
-        db_state = {}
-        try:
-            db.connect()
-            conn = db.get_conn()
-            with conn.cursor() as cur:
-                cur.execute("SELECT version, applied_at, batch FROM schema_migrations")
-                for row in cur.fetchall():
-                    db_state[row['version']] = row
-                    all_versions.add(row['version'])
-        except Exception:
-            # If table doesn't exist yet, just show local files
-            pass
-        finally:
-            db.close()
+        db.connect()
+        conn = db.get_conn()
+        with conn.cursor() as cur:
+            cur.execute("SELECT version, applied_at, batch FROM schema_migrations")
+            for row in cur.fetchall():
+                db_state[row['version']] = row
+                all_versions.add(row['version'])
+    except psycopg2.errors.UndefinedTable:
+        # If table doesn't exist yet, just show local files
+        pass
+    finally:
+        db.close()
 
-        # 3. Build the Dashboard
-        sorted_versions = sorted(list(all_versions))
-        
-        print(f"{'VERSION':<20} | {'STATUS':<10} | {'BATCH':<5} | {'NAME'}")
-        print("-" * 65)
+    # 3. Build the Dashboard
+    sorted_versions = sorted(list(all_versions))
+    
+    echo(f"{'VERSION':<20} | {'STATUS':<10} | {'BATCH':<5} | {'NAME'}")
+    echo("-" * 65)
 
-        for v in sorted_versions:
-            local = local_migrations.get(v)
-            remote = db_state.get(v)
-            
-            # Determine Status
-            status_str = "???"
-            batch_str = "-"
-            name = local.name if local else "(File Missing!)"
-            color = None
+    for v in sorted_versions:
+        local = local_migrations.get(v)
+        remote = db_state.get(v)
+        
+        # Determine Status
+        status_str = "???"
+        batch_str = "-"
+        name = local.name if local else "(File Missing!)"
+        color = None
+        
+        if remote and local:
+            status_str = "Applied"
+            batch_str = str(remote['batch'])
+            color = "green"
+        elif local and not remote:
+            status_str = "Pending"
+            color = "yellow"
+        elif remote and not local:
+            status_str = "**MISSING**"
+            batch_str = str(remote['batch'])
+            color = "red"
             
-            if remote and local:
-                status_str = "Applied"
-                batch_str = str(remote['batch'])
-                color = "green"
-            elif local and not remote:
-                status_str = "Pending"
-                color = "yellow"
-            elif remote and not local:
-                status_str = "**MISSING**"
-                batch_str = str(remote['batch'])
-                color = "red"
-                
-            # Print with color
-            row = f"{v:<20} | {status_str:<10} | {batch_str:<5} | {name}"
-            click.secho(row, fg=color)
-
-    except Exception as e:
-        click.secho(f"Error checking status: {e}", fg="red")
+        # Print with color
+        row = f"{v:<20} | {status_str:<10} | {batch_str:<5} | {name}"
+        echo(row, fg=color)
 
 @cli.command()
 @click.option('--output', default='schema.sql', help='Output file path (default: schema.sql).')
-def dump(output):
+@click.option('--engine', type=click.Choice(["pg_dump", "native"]), default="pg_dump", show_default=True,
+              help="'pg_dump' shells out to the client tools; 'native' reads pg_catalog directly "
+                   "(no client tools needed, one block per object for 'diff').")
+@click.option('--schema', 'schemas', multiple=True, help="Only dump this schema (repeatable, native engine).")
+def dump(output, engine, schemas):
     """Dumps the current database schema (structure only) to a SQL file."""
     url = get_db_url()
+
+    if engine == "native":
+        click.echo(f"📸 Snapshotting database schema to '{output}'...")
+        db = Database(url)
+        try:
+            objects = introspect(db.get_conn(), schemas)
+        finally:
+            db.close()
+        with open(output, 'w') as f:
+            f.write(render(objects))
+        click.echo(f"✅ Schema dumped successfully ({len(objects)} objects).")
+        return
     
     # Check if pg_dump is installed
-    try:
-        subprocess.run(['pg_dump', '--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-    except (FileNotFoundError, subprocess.CalledProcessError):
-        click.secho("❌ Error: 'pg_dump' executable not found.", fg="red")
-        click.echo("   You must have the PostgreSQL client tools installed on this machine.")
-        click.echo("   (e.g., 'brew install libpq' on Mac or 'apt-get install postgresql-client' on Linux)")
+    if not pg_dump_available():
         return
 
     click.echo(f"📸 Snapshotting database schema to '{output}'...")
 
     try:
-        # Construct the pg_dump command
-        # -s: Schema only (no data)
-        # --no-owner: Skip 'ALTER TABLE ... OWNER TO' (makes it portable)
-        # --no-privileges: Skip GRANT/REVOKE (cleaner)
-        # -f: Output file
-        cmd = ['pg_dump', url, '-f', output, '-s', '--no-owner', '--no-privileges']
-        
-        # Execute
-        subprocess.run(cmd, check=True)
+        run_pg_dump(url, output)
         
         # Check if file was actually created and has content
         if os.path.exists(output) and os.path.getsize(output) > 0:
@@ -404,4 +1020,367 @@ def dump(output):
             click.secho("⚠️  Warning: Output file is empty.", fg="yellow")
             
     except subprocess.CalledProcessError as e:
-        click.secho(f"❌ Error during pg_dump: {e}", fg="red")
\ No newline at end of file
+        click.secho(f"❌ Error during pg_dump: {e}", fg="red")
+
+@cli.command()
+@click.argument('snapshot', default='schema.sql', type=click.Path(exists=True, dir_okay=False))
+@click.option('--schema', 'schemas', multiple=True, help="Only compare this schema (repeatable).")
+def diff(snapshot, schemas):
+    """Reports schema drift between the database and SNAPSHOT (default: schema.sql)."""
+    url = get_db_url()
+    started = time.perf_counter()
+    with open(snapshot, 'r') as f:
+        text = f.read()
+
+    db = Database(url)
+    try:
+        actual = introspect(db.get_conn(), schemas)
+    finally:
+        db.close()
+
+    if is_native_dump(text):
+        expected = parse_dump(text)
+    else:
+        # Any other SQL (e.g. pg_dump output) is loaded into a scratch database and introspected there
+        scratch = f"pgmigrate_diff_{secrets.token_hex(4)}"
+        click.echo(f"ℹ️  '{snapshot}' is not a native dump; loading it into scratch database '{scratch}'...")
+        create_database(url, scratch)
+        try:
+            db = Database(url_for_database(url, scratch))
+            try:
+                conn = db.get_conn()
+                with conn:
+                    with conn.cursor() as cur:
+                        execute_script(cur, "\n".join(line for line in text.splitlines()
+                                                      if not line.startswith("\\")))
+                expected = introspect(conn, schemas)
+            finally:
+                db.close()
+        except psycopg2.Error as e:
+            raise click.ClickException(f"Could not load '{snapshot}'{error_location(e)}: {e.pgerror}")
+        finally:
+            drop_database(url, scratch)
+
+    drift = diff_snapshots(expected, actual)
+    elapsed = (time.perf_counter() - started) * 1000
+    if not drift:
+        click.echo(f"✅ No drift: {len(actual)} objects match '{snapshot}' ({format_ms(elapsed)}).")
+        return
+
+    symbols = {"added": ("+", "green", "only in database"), "removed": ("-", "red", "missing from database"),
+               "changed": ("~", "yellow", "differs")}
+    for d in drift:
+        symbol, color, label = symbols[d.change]
+        click.secho(f"{symbol} {d.kind} {d.name} ({label})", fg=color)
+        for line in d.diff or []:
+            click.echo(f"      {line}")
+    click.echo(f"{len(drift)} difference(s) across {len(set(expected) | set(actual))} objects ({format_ms(elapsed)}).")
+    sys.exit(1)
+
+def pg_dump_available():
+    """Checks for the pg_dump executable, explaining how to install it if missing."""
+    try:
+        subprocess.run(['pg_dump', '--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        return True
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        click.secho("❌ Error: 'pg_dump' executable not found.", fg="red")
+        click.echo("   You must have the PostgreSQL client tools installed on this machine.")
+        click.echo("   (e.g., 'brew install libpq' on Mac or 'apt-get install postgresql-client' on Linux)")
+        return False
+
+def run_pg_dump(url, output, extra_args=()):
+    # Construct the pg_dump command
+    # -s: Schema only (no data)
+    # --no-owner: Skip 'ALTER TABLE ... OWNER TO' (makes it portable)
+    # --no-privileges: Skip GRANT/REVOKE (cleaner)
+    # -f: Output file
+    cmd = ['pg_dump', url, '-f', output, '-s', '--no-owner', '--no-privileges', *extra_args]
+    
+    # Execute
+    subprocess.run(cmd, check=True)
+
+@cli.command()
+@click.option('--before', 'before_version', required=True,
+              help="First version NOT included in the baseline.")
+@click.option('--output', default=os.path.join("migrations", BASELINE_FILENAME), show_default=True,
+              help="Where to write the baseline.")
+def squash(before_version, output):
+    """Writes a schema baseline that replaces all migrations before VERSION on fresh databases."""
+    url = get_db_url()
+    local_migrations = get_migrations()
+    covered = [local_migrations[v] for v in sorted(local_migrations) if v < before_version]
+    if not covered:
+        raise click.ClickException(f"No migrations before {before_version}.")
+    missing_up = [m.version for m in covered if not m.up_path]
+    if missing_up:
+        raise click.ClickException(f"Missing .up.sql for {', '.join(missing_up)}")
+    if not pg_dump_available():
+        sys.exit(1)
+
+    # Replay the covered migrations into a throwaway database on the same server and dump it
+    scratch = f"pgmigrate_squash_{secrets.token_hex(4)}"
+    scratch_url = url_for_database(url, scratch)
+    click.echo(f"🗜️  Replaying {len(covered)} migrations into scratch database '{scratch}'...")
+    try:
+        migrate_new_database(url, scratch, RunConfig(stop_before=before_version, use_baseline=False))
+
+        dump_path = f"{output}.{scratch}.tmp"
+        try:
+            run_pg_dump(scratch_url, dump_path, ['--exclude-table=schema_migrations*'])
+            with open(dump_path, 'r') as f:
+                dump_sql = f.read()
+        finally:
+            if os.path.exists(dump_path):
+                os.remove(dump_path)
+    except subprocess.CalledProcessError as e:
+        raise click.ClickException(f"pg_dump failed: {e}")
+    except Exception as e:
+        raise click.ClickException(f"Squash failed: {e}")
+    finally:
+        drop_database(url, scratch)
+
+    write_baseline(output, dump_sql, covered)
+    click.echo(f"✅ Wrote baseline '{output}' covering {covered[0].version} .. {covered[-1].version}.")
+    click.echo("   Fresh databases will load it in one step; existing databases are unaffected.")
+
+def migrate_new_database(server_url, name, config=None):
+    """
+    Creates database NAME on the same server, initializes it and applies the
+    migrations selected by CONFIG without printing anything. Returns its URL.
+    """
+    url = url_for_database(server_url, name)
+    create_database(server_url, name)
+    db = Database(url)
+    try:
+        create_metadata(db.get_conn())
+    finally:
+        db.close()
+    run_up(url, config, echo=lambda *args, **kwargs: None)
+    return url
+
+@cli.command()
+@click.option('--via', type=click.Choice(["template", "dump"]), default="template", show_default=True,
+              help="template: CREATE DATABASE ... TEMPLATE on the target's server (the target must be idle). "
+                   "dump: pg_dump | pg_restore, e.g. into a local stand-in given with --server.")
+@click.option('--server', 'server_url', default=None,
+              help="Server to create the clone on, with --via dump (default: the target's server).")
+@click.option('--keep', is_flag=True, help="Keep the clone instead of dropping it afterwards.")
+@click.option('--report', 'report_path', type=click.Path(dir_okay=False),
+              help="Write the timing report (and per-statement timings) as JSON.")
+@click.option('--verbose', '-v', is_flag=True, help="Show each statement's timing as it runs.")
+def rehearse(via, server_url, keep, report_path, verbose):
+    """Times pending migrations on a disposable clone of the database."""
+    url = get_db_url()
+    if server_url and via == "template":
+        raise click.BadParameter("--server needs --via dump: a template copy stays on the target's server.")
+    if via == "dump" and not pg_dump_available():
+        sys.exit(1)
+    server_url = server_url or url
+    name = f"pgmigrate_rehearse_{secrets.token_hex(4)}"
+    source = target_label(url)
+
+    click.echo(f"🎭 Cloning '{source}' into '{name}' ({via})...")
+    started = time.monotonic()
+    try:
+        if via == "template":
+            clone_url = clone_with_template(url, name)
+        else:
+            clone_url = url_for_database(server_url, name)
+            problems = clone_with_dump(url, server_url, name)
+            if problems:
+                click.secho(f"⚠️  pg_restore reported {len(problems)} issue(s), e.g.: {problems[0]}", fg="yellow")
+    except Exception as e:
+        drop_database(server_url, name)
+        raise click.ClickException(f"Could not clone '{source}': {e}")
+    click.echo(f"   Cloned in {format_ms((time.monotonic() - started) * 1000)}.")
+
+    # One migration at a time, so every measurement belongs to exactly one of them
+    config = RunConfig(concurrency=1, progress_interval_ms=None, blocker_policy="off", verbose=verbose)
+    log = RehearsalLog(clone_url, click.secho, verbose)
+    error = None
+    try:
+        run_up(clone_url, config, click.secho, log)
+    except Exception as e:
+        error = e
+    finally:
+        log.close()
+        if keep:
+            click.echo(f"ℹ️  Kept clone '{name}': {clone_url}")
+        else:
+            drop_database(server_url, name)
+
+    print_rehearsal(log.results)
+    if report_path:
+        log.write(report_path, target=source, error=error)
+        click.echo(f"📝 Wrote rehearsal report to '{report_path}'.")
+    if error:
+        raise click.ClickException(f"Rehearsal failed: {error}")
+
+def print_rehearsal(results):
+    """The per-migration timing table of a rehearsal."""
+    if not results:
+        return
+    click.echo("")
+    click.echo(f"{'VERSION':<30} | {'DURATION':>9} | {'WAL':>9} | LOCKS / TABLE SIZE CHANGES")
+    click.echo("-" * 90)
+    for r in results:
+        color = None if r.status == "ok" else "red"
+        locks = ", ".join(f"{short_mode(mode)} {table}" for table, mode in sorted(r.locks.items())) or "-"
+        click.secho(f"{r.version:<30} | {format_ms(r.duration_ms):>9} | {format_bytes(r.wal_bytes):>9} | {locks}",
+                    fg=color)
+        for relation, (before, after) in r.size_changes.items():
+            click.echo(f"{'':<30} | {'':>9} | {'':>9} |   {describe_size_change(relation, before, after)}")
+    click.echo("-" * 90)
+    total_ms = sum(r.duration_ms for r in results)
+    total_wal = sum(r.wal_bytes for r in results)
+    click.echo(f"⏱  {len(results)} migration(s): {format_ms(total_ms)}, {format_bytes(total_wal)} of WAL.")
+    click.echo("   WAL is counted server-wide, so other activity on the clone's server adds to it.")
+
+@cli.command()
+@click.option('--all', 'lint_all', is_flag=True, help="Lint every local migration, not only pending ones.")
+@click.option('--strict', is_flag=True, help="Exit non-zero on warnings too.")
+def lint(lint_all, strict):
+    """Flags blocking, table-rewriting or failing DDL in pending migrations."""
+    local_migrations = get_migrations()
+    conn, db = None, None
+    if os.getenv("DATABASE_URL"):
+        db = Database(os.getenv("DATABASE_URL"))
+        try:
+            conn = db.get_conn()
+        except Exception as e:
+            click.echo(f"ℹ️  Database not reachable, skipping size estimates ({str(e).splitlines()[0]}).")
+            db = None
+
+    try:
+        applied = set()
+        if conn is not None and not lint_all:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT version FROM schema_migrations")
+                    applied = {row['version'] for row in cur.fetchall()}
+            except psycopg2.Error:
+                pass
+            conn.rollback()
+
+        scripts = [m.load("up") for v, m in sorted(local_migrations.items())
+                   if m.up_path and v not in applied]
+        scope = "" if lint_all or conn is None else "pending "
+        click.echo(f"🔍 Linting {len(scripts)} {scope}migrations...")
+        findings = lint_scripts(scripts, conn)
+    finally:
+        if db:
+            db.close()
+
+    print_findings(findings, click.secho)
+    errors = sum(1 for f in findings if f.severity == "error")
+    warnings = sum(1 for f in findings if f.severity == "warning")
+    if not findings:
+        click.echo("✅ No blocking operations found.")
+        return
+    click.echo(f"{errors} error(s), {warnings} warning(s), {len(findings) - errors - warnings} note(s).")
+    if errors or (strict and warnings):
+        sys.exit(1)
+
+def format_ms(ms):
+    """Human-readable duration: 850ms, 12.4s, 3m 05s."""
+    if ms is None:
+        return "-"
+    ms = float(ms)
+    if ms < 1000:
+        return f"{ms:.0f}ms"
+    if ms < 60_000:
+        return f"{ms / 1000:.1f}s"
+    minutes, seconds = divmod(int(ms / 1000), 60)
+    return f"{minutes}m {seconds:02d}s"
+
+@cli.command()
+@click.option('--limit', default=10, show_default=True, help="Rows per section.")
+def stats(limit):
+    """Reports slow migrations, per-batch totals and duration trends."""
+    db = Database(get_db_url())
+    try:
+        conn = db.get_conn()
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations_history') AS history")
+            if not cur.fetchone()['history']:
+                raise click.ClickException("No execution history yet. Run 'init' or 'up' to create it.")
+
+            # 1. Slowest executions
+            cur.execute("""
+                SELECT version, name, direction, duration_ms, tx_mode, executed_at
+                FROM schema_migrations_history
+                WHERE duration_ms IS NOT NULL
+                ORDER BY duration_ms DESC
+                LIMIT %s
+            """, (limit,))
+            click.secho("🐢 Slowest migrations", bold=True)
+            click.echo(f"{'VERSION':<20} | {'DIR':<4} | {'MODE':<5} | {'DURATION':>9} | {'EXECUTED AT':<19} | NAME")
+            click.echo("-" * 90)
+            for r in cur.fetchall():
+                click.echo(f"{r['version']:<20} | {r['direction']:<4} | {r['tx_mode'] or '-':<5} | "
+                           f"{format_ms(r['duration_ms']):>9} | {r['executed_at']:%Y-%m-%d %H:%M:%S} | {r['name'] or ''}")
+
+            # 2. Per-batch totals (currently applied migrations)
+            cur.execute("""
+                SELECT batch, COUNT(*) AS migrations, SUM(duration_ms) AS total_ms,
+                       MAX(duration_ms) AS max_ms, MAX(lock_wait_ms) AS lock_wait_ms,
+                       MIN(applied_at) AS started, string_agg(DISTINCT applied_by, ', ') AS applied_by
+                FROM schema_migrations
+                GROUP BY batch
+                ORDER BY batch DESC
+                LIMIT %s
+            """, (limit,))
+            click.echo("")
+            click.secho("📦 Batches", bold=True)
+            click.echo(f"{'BATCH':>5} | {'COUNT':>5} | {'TOTAL':>9} | {'LONGEST':>9} | {'LOCK WAIT':>9} | {'STARTED':<19} | BY")
+            click.echo("-" * 90)
+            for r in cur.fetchall():
+                click.echo(f"{r['batch']:>5} | {r['migrations']:>5} | {format_ms(r['total_ms']):>9} | "
+                           f"{format_ms(r['max_ms']):>9} | {format_ms(r['lock_wait_ms']):>9} | "
+                           f"{r['started']:%Y-%m-%d %H:%M:%S} | {r['applied_by'] or '-'}")
+
+            # 3. Trend: weekly totals of 'up' executions
+            cur.execute("""
+                SELECT date_trunc('week', executed_at) AS period, COUNT(*) AS runs,
+                       AVG(duration_ms) AS avg_ms,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms) AS p95_ms,
+                       SUM(duration_ms) AS total_ms
+                FROM schema_migrations_history
+                WHERE direction = 'up' AND duration_ms IS NOT NULL
+                GROUP BY 1
+                ORDER BY 1 DESC
+                LIMIT %s
+            """, (limit,))
+            click.echo("")
+            click.secho("📈 Weekly trend (up)", bold=True)
+            click.echo(f"{'WEEK OF':<10} | {'RUNS':>5} | {'AVG':>9} | {'P95':>9} | {'TOTAL':>9}")
+            click.echo("-" * 55)
+            for r in cur.fetchall():
+                click.echo(f"{r['period']:%Y-%m-%d} | {r['runs']:>5} | {format_ms(r['avg_ms']):>9} | "
+                           f"{format_ms(r['p95_ms']):>9} | {format_ms(r['total_ms']):>9}")
+
+            # 4. Migrations that were applied more than once and got slower
+            cur.execute("""
+                SELECT version, COUNT(*) AS runs,
+                       (array_agg(duration_ms ORDER BY executed_at ASC))[1] AS first_ms,
+                       (array_agg(duration_ms ORDER BY executed_at DESC))[1] AS last_ms
+                FROM schema_migrations_history
+                WHERE direction = 'up' AND duration_ms IS NOT NULL
+                GROUP BY version
+                HAVING COUNT(*) > 1
+                ORDER BY (array_agg(duration_ms ORDER BY executed_at DESC))[1]
+                       - (array_agg(duration_ms ORDER BY executed_at ASC))[1] DESC
+                LIMIT %s
+            """, (limit,))
+            regressions = [r for r in cur.fetchall() if r['last_ms'] > r['first_ms']]
+            if regressions:
+                click.echo("")
+                click.secho("⚠️  Getting slower (re-applied migrations)", bold=True, fg="yellow")
+                for r in regressions:
+                    click.secho(f"   {r['version']}: {format_ms(r['first_ms'])} -> {format_ms(r['last_ms'])} "
+                                f"over {r['runs']} runs", fg="yellow")
+    except psycopg2.Error as e:
+        click.secho(f"❌ Error: {e}", fg="red")
+        sys.exit(1)
+    finally:
+        db.close()
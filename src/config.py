@@ -0,0 +1,63 @@
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from .utils import parse_duration
+from .budget import DEFAULT_ESTIMATE_MS, parse_window
+
+# Retry policy for migrations that hit lock_timeout
+DEFAULT_LOCK_RETRIES = 3
+LOCK_RETRY_BASE_DELAY = 0.5   # Seconds, doubled on every attempt
+LOCK_RETRY_MAX_DELAY = 30.0
+
+@dataclass
+class RunConfig:
+    """Options that control how up/down apply migrations."""
+    dry_run: bool = False
+    single_transaction: bool = False
+    lock_timeout_ms: Optional[int] = None   # None: migration SQL may wait for locks forever
+    lock_retries: int = DEFAULT_LOCK_RETRIES
+    verbose: bool = False                   # Echo per-statement timings live
+    report_path: Optional[str] = None       # JSON run report destination
+    backfill_sleep_ms: Optional[int] = None # Overrides a backfill file's sleep=
+    stop_before: Optional[str] = None       # Only apply versions lower than this
+    use_baseline: bool = True               # Bootstrap empty databases from a squashed baseline
+    migrations_dir: str = "migrations"
+    concurrency: int = 1                    # Independent no-tx migrations applied at once
+    fast_check: bool = True                 # Skip the lock when the stored fingerprint matches
+    invalid_index: str = "drop"             # Leftover INVALID index before resuming: drop, reindex or fail
+    progress_interval_ms: Optional[int] = None  # Poll pg_stat_progress_* this often while a statement runs
+    events_path: Optional[str] = None       # JSON-lines event stream destination
+    max_replica_lag_ms: Optional[int] = None  # Pause while replicas lag further behind than this
+    replica_urls: Tuple[str, ...] = ()      # Standbys to measure directly (default: pg_stat_replication)
+    replica_lag_timeout_ms: Optional[int] = None  # Give up after pausing this long
+    blocker_policy: str = "warn"            # Sessions in the way of a migration's locks: off, warn, wait, abort, terminate
+    blocker_min_age_ms: int = 5000          # Ignore blockers younger than this
+    blocker_timeout_ms: Optional[int] = 60000  # --blockers wait/terminate give up after this
+    budget_ms: Optional[int] = None         # Only apply what fits in this much time
+    window: Optional[str] = None            # Maintenance window, e.g. '02:00-04:00' (local time)
+    estimate_sources: Tuple[str, ...] = ()  # Reports / other databases with recorded durations
+    default_estimate_ms: int = DEFAULT_ESTIMATE_MS  # For migrations never timed anywhere
+    lock_mode: str = "session"              # session: pg_advisory_lock; lease: lease row, works through transaction poolers
+
+    @classmethod
+    def from_options(cls, lock_timeout=None, backfill_sleep=None, progress_interval=None,
+                     max_replica_lag=None, replica_lag_timeout=None, blocker_min_age=None,
+                     blocker_timeout=None, lock_mode=None, budget=None,
+                     default_estimate=None, **kwargs) -> "RunConfig":
+        """Builds a config from CLI values, falling back to PGMIGRATE_* environment variables."""
+        if lock_timeout is None:
+            lock_timeout = os.getenv("PGMIGRATE_LOCK_TIMEOUT")
+        lock_mode = lock_mode or os.getenv("PGMIGRATE_LOCK_MODE") or "session"
+        if lock_mode not in ("session", "lease"):
+            raise ValueError(f"Unknown lock mode '{lock_mode}' (expected session or lease).")
+        if kwargs.get("window"):
+            parse_window(kwargs["window"])
+        return cls(lock_mode=lock_mode, budget_ms=parse_duration(budget),
+                   default_estimate_ms=parse_duration(default_estimate) or DEFAULT_ESTIMATE_MS,
+                   lock_timeout_ms=parse_duration(lock_timeout),
+                   backfill_sleep_ms=parse_duration(backfill_sleep),
+                   progress_interval_ms=parse_duration(progress_interval) or None,
+                   max_replica_lag_ms=parse_duration(max_replica_lag),
+                   replica_lag_timeout_ms=parse_duration(replica_lag_timeout),
+                   blocker_min_age_ms=parse_duration(blocker_min_age or "5s"),
+                   blocker_timeout_ms=parse_duration(blocker_timeout or "60s") or None, **kwargs)
@@ -1,48 +1,215 @@
+import atexit
 import os
+import threading
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import make_dsn, parse_dsn, TRANSACTION_STATUS_IDLE
 from psycopg2.extras import RealDictCursor
 import time
+from .lease import LeaseLock
+
+LOCK_MODES = ["session", "lease"]
 
 # A arbitrary constant integer for the Postgres Advisory Lock
 ADVISORY_LOCK_ID = 4294967295 
+# Schemas other than public (tenant schemas) lock (TENANT_LOCK_CLASS, hashtext(schema)) instead,
+# so tenants sharing a database migrate independently
+TENANT_LOCK_CLASS = 1885826409
+
+def application_name() -> str:
+    """application_name for this process's connections, so pre-flight checks can tell them apart."""
+    return f"pgmigrate:{os.getpid()}"
+
+class ConnectionPool:
+    """
+    Idle connections kept for the rest of the process, so the phases of a
+    run (fast check, lock, workers, tenant setup) and the commands run from
+    one process share connections instead of paying a TLS handshake and a
+    backend fork each time. Every tenant and target has a URL of its own, so
+    besides SIZE per URL at most MAX_IDLE are kept overall, least recently used going first.
+    """
+    def __init__(self, size: int = 4, max_idle: int = 8):
+        self.size = size          # Idle connections kept per URL
+        self.max_idle = max_idle  # ... and across all URLs
+        self.opened = 0
+        self.reused = 0
+        self._idle = []           # (db_url, conn), least recently returned first
+        self._lock = threading.Lock()
+
+    def get(self, db_url):
+        while True:
+            with self._lock:
+                conn = None
+                for i in range(len(self._idle) - 1, -1, -1):
+                    if self._idle[i][0] == db_url:
+                        conn = self._idle.pop(i)[1]
+                        break
+            if conn is None:
+                break
+            # The server may have closed it meanwhile (restart, idle timeout, pg_terminate_backend)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+                self.reused += 1
+                return conn
+            except psycopg2.Error:
+                conn.close()
+        try:
+            options = {} if "application_name" in parse_dsn(db_url) else {"application_name": application_name()}
+            conn = psycopg2.connect(db_url, cursor_factory=RealDictCursor, **options)
+        except psycopg2.Error as e:
+            raise Exception(f"Failed to connect to DB: {e}")
+        self.opened += 1
+        return conn
+
+    def put(self, db_url, conn):
+        """
+        Returns CONN for reuse with its session state discarded (settings, temp tables,
+        prepared statements, advisory locks); closes it if that fails or the pool is full.
+        """
+        if conn.closed:
+            return
+        try:
+            if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("DISCARD ALL")
+            conn.autocommit = False
+        except psycopg2.Error:
+            conn.close()
+            return
+        with self._lock:
+            if sum(1 for url, _ in self._idle if url == db_url) >= self.size:
+                evicted = [conn]
+            else:
+                self._idle.append((db_url, conn))
+                evicted = [c for _, c in self._idle[:max(0, len(self._idle) - self.max_idle)]]
+                del self._idle[:len(evicted)]
+        for conn in evicted:
+            conn.close()
+
+    def close_all(self, dbname=None):
+        """Closes idle connections (to DBNAME only, if given), e.g. before it is dropped or used as a template."""
+        with self._lock:
+            conns = [conn for _, conn in self._idle if dbname is None or conn.info.dbname == dbname]
+            self._idle = [(url, conn) for url, conn in self._idle if conn not in conns]
+        for conn in conns:
+            conn.close()
+
+pool = ConnectionPool(int(os.getenv("PGMIGRATE_POOL_SIZE", "4")), int(os.getenv("PGMIGRATE_POOL_MAX_IDLE", "8")))
+atexit.register(pool.close_all)
 
 class Database:
-    def __init__(self, db_url):
+    def __init__(self, db_url, lock_mode="session"):
         self.db_url = db_url
+        self.lock_mode = lock_mode   # session: pg_advisory_lock; lease: a row in schema_migrations_lock
         self.conn = None
+        self.lock_wait_ms = 0   # Time the last acquire_lock() spent waiting
+        self.locked = False
+        self.lease = None
+        self._lock_key = (ADVISORY_LOCK_ID,)
 
     def connect(self):
-        """Establishes connection to the database."""
+        """Takes a connection from the pool (or opens one)."""
         if self.conn is None or self.conn.closed:
-            try:
-                self.conn = psycopg2.connect(self.db_url, cursor_factory=RealDictCursor)
-                # Ensure we start in a known state
-                self.conn.autocommit = False 
-            except psycopg2.Error as e:
-                raise Exception(f"Failed to connect to DB: {e}")
+            self.conn = pool.get(self.db_url)
+            # Ensure we start in a known state
+            self.conn.autocommit = False
 
     def close(self):
+        """Hands the connection back to the pool. One still holding the advisory lock is closed instead."""
         if self.conn and not self.conn.closed:
-            self.conn.close()
+            if self.locked and self.lease is None:
+                self.conn.close()
+            else:
+                pool.put(self.db_url, self.conn)
+        self.conn = None
 
     def acquire_lock(self):
         """Acquires a global exclusive lock for migrations with a timeout."""
         self.connect()
+        if self.lock_mode == "lease":
+            self.lease = LeaseLock(self.db_url, pool)
+            self.lock_wait_ms = self.lease.acquire(self.conn)
+            self.locked = True
+            return
         with self.conn.cursor() as cur:
             # Prevent infinite hangs: Set a local statement timeout (e.g., 10 seconds for the lock)
-            # Note: This timeout applies to the 'acquiring' step, not the migration duration.
-            cur.execute("SET lock_timeout = '10s'")
+            # Note: SET LOCAL + commit keeps this timeout from leaking into the migration SQL,
+            # which gets its own (configurable) lock_timeout.
+            cur.execute("SET LOCAL lock_timeout = '10s'")
+            cur.execute("SELECT current_schema() AS schema")
+            schema = cur.fetchone()['schema']
+            if schema and schema != 'public':
+                cur.execute("SELECT hashtext(%s) AS key", (schema,))
+                self._lock_key = (TENANT_LOCK_CLASS, cur.fetchone()['key'])
+            started = time.monotonic()
             try:
-                cur.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+                cur.execute(self._lock_sql("pg_advisory_lock"), self._lock_key)
             except psycopg2.errors.LockNotAvailable:
+                self.conn.rollback()
                 raise Exception("Could not acquire migration lock. Is another migration running?")
+            self.lock_wait_ms = int((time.monotonic() - started) * 1000)
+        # Session-level advisory locks survive the end of the transaction
+        self.conn.commit()
+        self.locked = True
 
     def release_lock(self):
         """Releases the global exclusive lock."""
-        if self.conn and not self.conn.closed:
+        if self.lease is not None:
+            if self.locked:
+                self.lease.release(self.get_conn())
+                self.locked = False
+            return
+        if self.locked and self.conn and not self.conn.closed:
             with self.conn.cursor() as cur:
-                cur.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+                cur.execute(self._lock_sql("pg_advisory_unlock"), self._lock_key)
+            self.locked = False
+
+    def _lock_sql(self, function):
+        return f"SELECT {function}({', '.join(['%s'] * len(self._lock_key))})"
 
     def get_conn(self):
         self.connect()
-        return self.conn
\ No newline at end of file
+        return self.conn
+
+def url_for_database(db_url, dbname):
+    """Returns db_url pointed at another database on the same server."""
+    return make_dsn(db_url, dbname=dbname)
+
+def create_database(db_url, name, template=None):
+    """CREATE DATABASE (optionally from a template), issued through db_url's server."""
+    if template:
+        # A template must have no other connections, pooled ones included
+        pool.close_all(template)
+    conn = psycopg2.connect(db_url)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            query = sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name))
+            if template:
+                query += sql.SQL(" TEMPLATE {}").format(sql.Identifier(template))
+            cur.execute(query)
+    finally:
+        conn.close()
+
+def drop_database(db_url, name, terminate=True):
+    """
+    DROP DATABASE IF EXISTS, disconnecting leftover sessions first. With
+    terminate=False a database still in use raises ObjectInUse instead.
+    """
+    pool.close_all(name)
+    conn = psycopg2.connect(db_url)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            if terminate:
+                cur.execute("""
+                    SELECT pg_terminate_backend(pid) FROM pg_stat_activity
+                    WHERE datname = %s AND pid <> pg_backend_pid()
+                """, (name,))
+            cur.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(name)))
+    finally:
+        conn.close()
@@ -0,0 +1,290 @@
+import datetime
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field, asdict
+from typing import List, Optional
+import click
+import psycopg2
+from .metadata import client_identity
+from .monitor import ProgressMonitor, describe
+from .splitter import split_statements
+from .utils import open_migration
+
+# "COPY table [(cols)] FROM 'file' [WITH (...)]" with a relative path: streamed from the seed data folder
+COPY_FILE_REGEX = re.compile(r"^COPY\s+(.+?)\s+FROM\s+'((?:[^']|'')+)'(.*)$", re.IGNORECASE | re.DOTALL)
+# Bytes handed to COPY at a time, so memory stays flat whatever the file size
+COPY_CHUNK_BYTES = 1024 * 1024
+
+@dataclass
+class StatementResult:
+    index: int
+    line: int                 # Line in the migration file
+    sql: str                  # Preview (first line) of the statement
+    duration_ms: float
+    rowcount: int             # -1 when the statement reports no row count (e.g. DDL)
+    error: Optional[str] = None
+
+@dataclass
+class MigrationRecord:
+    version: str
+    direction: str            # 'up' or 'down'
+    mode: str                 # 'tx', 'no-tx' or 'batch'
+    attempts: int = 0
+    status: str = "running"
+    error: Optional[str] = None
+    duration_ms: float = 0.0
+    throttled_ms: float = 0.0 # Paused waiting for replicas
+    statements: List[StatementResult] = field(default_factory=list)
+    _started: float = field(default=0.0, repr=False)
+    _attempt_started: float = field(default=0.0, repr=False)
+
+class ExecutionLog:
+    """
+    Collects per-statement timings for a run, echoes them live when verbose,
+    and can be written out as a JSON run report.
+    """
+    def __init__(self, echo=click.secho, verbose=False):
+        self.echo = echo
+        self.verbose = verbose
+        self.records: List[MigrationRecord] = []
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self._current: Optional[MigrationRecord] = None
+        # Run-level facts stored with every schema_migrations row
+        self.applied_by = client_identity()
+        self.lock_wait_ms = 0
+        # Live progress (see watch()) and the --events stream; set by the runner
+        self.monitor_url: Optional[str] = None
+        self.progress_interval_ms: Optional[int] = None
+        self.events = None
+        self.target: Optional[str] = None
+        self.throttle = None      # ReplicationThrottle when --max-replica-lag is set
+        self.lease = None         # LeaseLock under --lock-mode lease
+        self.budget = None        # Budget under --budget / --window
+        self._partial_line = False
+
+    def fork(self, echo=None) -> "ExecutionLog":
+        """A log for a worker thread: its own current migration, but records shared with this log."""
+        child = ExecutionLog(echo or self.echo, self.verbose)
+        child.records = self.records
+        child.started_at = self.started_at
+        child.applied_by = self.applied_by
+        child.lock_wait_ms = self.lock_wait_ms
+        child.monitor_url = self.monitor_url
+        child.progress_interval_ms = self.progress_interval_ms
+        child.events = self.events
+        child.target = self.target
+        child.throttle = self.throttle
+        child.lease = self.lease
+        child.budget = self.budget
+        return child
+
+    def records_for(self, version) -> Optional[MigrationRecord]:
+        return next((r for r in reversed(self.records) if r.version == version), None)
+
+    # --- Console helpers ---
+
+    def announce(self, message):
+        """Prints 'Applying X...'. Statement lines follow on their own lines when verbose."""
+        self.echo(message, nl=self.verbose)
+        self._partial_line = not self.verbose
+
+    def conclude(self, message):
+        # Progress lines may have been printed since announce(); then the result goes on its own line
+        self.echo(message if self._partial_line else f"   {message.strip()}")
+        self._partial_line = False
+
+    def emit(self, event, **fields):
+        """Writes one event to the --events stream, if there is one."""
+        if self.events is not None:
+            self.events.emit(event, target=self.target, **fields)
+
+    def line(self, message="", fg=None, nl=True):
+        """Echoes on a line of its own, even after an announce() that left one open."""
+        if self._partial_line:
+            self.echo("")
+            self._partial_line = False
+        self.echo(message, fg=fg, nl=nl)
+
+    def pace(self):
+        """
+        Pauses while replicas lag behind (no-op without a throttle), and stops the
+        run if its lease was lost. Only call between committed work.
+        """
+        if self.lease is not None:
+            self.lease.check()
+        if self.throttle is None:
+            return
+        paused_ms = self.throttle.wait(self.line, self.emit)
+        if paused_ms and self._current is not None:
+            self._current.throttled_ms += paused_ms
+
+    # --- Live progress ---
+
+    def watch(self, conn, total: int):
+        """
+        Starts a ProgressMonitor for CONN's backend (None when progress is off).
+        Set .statement on the result as execution moves on; call .stop() when done.
+        """
+        if not self.monitor_url or not self.progress_interval_ms:
+            return None
+        record = self._current
+        monitor = None
+
+        def report(snapshot):
+            stmt = monitor.statement
+            where = f"[{stmt.index}/{total}] " if stmt else ""
+            self.line(f"   ⏳ {where}{describe(snapshot)}", fg="cyan")
+            self.emit("progress", version=record.version if record else None,
+                      statement=stmt.index if stmt else None, statements=total, **snapshot)
+
+        monitor = ProgressMonitor(self.monitor_url, conn.get_backend_pid(),
+                                  self.progress_interval_ms / 1000, report)
+        monitor.statement = None
+        return monitor.start()
+
+    # --- Recording ---
+
+    def begin(self, version, direction, mode):
+        """Starts (or, on a retry, restarts) the record for one migration."""
+        record = next((r for r in self.records
+                       if r.version == version and r.direction == direction and r.status == "running"), None)
+        if record is None:
+            record = MigrationRecord(version, direction, mode, _started=time.perf_counter())
+            self.records.append(record)
+        record.attempts += 1
+        record.statements = []
+        record._attempt_started = time.perf_counter()
+        self._current = record
+        self.emit("migration_started", version=version, direction=direction, mode=mode, attempt=record.attempts)
+
+    def elapsed_ms(self) -> int:
+        """Milliseconds since the current migration's latest attempt started."""
+        if self._current is None:
+            return 0
+        return int((time.perf_counter() - self._current._attempt_started) * 1000)
+
+    def statement(self, result: StatementResult, total: int):
+        if self._current is not None:
+            self._current.statements.append(result)
+            self.emit("statement", version=self._current.version, statements=total, **asdict(result))
+        if not self.verbose:
+            return
+        rows = "-" if result.rowcount < 0 else str(result.rowcount)
+        if result.error:
+            self.echo(f"   [{result.index}/{total}] FAILED after {result.duration_ms:.1f} ms "
+                      f"(line {result.line}): {result.sql}", fg="red")
+        else:
+            self.echo(f"   [{result.index}/{total}] {result.duration_ms:>9.1f} ms  rows={rows:<8} {result.sql}")
+
+    def end(self, versions, status="ok", error=None):
+        now = time.perf_counter()
+        for record in self.records:
+            if record.version in versions and record.status == "running":
+                record.status = status
+                record.error = error
+                record.duration_ms = (now - record._started) * 1000
+                self.emit("migration_finished", version=record.version, direction=record.direction,
+                          status=status, duration_ms=round(record.duration_ms, 1), error=error)
+        self._current = None
+
+    def fail_running(self, error):
+        """Marks whatever was in flight as failed (used when a run aborts)."""
+        self.end({r.version for r in self.records}, "failed", str(error))
+
+    def slowest_statements(self, limit=5) -> List[tuple]:
+        rows = [(s.duration_ms, r.version, s) for r in self.records for s in r.statements]
+        return sorted(rows, key=lambda row: row[0], reverse=True)[:limit]
+
+    def to_dict(self, target=None, error=None) -> dict:
+        migrations = []
+        for record in self.records:
+            data = asdict(record)
+            data.pop("_started", None)
+            data.pop("_attempt_started", None)
+            migrations.append(data)
+        report = {
+            "target": target,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "status": "failed" if error else "ok",
+            "error": str(error) if error else None,
+            "migrations": migrations,
+        }
+        if self.throttle is not None:
+            report["replica_lag"] = {"max_lag_ms": self.throttle.max_lag_ms, "pauses": self.throttle.pauses,
+                                     "paused_ms": self.throttle.paused_ms,
+                                     "max_seen_ms": round(self.throttle.max_seen_ms, 1)}
+        return report
+
+    def write(self, path, target=None, error=None):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(target, error), f, indent=2)
+
+def error_location(e) -> str:
+    """Returns ' (statement 3/40, line 12)' for errors raised by execute_script, else ''."""
+    location = getattr(e, "pgmigrate_location", None)
+    return f" ({location})" if location else ""
+
+def copy_source(sql: str, data_dir: Optional[str]):
+    """(COPY ... FROM STDIN statement, data file path) for a seed data COPY, else None."""
+    match = COPY_FILE_REGEX.match(sql) if data_dir else None
+    if not match or os.path.isabs(match.group(2)):
+        return None
+    target, filename, options = match.groups()
+    path = os.path.realpath(os.path.join(data_dir, filename.replace("''", "'")))
+    if os.path.commonpath([path, os.path.realpath(data_dir)]) != os.path.realpath(data_dir):
+        raise Exception(f"COPY source '{filename}' is outside the migration's data folder {data_dir}")
+    return f"COPY {target} FROM STDIN{options}", path
+
+def execute_script(cur, sql_content, log: Optional[ExecutionLog] = None,
+                   skip: int = 0, after_statement=None, data_dir: Optional[str] = None) -> List[StatementResult]:
+    """
+    Executes a migration statement by statement, timing each one.
+    The first SKIP statements are not run; after_statement(stmt) is called after each one that succeeds.
+    COPY ... FROM 'file' statements stream the file from DATA_DIR through COPY FROM STDIN.
+    Under a time budget each statement's statement_timeout is the time left when it starts.
+    psycopg2 errors are re-raised unchanged, tagged with where in the file they happened.
+    """
+    statements = split_statements(sql_content)
+    results = []
+    monitor = log.watch(cur.connection, len(statements)) if log else None
+    try:
+        for stmt in statements[skip:]:
+            if monitor:
+                monitor.statement = stmt
+            started = time.perf_counter()
+            copy = copy_source(stmt.sql, data_dir)
+            try:
+                if log and log.budget is not None:
+                    log.budget.cap(cur)
+                if copy:
+                    with open_migration(copy[1]) as f:
+                        cur.copy_expert(copy[0], f, size=COPY_CHUNK_BYTES)
+                else:
+                    cur.execute(stmt.sql)
+            except psycopg2.Error as e:
+                line = stmt.line
+                position = getattr(e.diag, "statement_position", None)
+                if position and str(position).isdigit():
+                    line += stmt.sql.count("\n", 0, int(position) - 1)
+                result = StatementResult(stmt.index, line, stmt.preview,
+                                         (time.perf_counter() - started) * 1000, -1,
+                                         (e.pgerror or str(e)).strip())
+                results.append(result)
+                if log:
+                    log.statement(result, len(statements))
+                e.pgmigrate_location = f"statement {stmt.index}/{len(statements)}, line {line}"
+                raise
+            result = StatementResult(stmt.index, stmt.line, stmt.preview,
+                                     (time.perf_counter() - started) * 1000, cur.rowcount)
+            results.append(result)
+            if log:
+                log.statement(result, len(statements))
+            if after_statement:
+                after_statement(stmt)
+    finally:
+        if monitor:
+            monitor.stop()
+    return results
@@ -0,0 +1,103 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+import click
+from psycopg2.extensions import parse_dsn
+from .tenants import tenant_schema
+
+# Upper bound on concurrent targets when --parallel is not given
+DEFAULT_PARALLELISM = 8
+
+@dataclass
+class TargetResult:
+    target: str       # Display label (no credentials)
+    ok: bool
+    duration: float   # Seconds
+    error: Optional[str] = None
+
+def load_targets(targets, targets_file: Optional[str] = None) -> List[str]:
+    """
+    Merges --target values with a targets file (one URL per line, '#' comments allowed).
+    Duplicates are dropped, first occurrence wins.
+    """
+    urls = list(targets or [])
+    if targets_file:
+        with open(targets_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    urls.append(line)
+    return list(dict.fromkeys(urls))
+
+def target_label(db_url: str) -> str:
+    """Returns 'host:port/dbname' (plus '#schema' for tenants) for a connection URL, hiding credentials."""
+    try:
+        params = parse_dsn(db_url)
+    except Exception:
+        return "<invalid url>"
+    host = params.get("host", "localhost")
+    port = params.get("port", "5432")
+    label = f"{host}:{port}/{params.get('dbname', '')}"
+    schema = tenant_schema(db_url)
+    return f"{label}#{schema}" if schema else label
+
+class TargetEcho:
+    """
+    A click.secho stand-in that prefixes every line with the target label,
+    so output from concurrent targets stays readable.
+    """
+    def __init__(self, label: str):
+        self.label = label
+        self._pending = ""
+
+    def __call__(self, message="", fg=None, nl=True):
+        # Partial lines (nl=False) are held back until the line is complete
+        self._pending += str(message)
+        if not nl:
+            return
+        for line in (self._pending.splitlines() or [""]):
+            click.secho(f"[{self.label}] {line}", fg=fg)
+        self._pending = ""
+
+def run_targets(urls: List[str], task: Callable, parallel: Optional[int] = None) -> List[TargetResult]:
+    """
+    Runs task(db_url, echo) for every URL on a bounded thread pool.
+    Each task is expected to open (and close) its own Database.
+    Results are returned in the order of `urls`.
+    """
+    def run_one(url):
+        label = target_label(url)
+        echo = TargetEcho(label)
+        started = time.monotonic()
+        try:
+            task(url, echo)
+            return TargetResult(label, True, time.monotonic() - started)
+        except (Exception, SystemExit) as e:
+            # A failure (or sys.exit) in one target must not take down the others
+            message = getattr(e, "message", None) or str(e) or e.__class__.__name__
+            echo(f"❌ Error: {message}", fg="red")
+            return TargetResult(label, False, time.monotonic() - started, message)
+
+    workers = parallel or min(DEFAULT_PARALLELISM, len(urls))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(run_one, urls))
+
+def print_report(results: List[TargetResult], wall_time: float, failures_only: bool = False):
+    """Prints one aggregated line per target (or per failed target) plus totals."""
+    click.echo("")
+    click.echo(f"{'TARGET':<40} | {'RESULT':<7} | {'TIME':>8} | {'DETAIL'}")
+    click.echo("-" * 80)
+    for r in results:
+        if failures_only and r.ok:
+            continue
+        result = "OK" if r.ok else "FAILED"
+        detail = (r.error or "").strip().split("\n")[0]
+        click.secho(f"{r.target:<40} | {result:<7} | {r.duration:>7.2f}s | {detail}",
+                    fg="green" if r.ok else "red")
+
+    failed = sum(1 for r in results if not r.ok)
+    slowest = max((r.duration for r in results), default=0.0)
+    click.echo("-" * 80)
+    click.echo(f"{len(results) - failed} succeeded, {failed} failed. "
+               f"Wall time {wall_time:.2f}s (slowest target {slowest:.2f}s).")
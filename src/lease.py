@@ -0,0 +1,131 @@
+"""
+Lease locking for transaction poolers (PgBouncer pool_mode=transaction).
+
+Session-level advisory locks need the same backend for the whole run, which
+a transaction pooler doesn't give. A lease is a row instead: taken with one
+INSERT ... ON CONFLICT, kept alive by a heartbeat and free for the taking
+once it expires, so a crashed run blocks the next one for at most the TTL.
+"""
+import os
+import secrets
+import socket
+import threading
+import time
+from typing import Optional
+import psycopg2
+
+LEASE_TTL_MS = 60000      # A lease nobody renews is free after this long
+LEASE_WAIT = 10.0         # Seconds to wait for a busy lease, like the advisory lock's lock_timeout
+POLL_INTERVAL = 0.5
+
+# Unqualified, so in tenant mode every schema gets its own lease
+LEASE_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations_lock (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        holder VARCHAR(255) NOT NULL,
+        acquired_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP NOT NULL
+    );
+"""
+
+TAKE_LEASE_SQL = """
+    INSERT INTO schema_migrations_lock (id, holder, acquired_at, expires_at)
+    VALUES (TRUE, %(holder)s, NOW(), NOW() + %(ttl_ms)s * INTERVAL '1 millisecond')
+    ON CONFLICT (id) DO UPDATE
+        SET holder = EXCLUDED.holder, acquired_at = EXCLUDED.acquired_at, expires_at = EXCLUDED.expires_at
+        WHERE schema_migrations_lock.expires_at < NOW()
+    RETURNING holder
+"""
+
+RENEW_LEASE_SQL = """
+    UPDATE schema_migrations_lock SET expires_at = NOW() + %(ttl_ms)s * INTERVAL '1 millisecond'
+    WHERE id AND holder = %(holder)s
+"""
+
+class LeaseLostError(Exception):
+    """The lease expired or was taken over while the run was still going."""
+
+class LeaseLock:
+    """
+    The migration lock as a lease row. Every statement is its own short
+    transaction, so any pooled backend will do. The heartbeat runs on a
+    connection of its own, taken from POOL, while the run's connection is busy.
+    """
+    def __init__(self, db_url: str, pool, ttl_ms: int = LEASE_TTL_MS):
+        self.db_url = db_url
+        self.pool = pool
+        self.ttl_ms = ttl_ms
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.lost: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def acquire(self, conn) -> int:
+        """Takes the lease, waiting up to LEASE_WAIT for a live one. Returns the ms spent waiting."""
+        started = time.monotonic()
+        create_lease_table(conn)
+        while True:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(TAKE_LEASE_SQL, {"holder": self.holder, "ttl_ms": self.ttl_ms})
+                    if cur.fetchone():
+                        break
+                    cur.execute("SELECT holder, expires_at FROM schema_migrations_lock")
+                    current = cur.fetchone()
+            if time.monotonic() - started >= LEASE_WAIT:
+                held_by = f" (lease held by {current['holder']} until {current['expires_at']})" if current else ""
+                raise Exception(f"Could not acquire migration lock. Is another migration running?{held_by}")
+            time.sleep(POLL_INTERVAL)
+
+        self._thread = threading.Thread(target=self._heartbeat, name="pgmigrate-lease", daemon=True)
+        self._thread.start()
+        return int((time.monotonic() - started) * 1000)
+
+    def _heartbeat(self):
+        conn = None
+        renewed = time.monotonic()
+        # Renewing at a third of the TTL leaves room for two failed attempts
+        while not self._stop.wait(self.ttl_ms / 3000):
+            try:
+                if conn is None:
+                    conn = self.pool.get(self.db_url)
+                    conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(RENEW_LEASE_SQL, {"holder": self.holder, "ttl_ms": self.ttl_ms})
+                    if cur.rowcount == 0:
+                        self.lost = "the lease expired and was taken over by another run"
+                        break
+                renewed = time.monotonic()
+            except Exception:
+                if (time.monotonic() - renewed) * 1000 >= self.ttl_ms:
+                    self.lost = f"it could not be renewed for {self.ttl_ms // 1000}s"
+                    break
+                # Transient (e.g. the pooler restarting): try again on a fresh connection
+                if conn is not None:
+                    conn.close()
+                conn = None
+        if conn is not None:
+            self.pool.put(self.db_url, conn)
+
+    def check(self):
+        """Raises if the lease was lost; call between units of work."""
+        if self.lost:
+            raise LeaseLostError(f"Lost the migration lock: {self.lost}. Stopping before the next migration.")
+
+    def release(self, conn):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        conn.rollback()
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM schema_migrations_lock WHERE id AND holder = %s", (self.holder,))
+
+def create_lease_table(conn):
+    """Creates the lease table, tolerating a concurrent run doing the same."""
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(LEASE_DDL)
+    except psycopg2.errors.UniqueViolation:
+        pass
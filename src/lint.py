@@ -0,0 +1,284 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+import psycopg2
+from .splitter import split_statements, SplitError
+from .utils import TX_CONTROL_REGEX
+
+# Rough rewrite/scan throughput used to turn table sizes into lock durations.
+# Real numbers depend on hardware, indexes and cache; this only sets the order of magnitude.
+SCAN_BYTES_PER_SEC = 100 * 1024 * 1024
+# Below this size a blocking operation is over before anyone notices
+SMALL_TABLE_BYTES = 10 * 1024 * 1024
+
+IDENT = r'(?:"(?:[^"]|"")+"|[A-Za-z_][\w$]*)'
+QUALIFIED = rf"({IDENT}(?:\s*\.\s*{IDENT})?)"
+
+CREATE_TABLE_REGEX = re.compile(
+    rf"^CREATE\s+(?:(?:GLOBAL|LOCAL)\s+)?(?:(?:TEMP|TEMPORARY|UNLOGGED)\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?{QUALIFIED}", re.I)
+CREATE_INDEX_REGEX = re.compile(
+    rf"^CREATE\s+(?:UNIQUE\s+)?INDEX\s+(CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?(?:{IDENT}\s+)?ON\s+(?:ONLY\s+)?{QUALIFIED}", re.I)
+ALTER_TABLE_REGEX = re.compile(rf"^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?{QUALIFIED}\s+(.*)$", re.I | re.S)
+CONCURRENTLY_REGEX = re.compile(r"\bCONCURRENTLY\b", re.I)
+VACUUM_FULL_REGEX = re.compile(
+    rf"^VACUUM\s*(?:\([^)]*\bFULL\b[^)]*\)|\s+FULL\b)(?:\s+(?:FREEZE|VERBOSE|ANALYZE)\b)*\s*{QUALIFIED}?", re.I)
+CLUSTER_REGEX = re.compile(rf"^CLUSTER\b(?:\s+VERBOSE\b)?\s*{QUALIFIED}?", re.I)
+REFRESH_REGEX = re.compile(rf"^REFRESH\s+MATERIALIZED\s+VIEW\s+(CONCURRENTLY\s+)?{QUALIFIED}", re.I)
+
+# ALTER TABLE sub-commands
+ADD_COLUMN_REGEX = re.compile(rf"^ADD\s+(?:COLUMN\s+)?(?:IF\s+NOT\s+EXISTS\s+)?{IDENT}\s+(.*)$", re.I | re.S)
+ALTER_TYPE_REGEX = re.compile(rf"^ALTER\s+(?:COLUMN\s+)?({IDENT})\s+(?:SET\s+DATA\s+)?TYPE\b", re.I)
+SET_NOT_NULL_REGEX = re.compile(rf"^ALTER\s+(?:COLUMN\s+)?({IDENT})\s+SET\s+NOT\s+NULL\b", re.I)
+ADD_CONSTRAINT_REGEX = re.compile(
+    rf"^ADD\s+(?:CONSTRAINT\s+{IDENT}\s+)?(CHECK|FOREIGN\s+KEY|PRIMARY\s+KEY|UNIQUE|EXCLUDE)\b", re.I)
+VOLATILE_DEFAULT_REGEX = re.compile(
+    r"\bDEFAULT\b.*\b(random|gen_random_uuid|uuid_generate_v[14]|clock_timestamp|timeofday|nextval)\s*\(", re.I | re.S)
+SERIAL_TYPE_REGEX = re.compile(r"^(small|big)?serial\b|\bGENERATED\s+(ALWAYS|BY\s+DEFAULT)\s+AS\s+(IDENTITY|\()", re.I)
+COMMENT_REGEX = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+DROP_TABLE_REGEX = re.compile(rf"^DROP\s+(?:TABLE|MATERIALIZED\s+VIEW)\s+(?:IF\s+EXISTS\s+)?{QUALIFIED}", re.I)
+TRUNCATE_REGEX = re.compile(rf"^TRUNCATE\s+(?:TABLE\s+)?(?:ONLY\s+)?{QUALIFIED}", re.I)
+LOCK_TABLE_REGEX = re.compile(rf"^LOCK\s+(?:TABLE\s+)?(?:ONLY\s+)?{QUALIFIED}(?:\s+IN\s+([A-Z ]+?)\s+MODE)?", re.I)
+CREATE_TRIGGER_REGEX = re.compile(rf"^CREATE\s+(?:OR\s+REPLACE\s+)?(?:CONSTRAINT\s+)?TRIGGER\b.*?\bON\s+{QUALIFIED}", re.I | re.S)
+REFERENCES_REGEX = re.compile(rf"\bREFERENCES\s+{QUALIFIED}", re.I)
+
+# pg_locks mode names, weakest first
+LOCK_MODES = ["AccessShareLock", "RowShareLock", "RowExclusiveLock", "ShareUpdateExclusiveLock",
+              "ShareLock", "ShareRowExclusiveLock", "ExclusiveLock", "AccessExclusiveLock"]
+
+@dataclass
+class Finding:
+    version: str
+    statement: int        # 1-based statement index in the file (0: whole file)
+    line: int
+    rule: str
+    severity: str         # 'error' (will fail), 'warning' (blocks or rewrites), 'info' (small table)
+    message: str
+    table: Optional[str] = None
+    impact: Optional[str] = None   # Filled in from pg_class when a database is reachable
+
+def _name(identifier: str) -> str:
+    """'"Foo" . bar' -> 'Foo.bar' (for display and to_regclass lookups)."""
+    parts = [p.strip() for p in re.split(r'\.(?=(?:[^"]*"[^"]*")*[^"]*$)', identifier)]
+    return ".".join(p[1:-1].replace('""', '"') if p.startswith('"') else p.lower() for p in parts)
+
+def _split_actions(text: str) -> List[str]:
+    """Splits ALTER TABLE sub-commands on commas outside parentheses."""
+    actions, depth, current = [], 0, []
+    for ch in text:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            actions.append("".join(current).strip())
+            current = []
+            continue
+        current.append(ch)
+    actions.append("".join(current).strip())
+    return [a for a in actions if a]
+
+def lint_script(script) -> List[Finding]:
+    """Static checks for one loaded MigrationScript."""
+    findings = []
+    in_transaction = not script.no_transaction or any(
+        m.group(1).upper().split()[0] in ("BEGIN", "START") for m in TX_CONTROL_REGEX.finditer(script.sql))
+    try:
+        statements = split_statements(script.sql)
+    except SplitError as e:
+        return [Finding(script.version, 0, 1, "parse-error", "error", str(e))]
+
+    created = set()   # Tables created by this migration are new and empty: nothing to block
+    for stmt in statements:
+        text = COMMENT_REGEX.sub(" ", stmt.sql).strip()
+
+        def add(rule, severity, message, table=None):
+            findings.append(Finding(script.version, stmt.index, stmt.line, rule, severity, message, table))
+
+        match = CREATE_TABLE_REGEX.match(text)
+        if match:
+            created.add(_name(match.group(1)))
+            continue
+
+        if CONCURRENTLY_REGEX.search(text) and in_transaction:
+            add("concurrently-in-transaction", "error",
+                "CONCURRENTLY cannot run inside a transaction block; use '-- migration: no-transaction' "
+                "and drop the BEGIN/COMMIT wrapper.")
+
+        match = CREATE_INDEX_REGEX.match(text)
+        if match:
+            table = _name(match.group(2))
+            if not match.group(1) and table not in created:
+                add("index-not-concurrent", "warning",
+                    f"CREATE INDEX blocks writes to {table} for the whole build; use CREATE INDEX CONCURRENTLY.", table)
+            continue
+
+        match = REFRESH_REGEX.match(text)
+        if match:
+            if not match.group(1):
+                add("refresh-not-concurrent", "warning",
+                    f"REFRESH MATERIALIZED VIEW locks {_name(match.group(2))} against reads; "
+                    "consider REFRESH ... CONCURRENTLY.", _name(match.group(2)))
+            continue
+
+        match = VACUUM_FULL_REGEX.match(text) or CLUSTER_REGEX.match(text)
+        if match:
+            table = _name(match.group(1)) if match.group(1) else None
+            add("table-rewrite", "warning",
+                f"{text.split()[0].upper()} rewrites {table or 'every table'} under an ACCESS EXCLUSIVE lock.", table)
+            continue
+
+        match = ALTER_TABLE_REGEX.match(text)
+        if not match:
+            continue
+        table = _name(match.group(1))
+        if table in created:
+            continue
+        for action in _split_actions(match.group(2)):
+            constraint = ADD_CONSTRAINT_REGEX.match(action)
+            if constraint:
+                kind = constraint.group(1).upper()
+                if kind in ("CHECK", "FOREIGN KEY") and not re.search(r"\bNOT\s+VALID\b", action, re.I):
+                    add("constraint-without-not-valid", "warning",
+                        f"ADD {kind} scans {table} under lock; add it NOT VALID, then VALIDATE CONSTRAINT "
+                        "in a later migration.", table)
+                elif kind in ("PRIMARY KEY", "UNIQUE", "EXCLUDE") and not re.search(r"\bUSING\s+INDEX\b", action, re.I):
+                    add("constraint-builds-index", "warning",
+                        f"ADD {kind} builds an index on {table} under an ACCESS EXCLUSIVE lock; build it "
+                        "CONCURRENTLY first and attach it with USING INDEX.", table)
+                continue
+
+            column = ADD_COLUMN_REGEX.match(action)
+            if column:
+                definition = column.group(1)
+                if VOLATILE_DEFAULT_REGEX.search(definition) or SERIAL_TYPE_REGEX.search(definition):
+                    add("volatile-default", "warning",
+                        f"Adding a column with a volatile default, serial or generated value rewrites {table}; "
+                        "add it without a default and backfill in chunks.", table)
+                continue
+
+            if ALTER_TYPE_REGEX.match(action):
+                add("column-type-change", "warning",
+                    f"ALTER COLUMN ... TYPE usually rewrites {table} and its indexes under an ACCESS EXCLUSIVE lock.", table)
+            elif SET_NOT_NULL_REGEX.match(action):
+                add("set-not-null", "warning",
+                    f"SET NOT NULL scans {table} under an ACCESS EXCLUSIVE lock unless a validated "
+                    "CHECK (col IS NOT NULL) constraint already exists.", table)
+    return findings
+
+def _lock_mode(words: str) -> str:
+    """'SHARE ROW EXCLUSIVE' -> 'ShareRowExclusiveLock'."""
+    return "".join(w.capitalize() for w in words.split()) + "Lock"
+
+def lock_requirements(script) -> Dict[str, str]:
+    """
+    The table-level locks a migration's statements will take, as
+    {'public.users': 'AccessExclusiveLock'} (strongest mode per table).
+    Tables created by the migration itself are left out: nobody else can hold them.
+    """
+    try:
+        statements = split_statements(script.sql)
+    except SplitError:
+        return {}
+    needed, created = {}, set()
+
+    def need(identifier, mode):
+        table = _name(identifier)
+        if table in created:
+            return
+        current = needed.get(table)
+        if current is None or LOCK_MODES.index(mode) > LOCK_MODES.index(current):
+            needed[table] = mode
+
+    for stmt in statements:
+        text = COMMENT_REGEX.sub(" ", stmt.sql).strip()
+        match = CREATE_TABLE_REGEX.match(text)
+        if match:
+            created.add(_name(match.group(1)))
+            for ref in REFERENCES_REGEX.finditer(text):
+                need(ref.group(1), "ShareRowExclusiveLock")
+            continue
+        match = CREATE_INDEX_REGEX.match(text)
+        if match:
+            need(match.group(2), "ShareUpdateExclusiveLock" if match.group(1) else "ShareLock")
+            continue
+        match = REFRESH_REGEX.match(text)
+        if match:
+            need(match.group(2), "ExclusiveLock" if match.group(1) else "AccessExclusiveLock")
+            continue
+        match = LOCK_TABLE_REGEX.match(text)
+        if match:
+            need(match.group(1), _lock_mode(match.group(2)) if match.group(2) else "AccessExclusiveLock")
+            continue
+        match = CREATE_TRIGGER_REGEX.match(text)
+        if match:
+            need(match.group(1), "ShareRowExclusiveLock")
+            continue
+        match = (ALTER_TABLE_REGEX.match(text) or DROP_TABLE_REGEX.match(text) or TRUNCATE_REGEX.match(text)
+                 or VACUUM_FULL_REGEX.match(text) or CLUSTER_REGEX.match(text))
+        if match and match.group(1):
+            # Some ALTER TABLE forms take weaker locks; planning for the strongest is the safe side
+            need(match.group(1), "AccessExclusiveLock")
+            for ref in REFERENCES_REGEX.finditer(text):
+                need(ref.group(1), "ShareRowExclusiveLock")
+    return needed
+
+def table_sizes(conn, tables) -> Dict[str, dict]:
+    """pg_class estimates for the given tables: {'users': {'rows': 1200, 'bytes': 81920}}."""
+    sizes = {}
+    with conn.cursor() as cur:
+        for table in sorted(set(tables)):
+            cur.execute("""
+                SELECT GREATEST(c.reltuples, 0)::bigint AS rows, pg_total_relation_size(c.oid) AS bytes
+                FROM pg_class c WHERE c.oid = to_regclass(%s)
+            """, (table,))
+            row = cur.fetchone()
+            if row:
+                sizes[table] = row
+    conn.commit()
+    return sizes
+
+def format_bytes(n) -> str:
+    sign, n = ("-" if n < 0 else ""), abs(n)   # Negative for shrinking sizes (see rehearse)
+    for unit in ("B", "kB", "MB", "GB"):
+        if n < 1024:
+            return f"{sign}{n:.0f} {unit}"
+        n /= 1024
+    return f"{sign}{n:.1f} TB"
+
+def estimate_impact(findings: List[Finding], conn):
+    """Adds size-based impact notes; findings on tiny tables are downgraded to 'info'."""
+    tables = [f.table for f in findings if f.table]
+    if not tables:
+        return
+    try:
+        sizes = table_sizes(conn, tables)
+    except psycopg2.Error:
+        conn.rollback()
+        return
+    for finding in findings:
+        size = sizes.get(finding.table)
+        if not size:
+            continue
+        seconds = size['bytes'] / SCAN_BYTES_PER_SEC
+        finding.impact = (f"{finding.table}: ~{size['rows']:,} rows, {format_bytes(size['bytes'])} "
+                          f"(roughly {seconds:.0f}s at {format_bytes(SCAN_BYTES_PER_SEC)}/s)")
+        if finding.severity == "warning" and size['bytes'] < SMALL_TABLE_BYTES:
+            finding.severity = "info"
+
+def lint_scripts(scripts, conn=None) -> List[Finding]:
+    """Lints loaded MigrationScripts, adding pg_class estimates when CONN is given."""
+    findings = [f for script in scripts for f in lint_script(script)]
+    if conn is not None:
+        estimate_impact(findings, conn)
+    return findings
+
+SEVERITY_ICONS = {"error": "❌", "warning": "⚠️ ", "info": "ℹ️ "}
+SEVERITY_COLORS = {"error": "red", "warning": "yellow", "info": None}
+
+def print_findings(findings: List[Finding], echo):
+    for f in findings:
+        where = f"statement {f.statement}, line {f.line}" if f.statement else f"line {f.line}"
+        echo(f"{SEVERITY_ICONS[f.severity]} {f.version} ({where}) [{f.rule}] {f.message}",
+             fg=SEVERITY_COLORS[f.severity])
+        if f.impact:
+            echo(f"     ↳ {f.impact}", fg=SEVERITY_COLORS[f.severity])
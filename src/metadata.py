@@ -0,0 +1,183 @@
+import getpass
+import os
+import socket
+import psycopg2
+from psycopg2.extras import execute_values
+from .progress import PROGRESS_DDL
+from .utils import fingerprint_checksums
+
+# Layout of the bookkeeping table. Columns after 'batch' were added later and
+# are back-filled onto older tables by upgrade_metadata().
+SCHEMA_MIGRATIONS_DDL = """
+    CREATE TABLE schema_migrations (
+        version VARCHAR(255) PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        checksum VARCHAR(64) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        batch INTEGER NOT NULL DEFAULT 1,
+        duration_ms INTEGER,
+        lock_wait_ms INTEGER,
+        applied_by VARCHAR(255),
+        tx_mode VARCHAR(16)
+    );
+"""
+
+METRIC_COLUMNS = {
+    "duration_ms": "INTEGER",
+    "lock_wait_ms": "INTEGER",
+    "applied_by": "VARCHAR(255)",
+    "tx_mode": "VARCHAR(16)",
+}
+
+# Every up/down execution, kept after the schema_migrations row is gone
+HISTORY_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations_history (
+        id BIGSERIAL PRIMARY KEY,
+        version VARCHAR(255) NOT NULL,
+        name VARCHAR(255),
+        direction VARCHAR(4) NOT NULL,
+        batch INTEGER,
+        duration_ms INTEGER,
+        lock_wait_ms INTEGER,
+        applied_by VARCHAR(255),
+        tx_mode VARCHAR(16),
+        executed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+# Single row holding the fingerprint of schema_migrations after the last
+# successful run, so callers can tell "up to date" with one query and no lock
+STATE_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations_state (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        fingerprint VARCHAR(64),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+def client_identity() -> str:
+    """Who is running the migration: PGMIGRATE_CLIENT, or user@host."""
+    override = os.getenv("PGMIGRATE_CLIENT")
+    if override:
+        return override[:255]
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = "unknown"
+    return f"{user}@{socket.gethostname()}"[:255]
+
+def create_metadata(conn):
+    """Creates schema_migrations (current layout) and its companions if missing."""
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations') AS migrations")
+            if not cur.fetchone()['migrations']:
+                cur.execute(SCHEMA_MIGRATIONS_DDL)
+    upgrade_metadata(conn)
+
+def upgrade_metadata(conn, echo=None) -> list:
+    """
+    Brings an existing schema_migrations table up to the current layout and
+    creates the history, state and progress tables. Only takes DDL locks when something is missing.
+    Returns the names of the columns that were added.
+    """
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_migrations') AS migrations")
+            if not cur.fetchone()['migrations']:
+                # Not initialized; callers report that on their own
+                return []
+
+            cur.execute("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = 'schema_migrations'
+            """)
+            existing = {row['column_name'] for row in cur.fetchall()}
+            missing = [c for c in METRIC_COLUMNS if c not in existing]
+            for column in missing:
+                cur.execute(f"ALTER TABLE schema_migrations ADD COLUMN IF NOT EXISTS {column} {METRIC_COLUMNS[column]}")
+
+            cur.execute("SELECT to_regclass('schema_migrations_history') AS history, "
+                        "to_regclass('schema_migrations_state') AS state, "
+                        "to_regclass('schema_migrations_progress') AS progress")
+            row = cur.fetchone()
+            if not row['history']:
+                cur.execute(HISTORY_DDL)
+            if not row['state']:
+                cur.execute(STATE_DDL)
+            if not row['progress']:
+                cur.execute(PROGRESS_DDL)
+
+    if missing and echo:
+        echo(f"⬆️  Upgraded 'schema_migrations' (added {', '.join(missing)}).")
+    return missing
+
+def record_applied(cur, rows, lock_wait_ms, applied_by):
+    """
+    Inserts schema_migrations and history rows for applied migrations.
+    rows: (version, name, checksum, batch, duration_ms, tx_mode) tuples.
+    """
+    execute_values(cur, """
+        INSERT INTO schema_migrations
+            (version, name, checksum, applied_at, batch, duration_ms, lock_wait_ms, applied_by, tx_mode)
+        VALUES %s
+    """, [(v, n, c, b, d, lock_wait_ms, applied_by, m) for v, n, c, b, d, m in rows],
+        template="(%s, %s, %s, NOW(), %s, %s, %s, %s, %s)", page_size=max(1, len(rows)))
+    execute_values(cur, """
+        INSERT INTO schema_migrations_history
+            (version, name, direction, batch, duration_ms, lock_wait_ms, applied_by, tx_mode)
+        VALUES %s
+    """, [(v, n, 'up', b, d, lock_wait_ms, applied_by, m) for v, n, c, b, d, m in rows],
+        page_size=max(1, len(rows)))
+
+def record_reverted(cur, version, duration_ms, lock_wait_ms, applied_by, tx_mode):
+    """Deletes the schema_migrations row and logs the revert in the history table."""
+    cur.execute("""
+        DELETE FROM schema_migrations WHERE version = %s
+        RETURNING name, batch
+    """, (version,))
+    row = cur.fetchone() or {'name': None, 'batch': None}
+    cur.execute("""
+        INSERT INTO schema_migrations_history
+            (version, name, direction, batch, duration_ms, lock_wait_ms, applied_by, tx_mode)
+        VALUES (%s, %s, 'down', %s, %s, %s, %s, %s)
+    """, (version, row['name'], row['batch'], duration_ms, lock_wait_ms, applied_by, tx_mode))
+
+def read_fingerprint(conn):
+    """The stored fingerprint, or None if there is none (or no state table yet)."""
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT fingerprint FROM schema_migrations_state")
+                row = cur.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        return None
+    return row['fingerprint'] if row else None
+
+def read_applied_versions(conn) -> set:
+    """Versions in schema_migrations, read without the lock (empty if there is no table yet)."""
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM schema_migrations")
+                return {row['version'] for row in cur.fetchall()}
+    except psycopg2.errors.UndefinedTable:
+        return set()
+
+def save_fingerprint(conn):
+    """Stores the fingerprint of what schema_migrations currently holds."""
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT version, checksum FROM schema_migrations")
+            fingerprint = fingerprint_checksums((r['version'], r['checksum']) for r in cur.fetchall())
+            cur.execute("""
+                INSERT INTO schema_migrations_state (id, fingerprint, updated_at) VALUES (TRUE, %s, NOW())
+                ON CONFLICT (id) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, updated_at = NOW()
+            """, (fingerprint,))
+
+def clear_fingerprint(conn):
+    """Forgets the stored fingerprint before schema_migrations changes, so an
+    interrupted run can never look up to date."""
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM schema_migrations_state")
@@ -0,0 +1,177 @@
+"""
+Live progress for long statements, read from a side connection while the
+migration connection is busy, plus the JSON-lines event stream (--events).
+"""
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Callable, Optional
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+# pg_stat_progress_cluster needs PostgreSQL 12; older servers fall back to ACTIVITY_QUERY
+PROGRESS_QUERY = """
+    SELECT a.wait_event_type, a.wait_event, a.state, pg_blocking_pids(a.pid) AS blocked_by,
+           EXTRACT(EPOCH FROM clock_timestamp() - a.query_start) AS running_s,
+           ci.command AS index_command, ci.phase AS index_phase,
+           ci.blocks_total AS index_blocks_total, ci.blocks_done AS index_blocks_done,
+           ci.tuples_total AS index_tuples_total, ci.tuples_done AS index_tuples_done,
+           ci.lockers_total, ci.lockers_done, ci.current_locker_pid,
+           cl.command AS cluster_command, cl.phase AS cluster_phase,
+           cl.heap_blks_total AS cluster_blocks_total, cl.heap_blks_scanned AS cluster_blocks_done,
+           cl.heap_tuples_scanned AS cluster_tuples_done,
+           v.phase AS vacuum_phase,
+           v.heap_blks_total AS vacuum_blocks_total, v.heap_blks_scanned AS vacuum_blocks_done
+    FROM pg_stat_activity a
+    LEFT JOIN pg_stat_progress_create_index ci ON ci.pid = a.pid
+    LEFT JOIN pg_stat_progress_cluster cl ON cl.pid = a.pid
+    LEFT JOIN pg_stat_progress_vacuum v ON v.pid = a.pid
+    WHERE a.pid = %s
+"""
+
+ACTIVITY_QUERY = """
+    SELECT a.wait_event_type, a.wait_event, a.state, pg_blocking_pids(a.pid) AS blocked_by,
+           EXTRACT(EPOCH FROM clock_timestamp() - a.query_start) AS running_s
+    FROM pg_stat_activity a
+    WHERE a.pid = %s
+"""
+
+def summarize(row: dict) -> dict:
+    """Flattens one poll into {command, phase, done, total, unit, wait, blocked_by, running_s}."""
+    snapshot = {
+        "command": None, "phase": None, "done": None, "total": None, "unit": None,
+        "wait": f"{row['wait_event_type']}:{row['wait_event']}" if row.get('wait_event_type') else None,
+        "blocked_by": list(row.get('blocked_by') or []),
+        "running_s": round(float(row['running_s'] or 0), 1),
+    }
+    for view, command in (("index", row.get("index_command")), ("cluster", row.get("cluster_command")),
+                          ("vacuum", "VACUUM" if row.get("vacuum_phase") else None)):
+        if not command:
+            continue
+        snapshot["command"], snapshot["phase"] = command, row[f"{view}_phase"]
+        # Block counts when the phase has them, tuples otherwise (e.g. index 'loading tuples in tree')
+        blocks_total = row.get(f"{view}_blocks_total") or 0
+        tuples_total = row.get(f"{view}_tuples_total") or 0
+        if blocks_total:
+            snapshot.update(done=row[f"{view}_blocks_done"], total=blocks_total, unit="blocks")
+        elif tuples_total:
+            snapshot.update(done=row[f"{view}_tuples_done"], total=tuples_total, unit="tuples")
+        if view == "index" and row.get("lockers_total"):
+            snapshot["lockers"] = {"done": row["lockers_done"], "total": row["lockers_total"],
+                                   "current_pid": row["current_locker_pid"]}
+        break
+    return snapshot
+
+class ProgressMonitor:
+    """
+    Polls the progress views for one backend every INTERVAL seconds on its
+    own thread and connection, handing each snapshot to report().
+    Monitoring is best effort: any error just ends it.
+    """
+    def __init__(self, db_url: str, pid: int, interval: float, report: Callable[[dict], None]):
+        self.db_url = db_url
+        self.pid = pid
+        self.interval = interval
+        self.report = report
+        self._stop = threading.Event()
+        self._phase = None       # (command, phase, unit) the ETA baseline belongs to
+        self._first = None       # (monotonic time, done) at the start of that phase
+        self._thread = threading.Thread(target=self._run, name=f"pgmigrate-progress-{pid}", daemon=True)
+
+    def start(self) -> "ProgressMonitor":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _eta(self, snapshot) -> Optional[float]:
+        phase = (snapshot["command"], snapshot["phase"], snapshot["unit"])
+        now = time.monotonic()
+        if phase != self._phase or snapshot["done"] is None:
+            self._phase, self._first = phase, (now, snapshot["done"])
+            return None
+        started, first_done = self._first
+        rate = (snapshot["done"] - first_done) / (now - started) if now > started else 0
+        if rate <= 0:
+            return None
+        return round((snapshot["total"] - snapshot["done"]) / rate, 1)
+
+    def _run(self):
+        conn = None
+        query = PROGRESS_QUERY
+        try:
+            # Nothing is opened for statements that finish within one interval
+            while not self._stop.wait(self.interval):
+                if conn is None:
+                    conn = psycopg2.connect(self.db_url, cursor_factory=RealDictCursor)
+                    conn.autocommit = True
+                with conn.cursor() as cur:
+                    try:
+                        cur.execute(query, (self.pid,))
+                    except psycopg2.errors.UndefinedTable:
+                        query = ACTIVITY_QUERY
+                        cur.execute(query, (self.pid,))
+                    row = cur.fetchone()
+                if not row or row['state'] != 'active' or self._stop.is_set():
+                    continue
+                snapshot = summarize(row)
+                if snapshot["total"]:
+                    snapshot["percent"] = round(100.0 * snapshot["done"] / snapshot["total"], 1)
+                snapshot["eta_s"] = self._eta(snapshot)
+                self.report(snapshot)
+        except Exception:
+            pass
+        finally:
+            if conn is not None:
+                conn.close()
+
+def format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds // 60 % 60:02d}m"
+
+def describe(snapshot: dict) -> str:
+    """One console line for a snapshot."""
+    parts = []
+    if snapshot["command"]:
+        parts.append(f"{snapshot['command']}: {snapshot['phase']}")
+    if snapshot["total"]:
+        parts.append(f"{snapshot['done']:,}/{snapshot['total']:,} {snapshot['unit']} ({snapshot['percent']:.0f}%)")
+    if snapshot.get("eta_s") is not None:
+        parts.append(f"ETA {format_seconds(snapshot['eta_s'])}")
+    lockers = snapshot.get("lockers")
+    if lockers:
+        parts.append(f"waiting for old transactions {lockers['done']}/{lockers['total']}"
+                     + (f" (pid {lockers['current_pid']})" if lockers['current_pid'] else ""))
+    if snapshot["blocked_by"]:
+        parts.append(f"blocked by pid {', '.join(str(p) for p in snapshot['blocked_by'])}")
+    elif snapshot["wait"] and not snapshot["command"]:
+        parts.append(f"waiting on {snapshot['wait']}")
+    if not parts:
+        parts.append("running (no progress view for this statement)")
+    return f"{', '.join(parts)} — {format_seconds(snapshot['running_s'])} elapsed"
+
+class EventStream:
+    """
+    Appends one JSON object per line to a file. Each event is a single
+    O_APPEND write, so several targets can share one file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def emit(self, event: str, **fields):
+        record = {"ts": datetime.datetime.now(datetime.timezone.utc).isoformat(), "event": event, **fields}
+        os.write(self._fd, (json.dumps(record, default=str) + "\n").encode())
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
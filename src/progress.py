@@ -0,0 +1,84 @@
+import re
+from psycopg2 import sql
+
+# Statements of a no-transaction migration that have already been committed.
+# A row exists only while a migration is partially applied. Created by upgrade_metadata().
+PROGRESS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations_progress (
+        version VARCHAR(255) PRIMARY KEY,
+        checksum VARCHAR(64) NOT NULL,
+        statements_done INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+INVALID_INDEX_POLICIES = ("drop", "reindex", "fail")
+
+CONCURRENT_INDEX_REGEX = re.compile(
+    r'^CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?("(?:[^"]|"")+"|[A-Za-z_][\w$]*)\s+'
+    r'ON\s+(?:ONLY\s+)?((?:"(?:[^"]|"")+"|[A-Za-z_][\w$]*)(?:\s*\.\s*(?:"(?:[^"]|"")+"|[A-Za-z_][\w$]*))?)',
+    re.IGNORECASE)
+
+def load_progress(conn, version, checksum) -> int:
+    """Statements already done by an interrupted run of VERSION (0 if none)."""
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT checksum, statements_done FROM schema_migrations_progress WHERE version = %s",
+                        (version,))
+            row = cur.fetchone()
+    if not row:
+        return 0
+    if row['checksum'] != checksum:
+        raise Exception(
+            f"{version} was partially applied from a different version of the file "
+            f"({row['statements_done']} statements done). Undo them by hand, then: "
+            f"DELETE FROM schema_migrations_progress WHERE version = '{version}'")
+    return row['statements_done']
+
+def save_progress(cur, version, checksum, statements_done):
+    cur.execute("""
+        INSERT INTO schema_migrations_progress (version, checksum, statements_done, updated_at)
+        VALUES (%s, %s, %s, NOW())
+        ON CONFLICT (version) DO UPDATE
+        SET statements_done = EXCLUDED.statements_done, updated_at = NOW()
+    """, (version, checksum, statements_done))
+
+def clear_progress(cur, version):
+    cur.execute("DELETE FROM schema_migrations_progress WHERE version = %s", (version,))
+
+def _unquote(identifier):
+    identifier = identifier.strip()
+    if identifier.startswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier.lower()
+
+def invalid_indexes(cur, statements):
+    """
+    INVALID indexes (pg_index.indisvalid = false) named by CREATE INDEX CONCURRENTLY
+    statements in STATEMENTS, i.e. leftovers of a build that failed part-way.
+    Returns (statement, qualified index name) pairs.
+    """
+    found = []
+    for stmt in statements:
+        match = CONCURRENT_INDEX_REGEX.match(stmt.sql)
+        if not match:
+            continue
+        table = ".".join(_unquote(part) for part in re.split(r"\s*\.\s*(?=(?:[^\"]*\"[^\"]*\")*[^\"]*$)", match.group(2)))
+        cur.execute("""
+            SELECT format('%%I.%%I', n.nspname, c.relname) AS name
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE NOT i.indisvalid AND c.relname = %s AND i.indrelid = to_regclass(%s)
+        """, (_unquote(match.group(1)), table))
+        row = cur.fetchone()
+        if row:
+            found.append((stmt, row['name']))
+    return found
+
+def repair_invalid_index(cur, name, policy):
+    """'drop' removes the index so its CREATE runs again; 'reindex' rebuilds it in place."""
+    if policy == "drop":
+        cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.SQL(name)))
+    elif policy == "reindex":
+        cur.execute(sql.SQL("REINDEX INDEX CONCURRENTLY {}").format(sql.SQL(name)))
@@ -0,0 +1,138 @@
+"""
+pytest plugin that hands out databases already migrated to the latest version.
+
+The migrations are applied once to a template database named after the
+migrations directory and a fingerprint of the migration set; tests get cheap
+copies made with CREATE DATABASE ... TEMPLATE. The template is rebuilt only when
+a migration file (or the baseline) changes.
+
+It is opt-in: enable it with '-p src.pytest_plugin' or
+'pytest_plugins = ["src.pytest_plugin"]' in a conftest.py, and point it at a
+server with --pgmigrate-url or PGMIGRATE_TEST_DATABASE_URL.
+"""
+import hashlib
+import os
+import re
+import secrets
+import psycopg2
+import pytest
+from psycopg2 import sql
+from .commands import migrate_new_database
+from .config import RunConfig
+from .db import pool, url_for_database, create_database, drop_database
+from .utils import get_migrations, migration_fingerprint, calculate_file_hash, BASELINE_FILENAME
+
+TEMPLATE_PREFIX = "pgmigrate_tpl_"
+CLONE_PREFIX = "pgmigrate_test_"
+# Serializes template builds across xdist workers and concurrent test runs
+TEMPLATE_LOCK_ID = 4294967294
+
+def template_prefix(migrations_dir="migrations") -> str:
+    """Prefix of every template built from MIGRATIONS_DIR, so projects sharing a server keep theirs apart."""
+    directory = hashlib.sha256(os.path.abspath(migrations_dir).encode()).hexdigest()
+    return f"{TEMPLATE_PREFIX}{directory[:8]}_"
+
+def template_name(migrations_dir="migrations") -> str:
+    """Template database name for the current contents of MIGRATIONS_DIR."""
+    fingerprint = migration_fingerprint(get_migrations(migrations_dir))
+    baseline = os.path.join(migrations_dir, BASELINE_FILENAME)
+    if os.path.exists(baseline):
+        fingerprint = hashlib.sha256(f"{fingerprint} {calculate_file_hash(baseline)}".encode()).hexdigest()
+    return f"{template_prefix(migrations_dir)}{fingerprint[:16]}"
+
+def ensure_template(server_url, migrations_dir="migrations") -> str:
+    """
+    Returns the name of a fully migrated template database, building it first if
+    no template matches the current migrations. Stale templates are dropped.
+    """
+    name = template_name(migrations_dir)
+    conn = psycopg2.connect(server_url)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (TEMPLATE_LOCK_ID,))
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s AND datistemplate", (name,))
+            if cur.fetchone():
+                return name
+
+            # Build under a temporary name so a half-migrated template is never used
+            building = f"{name}_{secrets.token_hex(3)}"
+            try:
+                migrate_new_database(server_url, building, RunConfig(migrations_dir=migrations_dir))
+                # RENAME needs the database to have no sessions, idle pooled ones included
+                pool.close_all(building)
+                cur.execute(sql.SQL("ALTER DATABASE {} RENAME TO {}").format(
+                    sql.Identifier(building), sql.Identifier(name)))
+            except Exception:
+                drop_database(server_url, building)
+                raise
+            cur.execute(sql.SQL("ALTER DATABASE {} IS_TEMPLATE true").format(sql.Identifier(name)))
+
+            # Only finished templates of this migrations directory: '<prefix><fingerprint>', never
+            # another run's '<name>_<hex>' build or another project's templates
+            finished = re.compile(re.escape(template_prefix(migrations_dir)) + r"[0-9a-f]{16}")
+            cur.execute("SELECT datname FROM pg_database WHERE datistemplate AND datname <> %s", (name,))
+            for (stale,) in cur.fetchall():
+                if not finished.fullmatch(stale):
+                    continue
+                try:
+                    cur.execute(sql.SQL("ALTER DATABASE {} IS_TEMPLATE false").format(sql.Identifier(stale)))
+                    drop_database(server_url, stale, terminate=False)
+                except psycopg2.errors.ObjectInUse:
+                    # Still being copied by another run: keep it a template; the next build retries
+                    cur.execute(sql.SQL("ALTER DATABASE {} IS_TEMPLATE true").format(sql.Identifier(stale)))
+            return name
+    finally:
+        conn.close()
+
+def clone_template(server_url, template, label="") -> str:
+    """Creates a fresh copy of TEMPLATE and returns its URL."""
+    name = f"{CLONE_PREFIX}{label}{secrets.token_hex(4)}"
+    create_database(server_url, name, template=template)
+    return url_for_database(server_url, name)
+
+def drop_clone(server_url, clone_url):
+    drop_database(server_url, psycopg2.extensions.parse_dsn(clone_url)['dbname'])
+
+def pytest_addoption(parser):
+    group = parser.getgroup("pgmigrate")
+    group.addoption("--pgmigrate-url", default=None,
+                    help="Server to build test databases on (default: PGMIGRATE_TEST_DATABASE_URL).")
+    group.addoption("--pgmigrate-migrations", default=None,
+                    help="Migrations directory (default: 'migrations').")
+    parser.addini("pgmigrate_url", "Server to build test databases on.")
+    parser.addini("pgmigrate_migrations", "Migrations directory.", default="migrations")
+
+@pytest.fixture(scope="session")
+def pgmigrate_server_url(pytestconfig):
+    url = (pytestconfig.getoption("pgmigrate_url") or pytestconfig.getini("pgmigrate_url")
+           or os.getenv("PGMIGRATE_TEST_DATABASE_URL"))
+    if not url:
+        pytest.skip("No test server configured (--pgmigrate-url or PGMIGRATE_TEST_DATABASE_URL)")
+    return url
+
+@pytest.fixture(scope="session")
+def pgmigrate_template(pytestconfig, pgmigrate_server_url):
+    """Name of the migrated template database (built at most once per migration set)."""
+    migrations_dir = (pytestconfig.getoption("pgmigrate_migrations")
+                      or pytestconfig.getini("pgmigrate_migrations"))
+    return ensure_template(pgmigrate_server_url, migrations_dir)
+
+def _worker_label(request):
+    # 'gw3_' under pytest-xdist, '' otherwise
+    worker = getattr(request.config, "workerinput", {}).get("workerid")
+    return f"{worker}_" if worker else ""
+
+@pytest.fixture(scope="session")
+def pgmigrate_worker_db(request, pgmigrate_server_url, pgmigrate_template):
+    """URL of one migrated database per test process (xdist worker), shared by its tests."""
+    url = clone_template(pgmigrate_server_url, pgmigrate_template, _worker_label(request))
+    yield url
+    drop_clone(pgmigrate_server_url, url)
+
+@pytest.fixture
+def pgmigrate_db(request, pgmigrate_server_url, pgmigrate_template):
+    """URL of a freshly migrated database that is dropped after the test."""
+    url = clone_template(pgmigrate_server_url, pgmigrate_template, _worker_label(request))
+    yield url
+    drop_clone(pgmigrate_server_url, url)
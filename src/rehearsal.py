@@ -0,0 +1,190 @@
+"""
+Rehearsals: pending migrations applied to a disposable clone of the target,
+measuring per migration how long it took, the WAL it generated, the table
+locks it held and how table sizes changed, to size maintenance windows.
+"""
+import subprocess
+import tempfile
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from .db import create_database, url_for_database, pool
+from .executor import ExecutionLog
+from .lint import LOCK_MODES, format_bytes
+
+# Relations whose size is tracked: tables and materialized views, with their indexes and TOAST
+RELATION_SIZES_QUERY = """
+    SELECT c.oid::regclass::text AS relation, pg_total_relation_size(c.oid) AS bytes
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'm', 'p')
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast')
+      AND c.relname NOT LIKE 'schema\\_migrations%%'
+"""
+
+# Table locks held by the other sessions in the clone, which are all the rehearsal's own
+HELD_LOCKS_QUERY = """
+    SELECT c.oid::regclass::text AS relation, l.mode
+    FROM pg_locks l
+    JOIN pg_class c ON c.oid = l.relation
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE l.locktype = 'relation' AND l.granted
+      AND l.database = (SELECT oid FROM pg_database WHERE datname = current_database())
+      AND l.pid <> pg_backend_pid()
+      AND c.relkind IN ('r', 'm', 'p')
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast')
+      AND c.relname NOT LIKE 'schema\\_migrations%%'
+"""
+
+LOCK_SAMPLE_INTERVAL = 0.02   # Seconds; locks held for less than this may go unseen
+
+@dataclass
+class RehearsalResult:
+    version: str
+    mode: str
+    status: str = "running"
+    duration_ms: float = 0.0
+    wal_bytes: int = 0
+    locks: Dict[str, str] = field(default_factory=dict)          # {table: strongest mode held}
+    size_changes: Dict[str, List[Optional[int]]] = field(default_factory=dict)  # {table: [before, after]}
+    error: Optional[str] = None
+
+class LockSampler:
+    """
+    Polls pg_locks in the clone on a thread of its own, keeping the strongest mode seen per table.
+    Its connection comes from the pool, so one sampler after another reuses it.
+    """
+    def __init__(self, db_url: str, interval: float = LOCK_SAMPLE_INTERVAL):
+        self.db_url = db_url
+        self.interval = interval
+        self.locks: Dict[str, str] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pgmigrate-lock-sampler", daemon=True)
+
+    def start(self) -> "LockSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> Dict[str, str]:
+        self._stop.set()
+        self._thread.join()
+        return self.locks
+
+    def _run(self):
+        conn = pool.get(self.db_url)
+        conn.autocommit = True
+        try:
+            while True:
+                with conn.cursor() as cur:
+                    cur.execute(HELD_LOCKS_QUERY)
+                    for row in cur.fetchall():
+                        if row['mode'] not in LOCK_MODES:
+                            continue
+                        current = self.locks.get(row['relation'])
+                        if current is None or LOCK_MODES.index(row['mode']) > LOCK_MODES.index(current):
+                            self.locks[row['relation']] = row['mode']
+                if self._stop.wait(self.interval):
+                    break
+        finally:
+            pool.put(self.db_url, conn)
+
+class RehearsalLog(ExecutionLog):
+    """
+    An ExecutionLog that measures every migration it records: WAL and table
+    sizes before and after on a side connection, locks through a LockSampler.
+    """
+    def __init__(self, clone_url: str, echo, verbose=False):
+        super().__init__(echo, verbose)
+        self.clone_url = clone_url
+        self.results: List[RehearsalResult] = []
+        self._conn = psycopg2.connect(clone_url, cursor_factory=RealDictCursor)
+        self._conn.autocommit = True
+        self._open = {}   # version -> (result, start lsn, sizes before, sampler)
+
+    def begin(self, version, direction, mode):
+        # A lock retry restarts the record but keeps measuring from the first attempt
+        if version not in self._open:
+            result = RehearsalResult(version, mode)
+            self.results.append(result)
+            self._open[version] = (result, self._lsn(), self._sizes(), LockSampler(self.clone_url).start())
+        super().begin(version, direction, mode)
+
+    def end(self, versions, status="ok", error=None):
+        super().end(versions, status, error)
+        for version in [v for v in self._open if v in versions]:
+            result, lsn, before, sampler = self._open.pop(version)
+            result.locks = sampler.stop()
+            record = self.records_for(version)
+            result.status, result.error = status, error
+            result.duration_ms = round(record.duration_ms, 1) if record else 0.0
+            with self._conn.cursor() as cur:
+                cur.execute("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), %s)::bigint AS bytes", (lsn,))
+                result.wal_bytes = int(cur.fetchone()['bytes'])
+            after = self._sizes()
+            result.size_changes = {rel: [before.get(rel), after.get(rel)]
+                                   for rel in sorted(set(before) | set(after)) if before.get(rel) != after.get(rel)}
+
+    def _lsn(self) -> str:
+        with self._conn.cursor() as cur:
+            cur.execute("SELECT pg_current_wal_insert_lsn()::text AS lsn")
+            return cur.fetchone()['lsn']
+
+    def _sizes(self) -> Dict[str, int]:
+        with self._conn.cursor() as cur:
+            cur.execute(RELATION_SIZES_QUERY)
+            return {row['relation']: int(row['bytes']) for row in cur.fetchall()}
+
+    def to_dict(self, target=None, error=None) -> dict:
+        report = super().to_dict(target, error)
+        report["rehearsal"] = [asdict(r) for r in self.results]
+        return report
+
+    def close(self):
+        for _, _, _, sampler in self._open.values():
+            sampler.stop()
+        self._open = {}
+        self._conn.close()
+
+def clone_with_template(db_url: str, name: str) -> str:
+    """CREATE DATABASE NAME TEMPLATE <db_url's database>. Returns the clone's URL."""
+    source = psycopg2.extensions.parse_dsn(db_url)['dbname']
+    try:
+        create_database(db_url, name, template=source)
+    except psycopg2.errors.ObjectInUse:
+        raise Exception(f"Cannot copy '{source}' while other sessions are connected to it "
+                        f"(CREATE DATABASE ... TEMPLATE needs it idle). Use --via dump instead.")
+    return url_for_database(db_url, name)
+
+def clone_with_dump(db_url: str, server_url: str, name: str) -> List[str]:
+    """
+    Restores a pg_dump of db_url into a new database NAME on SERVER_URL
+    (e.g. a local stand-in). Returns pg_restore's complaints, if any.
+    """
+    create_database(server_url, name)
+    # pg_dump's stderr goes to a file: a full pipe nobody reads would stall the dump
+    with tempfile.TemporaryFile() as dump_errors:
+        dump = subprocess.Popen(['pg_dump', db_url, '-Fc', '--no-owner', '--no-privileges'],
+                                stdout=subprocess.PIPE, stderr=dump_errors)
+        restore = subprocess.run(['pg_restore', '--no-owner', '--no-privileges',
+                                  '-d', url_for_database(server_url, name)],
+                                 stdin=dump.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        dump.stdout.close()
+        if dump.wait() != 0:
+            dump_errors.seek(0)
+            raise Exception(f"pg_dump failed: {dump_errors.read().decode(errors='replace').strip()}")
+    # pg_restore exits 1 for errors it skipped (e.g. missing roles); those don't stop a rehearsal
+    return [line for line in restore.stderr.decode(errors="replace").splitlines() if line.strip()]
+
+def describe_size_change(relation: str, before: Optional[int], after: Optional[int]) -> str:
+    if before is None:
+        return f"{relation} new ({format_bytes(after)})"
+    if after is None:
+        return f"{relation} dropped ({format_bytes(before)})"
+    delta = after - before
+    return f"{relation} {'+' if delta >= 0 else ''}{format_bytes(delta)} ({format_bytes(after)})"
+
+def short_mode(mode: str) -> str:
+    """'AccessExclusiveLock' -> 'AccessExclusive'."""
+    return mode[:-4] if mode.endswith("Lock") else mode
@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, List, Set
+
+class DependencyError(Exception):
+    pass
+
+def plan_dependencies(steps, applied) -> List[Set[int]]:
+    """
+    For each step (a list of MigrationScripts applied together), the indexes of
+    the earlier steps it has to wait for.
+    Scripts with '-- depends-on:' headers wait only for what they declare;
+    scripts without them keep the classic behaviour and wait for every earlier step.
+    """
+    position = {script.version: i for i, step in enumerate(steps) for script in step}
+    deps = []
+    for i, step in enumerate(steps):
+        needs = set()
+        for script in step:
+            declared = script.depends_on
+            if declared is None:
+                needs.update(range(i))
+                continue
+            for version in declared:
+                if version >= script.version:
+                    raise DependencyError(f"{script.version} depends on {version}, which is not older than it.")
+                if version in position:
+                    needs.add(position[version])
+                elif version not in applied:
+                    raise DependencyError(f"{script.version} depends on {version}, which is neither applied nor pending.")
+        needs.discard(i)
+        deps.append(needs)
+    return deps
+
+def run_graph(steps, deps, concurrency: int, is_parallel: Callable,
+              run_inline: Callable, run_parallel: Callable):
+    """
+    Executes steps in dependency order. Ready steps start in version order:
+    those for which is_parallel(step) is true go to run_parallel on up to
+    CONCURRENCY worker threads; the others go to run_inline on the calling
+    thread once nothing else is in flight.
+    After a failure no new step starts; running ones finish, then the first error is raised.
+    """
+    done, remaining, running, errors = set(), list(range(len(steps))), {}, []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        while (remaining and not errors) or running:
+            launched = False
+            for i in ([] if errors else list(remaining)):
+                if not deps[i] <= done:
+                    continue
+                if is_parallel(steps[i]):
+                    if len(running) < concurrency:
+                        running[pool.submit(run_parallel, steps[i])] = i
+                        remaining.remove(i)
+                        launched = True
+                    continue
+                # Exclusive step: hold back everything after it until in-flight work drains
+                if not running:
+                    remaining.remove(i)
+                    run_inline(steps[i])
+                    done.add(i)
+                    launched = True
+                break
+            if launched:
+                continue
+            if not running:
+                raise DependencyError("No runnable migration left; the dependency graph has a cycle.")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                if future.exception():
+                    errors.append(future.exception())
+                else:
+                    done.add(i)
+    if errors:
+        raise errors[0]
@@ -0,0 +1,154 @@
+import re
+from dataclasses import dataclass
+from typing import List
+
+# Characters that can change the lexer state; everything in between is plain code
+SPECIAL_REGEX = re.compile(r"[-/'\"$;()]")
+DOLLAR_TAG_REGEX = re.compile(r"\$([A-Za-z_\u0080-\uffff][A-Za-z0-9_\u0080-\uffff]*)?\$")
+IDENT_CHAR_REGEX = re.compile(r"[A-Za-z0-9_$\u0080-\uffff]")
+BLOCK_COMMENT_REGEX = re.compile(r"/\*|\*/")
+BEGIN_ATOMIC_REGEX = re.compile(r"\bBEGIN\s+ATOMIC\b", re.IGNORECASE)
+WORD_REGEX = re.compile(r"[A-Za-z_]+")
+
+@dataclass
+class Statement:
+    index: int    # 1-based position in the file
+    line: int     # 1-based line where the statement's first code character is
+    sql: str      # Statement text without leading comments or the trailing ';'
+
+    @property
+    def preview(self) -> str:
+        """First line of the statement, for logs."""
+        text = self.sql.split("\n", 1)[0].strip()
+        return text if len(text) <= 80 else text[:77] + "..."
+
+class SplitError(Exception):
+    pass
+
+def _ends_atomic_body(code: str) -> bool:
+    """
+    Inside a 'BEGIN ATOMIC ... END' function body, semicolons separate body
+    statements. The body is closed by an END that is not closing a CASE.
+    """
+    body = code[BEGIN_ATOMIC_REGEX.search(code).end():]
+    words = [w.upper() for w in WORD_REGEX.findall(body)]
+    if not words or words[-1] != "END":
+        return False
+    return words.count("END") > words.count("CASE")
+
+def split_statements(sql: str) -> List[Statement]:
+    """
+    Splits a SQL script into statements on top-level semicolons.
+    Understands -- and nested /* */ comments, '' and E'' strings, "quoted"
+    identifiers, $tag$ dollar quoting, parentheses (e.g. multi-action CREATE RULE)
+    and BEGIN ATOMIC function bodies.
+    Comment-only fragments are dropped.
+    """
+    statements = []
+    n = len(sql)
+    i = 0
+    first_code = None    # Offset of its first non-comment, non-space character
+    code = []            # Code-only fragments of the current statement (for BEGIN ATOMIC)
+    depth = 0            # Open parentheses; like psql, ';' only ends a statement outside them
+    line, line_pos = 1, 0
+
+    def mark_code(pos):
+        nonlocal first_code
+        if first_code is None:
+            first_code = pos
+
+    while i < n:
+        match = SPECIAL_REGEX.search(sql, i)
+        stop = match.start() if match else n
+        chunk = sql[i:stop]
+        if chunk.strip():
+            mark_code(i + len(chunk) - len(chunk.lstrip()))
+        code.append(chunk)
+        if not match:
+            break
+        i = stop
+        c = sql[i]
+
+        if c == "-" and sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = n if end == -1 else end
+        elif c == "/" and sql.startswith("/*", i):
+            depth, i = 1, i + 2
+            while depth:
+                nxt = BLOCK_COMMENT_REGEX.search(sql, i)
+                if not nxt:
+                    raise SplitError(f"Unterminated /* comment starting at offset {stop}")
+                depth += 1 if nxt.group() == "/*" else -1
+                i = nxt.end()
+        elif c == "'":
+            mark_code(i)
+            # E'...' strings allow backslash escapes
+            backslash = i > 0 and sql[i - 1] in "eE" and (i < 2 or not IDENT_CHAR_REGEX.match(sql[i - 2]))
+            i += 1
+            while True:
+                if i >= n:
+                    raise SplitError(f"Unterminated string literal starting at offset {stop}")
+                ch = sql[i]
+                if backslash and ch == "\\":
+                    i += 2
+                elif ch == "'":
+                    if sql.startswith("''", i):
+                        i += 2
+                    else:
+                        i += 1
+                        break
+                else:
+                    i += 1
+            code.append("''")
+        elif c == '"':
+            mark_code(i)
+            i += 1
+            while True:
+                end = sql.find('"', i)
+                if end == -1:
+                    raise SplitError(f"Unterminated quoted identifier starting at offset {stop}")
+                i = end + 1
+                if not sql.startswith('"', i):
+                    break
+                i += 1
+            code.append('""')
+        elif c == "$":
+            mark_code(i)
+            tag = DOLLAR_TAG_REGEX.match(sql, i)
+            # '$' inside an identifier (e.g. foo$bar) or a $1 parameter is not a quote
+            if tag and not (i > 0 and IDENT_CHAR_REGEX.match(sql[i - 1])):
+                end = sql.find(tag.group(), tag.end())
+                if end == -1:
+                    raise SplitError(f"Unterminated dollar-quoted string {tag.group()} at offset {stop}")
+                i = end + len(tag.group())
+                code.append("$$")
+            else:
+                code.append("$")
+                i += 1
+        elif c in "()":
+            mark_code(i)
+            depth = depth + 1 if c == "(" else max(depth - 1, 0)
+            code.append(c)
+            i += 1
+        elif c == ";":
+            code_text = "".join(code)
+            if depth or (BEGIN_ATOMIC_REGEX.search(code_text) and not _ends_atomic_body(code_text)):
+                code.append(";")
+                i += 1
+                continue
+            if first_code is not None:
+                line += sql.count("\n", line_pos, first_code)
+                line_pos = first_code
+                statements.append(Statement(len(statements) + 1, line, sql[first_code:i].strip()))
+            i += 1
+            first_code, code = None, []
+        else:
+            # A lone '-' or '/' operator
+            mark_code(i)
+            code.append(c)
+            i += 1
+
+    if first_code is not None:
+        line += sql.count("\n", line_pos, first_code)
+        statements.append(Statement(len(statements) + 1, line, sql[first_code:].strip()))
+    return statements
@@ -0,0 +1,75 @@
+"""
+Schema-per-tenant mode: every tenant schema keeps its own schema_migrations
+and gets the same migrations, applied with search_path pointed at it.
+
+Tenants become ordinary fan-out targets: a connection string whose libpq
+'options' set search_path, so run_up/run_down/run_status work unchanged.
+"""
+import re
+from typing import List, Optional
+import psycopg2
+from psycopg2.extensions import make_dsn, parse_dsn
+from .db import Database
+from .metadata import create_metadata
+
+SEARCH_PATH_OPTION_REGEX = re.compile(r'-c\s*search_path=((?:\\.|\S)+)')
+
+def quote_option(schema: str) -> str:
+    """search_path value for a libpq 'options' string: quoted identifier, spaces escaped."""
+    value = '"' + schema.replace('"', '""') + '"'
+    return value.replace("\\", "\\\\").replace(" ", "\\ ")
+
+def tenant_url(db_url: str, schema: str) -> str:
+    """db_url with search_path set to SCHEMA, keeping any options it already has."""
+    options = parse_dsn(db_url).get("options", "")
+    return make_dsn(db_url, options=f"{options} -c search_path={quote_option(schema)}".strip())
+
+def tenant_schema(db_url: str) -> Optional[str]:
+    """The schema a tenant_url() points at, or None for a plain URL."""
+    try:
+        options = parse_dsn(db_url).get("options", "")
+    except Exception:
+        return None
+    match = SEARCH_PATH_OPTION_REGEX.search(options)
+    if not match:
+        return None
+    value = re.sub(r"\\(.)", r"\1", match.group(1))
+    if value.startswith('"') and value.endswith('"'):
+        value = value[1:-1].replace('""', '"')
+    return value
+
+def discover_tenants(db_url: str, pattern: Optional[str] = None, query: Optional[str] = None) -> List[str]:
+    """
+    Tenant schemas in db_url's database: names matching a LIKE PATTERN
+    (e.g. 'tenant_%'), or the first column of every row QUERY returns.
+    """
+    conn = psycopg2.connect(db_url)
+    try:
+        with conn.cursor() as cur:
+            if query:
+                cur.execute(query)
+                schemas = [row[0] for row in cur.fetchall()]
+            else:
+                cur.execute("""
+                    SELECT nspname FROM pg_namespace
+                    WHERE nspname LIKE %s
+                      AND nspname NOT LIKE 'pg\\_%%' AND nspname <> 'information_schema'
+                    ORDER BY nspname
+                """, (pattern,))
+                schemas = [row[0] for row in cur.fetchall()]
+        conn.rollback()
+    finally:
+        conn.close()
+    return list(dict.fromkeys(s for s in schemas if s))
+
+def expand_tenants(db_urls: List[str], pattern: Optional[str] = None, query: Optional[str] = None) -> List[str]:
+    """One tenant_url per discovered schema, for every database in db_urls."""
+    return [tenant_url(url, schema) for url in db_urls for schema in discover_tenants(url, pattern, query)]
+
+def ensure_tenant_metadata(db_url: str):
+    """Creates schema_migrations and its companions in a tenant schema that has none yet."""
+    db = Database(db_url)
+    try:
+        create_metadata(db.get_conn())
+    finally:
+        db.close()
@@ -0,0 +1,134 @@
+"""
+Replication-lag throttling: between migrations, between committed statements
+of no-transaction migrations and between backfill chunks, the runner checks
+replica lag and pauses while it is above --max-replica-lag.
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from .fanout import target_label
+from .monitor import format_seconds
+
+# Seconds between lag samples while paused, and how long a good sample is trusted
+POLL_INTERVAL = 1.0
+# Progress lines while paused
+REPORT_INTERVAL = 10.0
+
+# Seen from the primary: one row per connected standby
+PRIMARY_LAG_QUERY = """
+    SELECT COALESCE(NULLIF(application_name, ''), client_addr::text, 'standby') AS name,
+           COALESCE(EXTRACT(EPOCH FROM replay_lag) * 1000, 0) AS lag_ms
+    FROM pg_stat_replication
+"""
+
+# Run on a standby: how far replay is behind the last transaction it received
+STANDBY_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) * 1000, 0)
+    END AS lag_ms
+"""
+
+class ReplicaLagError(Exception):
+    """Replica lag stayed above the threshold for longer than the allowed wait."""
+
+class ReplicationThrottle:
+    """
+    Samples replay lag from pg_stat_replication on the primary, or directly on
+    the given standby URLs, on connections of its own. Thread-safe: concurrent
+    workers share one throttle and pause together.
+    """
+    def __init__(self, primary_url: str, max_lag_ms: int, replica_urls: Optional[List[str]] = None,
+                 timeout_ms: Optional[int] = None):
+        self.primary_url = primary_url
+        self.max_lag_ms = max_lag_ms
+        self.replica_urls = list(replica_urls or [])
+        self.timeout_ms = timeout_ms
+        self.pauses = 0
+        self.paused_ms = 0
+        self.max_seen_ms = 0.0
+        self._conns: Dict[str, object] = {}
+        self._last_ok = 0.0
+        self._lock = threading.Lock()
+
+    def _query(self, url, query) -> list:
+        conn = self._conns.get(url)
+        if conn is None or conn.closed:
+            conn = self._conns[url] = psycopg2.connect(url, cursor_factory=RealDictCursor)
+            conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(query)
+            return cur.fetchall()
+
+    def sample(self) -> Dict[str, float]:
+        """Current replay lag in ms per standby."""
+        if not self.replica_urls:
+            return {row['name']: float(row['lag_ms']) for row in self._query(self.primary_url, PRIMARY_LAG_QUERY)}
+        lags = {}
+        for url in self.replica_urls:
+            row = self._query(url, STANDBY_LAG_QUERY)[0]
+            if row['lag_ms'] is None:
+                raise Exception(f"{target_label(url)} is not a standby (pg_is_in_recovery() is false).")
+            lags[target_label(url)] = float(row['lag_ms'])
+        return lags
+
+    def _over(self, lags) -> Dict[str, float]:
+        if lags:
+            self.max_seen_ms = max(self.max_seen_ms, max(lags.values()))
+        return {name: lag for name, lag in lags.items() if lag > self.max_lag_ms}
+
+    def wait(self, echo, emit=None) -> int:
+        """Blocks while any replica lags too far behind. Returns the milliseconds spent paused."""
+        with self._lock:
+            # A recent good sample is trusted, so tiny migrations don't each pay for a query
+            if time.monotonic() - self._last_ok < POLL_INTERVAL:
+                return 0
+            lags = self.sample()
+            over = self._over(lags)
+            if emit:
+                emit("replica_lag", lags=lags, max_lag_ms=self.max_lag_ms)
+            if not over:
+                self._last_ok = time.monotonic()
+                return 0
+
+            self.pauses += 1
+            started = last_report = time.monotonic()
+            echo(f"   ⏸  Replica lag {describe_lags(over)} is above {format_lag(self.max_lag_ms)}; pausing...",
+                 fg="yellow")
+            while over:
+                waited = time.monotonic() - started
+                if self.timeout_ms and waited * 1000 >= self.timeout_ms:
+                    self.paused_ms += int(waited * 1000)
+                    raise ReplicaLagError(
+                        f"Replica lag stayed above {format_lag(self.max_lag_ms)} for {format_seconds(waited)} "
+                        f"({describe_lags(over)}). Completed work is kept; rerun 'up' to continue.")
+                time.sleep(POLL_INTERVAL)
+                lags = self.sample()
+                over = self._over(lags)
+                if emit:
+                    emit("replica_lag", lags=lags, max_lag_ms=self.max_lag_ms)
+                if over and time.monotonic() - last_report >= REPORT_INTERVAL:
+                    echo(f"   ⏸  Still waiting: {describe_lags(over)} ({format_seconds(time.monotonic() - started)} paused)",
+                         fg="yellow")
+                    last_report = time.monotonic()
+
+            paused_ms = int((time.monotonic() - started) * 1000)
+            self.paused_ms += paused_ms
+            self._last_ok = time.monotonic()
+            echo(f"   ▶️  Replicas caught up ({describe_lags(lags) or 'no standbys'}) after {format_lag(paused_ms)}; resuming.")
+            return paused_ms
+
+    def close(self):
+        for conn in self._conns.values():
+            if not conn.closed:
+                conn.close()
+        self._conns = {}
+
+def format_lag(ms) -> str:
+    return f"{ms:.0f}ms" if ms < 1000 else f"{ms / 1000:.1f}s"
+
+def describe_lags(lags: Dict[str, float]) -> str:
+    return ", ".join(f"{name} {format_lag(lag)}" for name, lag in sorted(lags.items()))
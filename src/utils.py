@@ -1,12 +1,87 @@
 import os
+import gzip
 import hashlib
+import io
+import json
 import re
-from dataclasses import dataclass
-from typing import Dict, Optional
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
 
-# Regex to parse: YYYYMMDDHHmmss_xxxx_description.up.sql
-# Capture groups: 1=Timestamp, 2=Suffix, 3=Name, 4=Type (up/down)
-FILENAME_REGEX = re.compile(r"^(\d{14})_([a-zA-Z0-9]{4})_(.+?)\.(up|down)\.sql$")
+# Regex to parse: YYYYMMDDHHmmss_xxxx_description.up.sql (optionally .sql.gz or .sql.zst)
+# Capture groups: 1=Timestamp, 2=Suffix, 3=Name, 4=Type (up/down), 5=Compression
+FILENAME_REGEX = re.compile(r"^(\d{14})_([a-zA-Z0-9]{4})_(.+?)\.(up|down)\.sql(\.gz|\.zst)?$")
+
+# Seed data for a migration: YYYYMMDDHHmmss_xxxx_description.data/ next to its .up.sql.
+# Files in it are loaded by "COPY ... FROM 'file'" statements and are part of the checksum.
+DATA_DIR_REGEX = re.compile(r"^(\d{14})_([a-zA-Z0-9]{4})_(.+?)\.data$")
+
+# Snapshot written by 'squash'; deliberately does not match FILENAME_REGEX
+BASELINE_FILENAME = "baseline.sql"
+
+# Header comments such as "-- migration: no-transaction" or "-- migration: lock-timeout=2s"
+DIRECTIVE_REGEX = re.compile(r"--\s*migration:[ \t]*([^\n]*)", re.IGNORECASE)
+
+# "-- depends-on: <version>[, <version>...]" header lines (repeatable)
+DEPENDS_ON_REGEX = re.compile(r"^--\s*depends-on:[ \t]*([^\n]*)", re.IGNORECASE | re.MULTILINE)
+
+DURATION_REGEX = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ms|s|m|min|h)?\s*$", re.IGNORECASE)
+DURATION_UNITS_MS = {"ms": 1, "s": 1000, "m": 60_000, "min": 60_000, "h": 3_600_000}
+
+def parse_duration(value) -> Optional[int]:
+    """Parses '500ms', '2s', '5m', '1h' (bare numbers are seconds) into milliseconds."""
+    if value is None or value == "":
+        return None
+    match = DURATION_REGEX.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid duration: '{value}' (expected e.g. 500ms, 2s, 5m, 1h)")
+    number, unit = match.groups()
+    return int(float(number) * DURATION_UNITS_MS[(unit or "s").lower()])
+
+def parse_directives(sql_content: str) -> Dict[str, str]:
+    """
+    Collects '-- migration:' header directives into a dict.
+    Flags map to "" (e.g. {'no-transaction': ''}), key=value pairs to their value.
+    """
+    directives = {}
+    for match in DIRECTIVE_REGEX.finditer(sql_content):
+        for token in re.split(r"[\s,]+", match.group(1).strip()):
+            if not token:
+                continue
+            key, _, value = token.partition("=")
+            directives[key.lower()] = value
+    return directives
+
+@dataclass
+class MigrationScript:
+    """The loaded SQL of one direction of a migration."""
+    version: str
+    name: str
+    path: str
+    sql: str
+    directives: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def no_transaction(self) -> bool:
+        return "no-transaction" in self.directives
+
+    @property
+    def backfill(self) -> bool:
+        return "backfill" in self.directives
+
+    @property
+    def lock_timeout_ms(self) -> Optional[int]:
+        return parse_duration(self.directives.get("lock-timeout"))
+
+    @property
+    def depends_on(self) -> Optional[List[str]]:
+        """Versions from '-- depends-on:' headers, or None when the file declares none."""
+        versions = [v for match in DEPENDS_ON_REGEX.finditer(self.sql)
+                    for v in re.split(r"[\s,]+", match.group(1).strip()) if v]
+        return versions or None
 
 @dataclass
 class MigrationFile:
@@ -14,18 +89,89 @@ class MigrationFile:
     name: str         # description
     up_path: Optional[str] = None
     down_path: Optional[str] = None
+    data_path: Optional[str] = None   # Seed data directory, if any
     
     @property
     def up_checksum(self) -> str:
-        """Calculates SHA256 of the UP file."""
+        """Calculates SHA256 of the UP file (combined with its data files, if any)."""
         if not self.up_path:
             return None
-        return calculate_file_hash(self.up_path)
+        checksum = checksum_cache.get(self.up_path)
+        if not self.data_path:
+            return checksum
+        sha256 = hashlib.sha256(checksum.encode())
+        for path in data_files(self.data_path):
+            relative = os.path.relpath(path, self.data_path).replace(os.sep, "/")
+            sha256.update(f"\n{relative}:{checksum_cache.get(path)}".encode())
+        return sha256.hexdigest()
+
+    def checksum_paths(self) -> List[str]:
+        """Every file that goes into up_checksum (for warming the cache)."""
+        if not self.up_path:
+            return []
+        return [self.up_path] + (data_files(self.data_path) if self.data_path else [])
+
+    def load(self, direction: str = "up") -> MigrationScript:
+        """Reads the SQL for 'up' or 'down' along with its header directives (checksumming it in the same pass)."""
+        path = self.up_path if direction == "up" else self.down_path
+        sql_content = checksum_cache.read(path, read_migration)
+        return MigrationScript(self.version, self.name, path, sql_content, parse_directives(sql_content))
+
+def open_zstd(path: str):
+    try:
+        from compression import zstd   # Python 3.14+
+        return zstd.open(path, 'rb')
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception(f"{path} is zstd-compressed; install the 'zstandard' package (pip install pgmigrate[zstd]).")
+    return zstandard.open(path, 'rb')
+
+def open_migration(path: str):
+    """Opens a migration or data file for binary reading, decompressing .gz and .zst on the fly."""
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rb')
+    if path.endswith(".zst"):
+        return open_zstd(path)
+    return open(path, 'rb')
+
+class HashingReader(io.RawIOBase):
+    """Binary stream wrapper that feeds everything read through SHA256."""
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer))
+        self.sha256.update(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+def read_migration(path: str) -> tuple:
+    """Returns (text, sha256 of the decompressed bytes), reading the file once."""
+    with open_migration(path) as raw:
+        reader = HashingReader(raw)
+        with io.TextIOWrapper(io.BufferedReader(reader, 65536), encoding="utf-8") as text:
+            content = text.read()
+        return content, reader.sha256.hexdigest()
+
+def data_files(directory: str) -> List[str]:
+    """Files under a seed data directory, in a stable order."""
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        found.extend(os.path.join(root, name) for name in sorted(files))
+    return found
 
 def calculate_file_hash(filepath: str) -> str:
-    """Reads a file in binary mode and returns its SHA256 hash."""
+    """Reads a file in binary mode and returns its SHA256 hash (of the decompressed content for .gz/.zst)."""
     sha256 = hashlib.sha256()
-    with open(filepath, 'rb') as f:
+    with open_migration(filepath) as f:
         while True:
             data = f.read(65536) # Read in 64k chunks
             if not data:
@@ -33,32 +179,322 @@ def calculate_file_hash(filepath: str) -> str:
             sha256.update(data)
     return sha256.hexdigest()
 
-def get_migrations(directory: str = "migrations") -> Dict[str, MigrationFile]:
+# Where checksums survive between runs. Set PGMIGRATE_CHECKSUM_CACHE=off to keep them in memory only.
+CHECKSUM_CACHE_PATH = os.path.join(".pgmigrate", "checksums.json")
+
+# Files modified this recently are not persisted: a later edit could land in the same mtime tick.
+RACY_WINDOW_NS = 2_000_000_000
+
+def _atomic_write_json(path: str, data: dict):
+    """
+    Writes DATA to PATH through a temporary file and a rename, so readers never
+    see a partial file. Failures (e.g. read-only checkouts) are ignored.
+    """
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+class ChecksumCache:
+    """
+    SHA256 checksums keyed by absolute path.
+    An entry is only trusted while the file's size, mtime and inode are unchanged.
     """
-    Scans the directory and groups .up.sql and .down.sql files by version.
+    def __init__(self, path: Optional[str] = None):
+        if path is None:
+            path = os.getenv("PGMIGRATE_CHECKSUM_CACHE", CHECKSUM_CACHE_PATH)
+        self.path = None if path.lower() in ("", "off", "none") else path
+        self._entries = None
+        self._dirty = False
+        self._texts = {}   # key -> (signature, text) read by warm(), handed to the next read()
+        self._lock = threading.Lock()
+        self._file_locks = defaultdict(threading.Lock)
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            self._entries = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r') as f:
+                        self._entries = json.load(f).get("files", {})
+                except (OSError, ValueError):
+                    # A corrupt cache is just a cold cache
+                    self._entries = {}
+        return self._entries
+
+    @staticmethod
+    def _signature(st: os.stat_result) -> list:
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def get(self, filepath: str) -> str:
+        """Returns the checksum of a file, hashing it only if the cached entry is stale."""
+        key = os.path.abspath(filepath)
+        with self._lock:
+            file_lock = self._file_locks[key]
+
+        # Per-file lock: concurrent callers wait for the first hash instead of repeating it
+        with file_lock:
+            signature = self._signature(os.stat(filepath))
+            with self._lock:
+                entry = self._load().get(key)
+            if entry and entry["sig"] == signature:
+                return entry["sha256"]
+            return self._hash(key, filepath, signature, lambda: (None, calculate_file_hash(filepath)))[1]
+
+    def read(self, filepath: str, reader: Callable[[str], tuple]):
+        """
+        Returns the content from reader(filepath) -> (content, sha256), remembering
+        the checksum, so loading a file never needs a second pass to hash it.
+        """
+        key = os.path.abspath(filepath)
+        with self._lock:
+            file_lock = self._file_locks[key]
+        with file_lock:
+            signature = self._signature(os.stat(filepath))
+            with self._lock:
+                kept = self._texts.pop(key, None)
+            if kept and kept[0] == signature:
+                return kept[1]
+            return self._hash(key, filepath, signature, lambda: reader(filepath))[0]
+
+    def _prefetch(self, filepath: str):
+        """Like get(), but a stale script is read with read_migration and its text kept for read()."""
+        key = os.path.abspath(filepath)
+        with self._lock:
+            file_lock = self._file_locks[key]
+        with file_lock:
+            signature = self._signature(os.stat(filepath))
+            with self._lock:
+                entry = self._load().get(key)
+            if entry and entry["sig"] == signature:
+                return
+            content = self._hash(key, filepath, signature, lambda: read_migration(filepath))[0]
+            with self._lock:
+                self._texts[key] = (signature, content)
+
+    def _hash(self, key, filepath, signature, compute) -> tuple:
+        hashed_at = time.time_ns()
+        content, digest = compute()
+
+        # If the file changed while we were reading it, don't remember the result
+        if self._signature(os.stat(filepath)) != signature:
+            return content, digest
+
+        with self._lock:
+            self._load()[key] = {
+                "sig": signature,
+                "sha256": digest,
+                "racy": signature[1] >= hashed_at - RACY_WINDOW_NS,
+            }
+            self._dirty = True
+        return content, digest
+
+    def warm(self, paths: Iterable[str], scripts: Iterable[str] = (), max_workers: Optional[int] = None):
+        """
+        Hashes any stale or missing entries in a thread pool. Those of SCRIPTS
+        (migration files about to be loaded) keep their text, so that loading
+        one later doesn't read it a second time.
+        """
+        paths = [p for p in paths if p]
+        if not paths:
+            return
+        scripts = {p for p in scripts if p}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # list() re-raises the first error (e.g. a file vanished mid-scan)
+            list(pool.map(lambda p: self._prefetch(p) if p in scripts else self.get(p), paths))
+
+    def save(self):
+        """Writes the cache to disk (see _atomic_write_json)."""
+        with self._lock:
+            self._texts = {}   # Texts nobody loaded (e.g. applied migrations) end with the run
+            if not self.path or not self._dirty:
+                return
+            entries = {
+                key: {"sig": e["sig"], "sha256": e["sha256"]}
+                for key, e in self._entries.items()
+                if not e.get("racy") and os.path.exists(key)
+            }
+            self._dirty = False
+
+        _atomic_write_json(self.path, {"version": 1, "files": entries})
+
+# Shared by every MigrationFile in this process
+checksum_cache = ChecksumCache()
+
+# Statements that open or close a transaction, on a line of their own
+TX_CONTROL_REGEX = re.compile(
+    r"^\s*(BEGIN|START\s+TRANSACTION|COMMIT|END|ROLLBACK|ABORT)(\s+(WORK|TRANSACTION))?\s*;\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+def strip_transaction_wrapper(sql_content: str) -> Optional[str]:
+    """
+    Removes a file-level BEGIN; ... COMMIT; wrapper (as generated by `make`)
+    so the SQL can run inside a caller-managed transaction.
+    Returns None if any other transaction control remains, i.e. the file
+    cannot safely share a transaction with other migrations.
+    """
+    controls = list(TX_CONTROL_REGEX.finditer(sql_content))
+    if not controls:
+        return sql_content
+
+    # Only accept exactly: [comments] BEGIN; ... COMMIT; [comments]
+    if len(controls) != 2:
+        return None
+    opener, closer = controls
+    if opener.group(1).upper().split()[0] not in ("BEGIN", "START"):
+        return None
+    if closer.group(1).upper() not in ("COMMIT", "END"):
+        return None
+
+    def only_comments(text):
+        return all(not line.strip() or line.strip().startswith("--") for line in text.splitlines())
+
+    if not only_comments(sql_content[:opener.start()]) or not only_comments(sql_content[closer.end():]):
+        return None
+    return sql_content[:opener.start()] + sql_content[opener.end():closer.start()]
+
+# Where directory listings survive between runs. Set PGMIGRATE_MANIFEST=off to rescan every time.
+MANIFEST_PATH = os.path.join(".pgmigrate", "manifest.json")
+MANIFEST_VERSION = 3
+
+class MigrationManifest:
+    """
+    Migration filenames per directory, keyed by absolute path.
+    Adding, removing or renaming a file bumps its directory's mtime, so a
+    listing is only trusted while that mtime is unchanged; subdirectories
+    (e.g. per-year folders) are tracked on their own and rescanned independently.
+    """
+    def __init__(self, path: Optional[str] = None):
+        if path is None:
+            path = os.getenv("PGMIGRATE_MANIFEST", MANIFEST_PATH)
+        self.path = None if path.lower() in ("", "off", "none") else path
+        self._dirs = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self._dirs is None:
+            self._dirs = {}
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r') as f:
+                        data = json.load(f)
+                    # Older layouts did not list seed data folders or compressed files
+                    self._dirs = data.get("dirs", {}) if data.get("version") == MANIFEST_VERSION else {}
+                except (OSError, ValueError):
+                    self._dirs = {}
+        return self._dirs
+
+    def _list(self, directory: str, mtime_ns: int) -> dict:
+        listed_at = time.time_ns()
+        files, subdirs = [], []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    # Seed data folders belong to their migration and are not searched for migrations
+                    (files if DATA_DIR_REGEX.match(entry.name) else subdirs).append(entry.name)
+                elif FILENAME_REGEX.match(entry.name):
+                    files.append(entry.name)
+        return {"mtime_ns": mtime_ns, "files": sorted(files), "subdirs": sorted(subdirs),
+                "racy": mtime_ns >= listed_at - RACY_WINDOW_NS}
+
+    def files(self, directory: str) -> List[str]:
+        """Paths of every migration file and seed data folder under DIRECTORY, relisting only directories that changed."""
+        root = os.path.abspath(directory)
+        found, seen, pending = [], set(), [directory]
+        with self._lock:
+            dirs = self._load()
+            while pending:
+                current = pending.pop()
+                key = os.path.abspath(current)
+                seen.add(key)
+                mtime_ns = os.stat(current).st_mtime_ns
+                entry = dirs.get(key)
+                if not entry or entry["mtime_ns"] != mtime_ns or entry.get("racy"):
+                    entry = dirs[key] = self._list(current, mtime_ns)
+                    self._dirty = True
+                found.extend(os.path.join(current, name) for name in entry["files"])
+                pending.extend(os.path.join(current, name) for name in entry["subdirs"])
+
+            # Forget folders that were removed from under this root
+            for key in [k for k in dirs if (k == root or k.startswith(root + os.sep)) and k not in seen]:
+                del dirs[key]
+                self._dirty = True
+        return found
+
+    def save(self):
+        """Writes the manifest to disk (see _atomic_write_json)."""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            dirs = {
+                key: {"mtime_ns": e["mtime_ns"], "files": e["files"], "subdirs": e["subdirs"]}
+                for key, e in self._dirs.items() if not e.get("racy")
+            }
+            self._dirty = False
+
+        _atomic_write_json(self.path, {"version": MANIFEST_VERSION, "dirs": dirs})
+
+migration_manifest = MigrationManifest()
+
+def get_migrations(directory: str = "migrations",
+                   manifest: Optional[MigrationManifest] = None) -> Dict[str, MigrationFile]:
+    """
+    Scans the directory (and its subdirectories) and groups .up.sql and .down.sql files by version.
     Returns a dict: {'2023..._xxxx': MigrationFile object}
+    Only paths are collected; SQL is read when a migration is loaded.
     """
     migrations = {}
     
     if not os.path.exists(directory):
         return migrations
 
-    for filename in os.listdir(directory):
-        match = FILENAME_REGEX.match(filename)
-        if not match:
-            continue
-            
-        timestamp, suffix, name, kind = match.groups()
+    manifest = manifest or migration_manifest
+    for full_path in manifest.files(directory):
+        data_match = DATA_DIR_REGEX.match(os.path.basename(full_path))
+        if data_match:
+            timestamp, suffix, name = data_match.groups()
+            kind = 'data'
+        else:
+            timestamp, suffix, name, kind, _ = FILENAME_REGEX.match(os.path.basename(full_path)).groups()
         version = f"{timestamp}_{suffix}"
         
         if version not in migrations:
             migrations[version] = MigrationFile(version=version, name=name)
         
-        full_path = os.path.join(directory, filename)
-        
+        existing = getattr(migrations[version], f"{kind}_path")
+        if existing:
+            raise Exception(f"Duplicate {kind} migration for {version}: {existing} and {full_path}")
+
         if kind == 'up':
             migrations[version].up_path = full_path
         elif kind == 'down':
             migrations[version].down_path = full_path
-            
-    return migrations
\ No newline at end of file
+        else:
+            migrations[version].data_path = full_path
+
+    manifest.save()
+    return migrations
+
+def fingerprint_checksums(pairs: Iterable[tuple]) -> str:
+    """sha256 over sorted (version, checksum) pairs."""
+    sha256 = hashlib.sha256()
+    for version, checksum in sorted(pairs):
+        sha256.update(f"{version} {checksum or '-'}\n".encode())
+    return sha256.hexdigest()
+
+def migration_fingerprint(migrations: Dict[str, MigrationFile]) -> str:
+    """
+    Fingerprint of the local migration set. Equals the fingerprint stored by
+    'up' exactly when every local migration is applied with the same checksum.
+    """
+    return fingerprint_checksums((version, m.up_checksum) for version, m in migrations.items())
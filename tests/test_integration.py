@@ -1,6 +1,11 @@
 import os
+import json
+import psycopg2
+import pytest
+import shutil
 from src.main import cli
-from src.db import Database
+from src.db import Database, url_for_database
+from unittest.mock import patch
 
 # Helper to check DB state
 def table_exists(db_url, table_name):
@@ -13,6 +18,23 @@ def table_exists(db_url, table_name):
     db.close()
     return res['to_regclass'] is not None
 
+def write_migration(version, name, up_sql, down_sql=""):
+    """Writes a migration pair with a fixed version so ordering is deterministic."""
+    os.makedirs("migrations", exist_ok=True)
+    with open(os.path.join("migrations", f"{version}_{name}.up.sql"), "w") as f:
+        f.write(up_sql)
+    with open(os.path.join("migrations", f"{version}_{name}.down.sql"), "w") as f:
+        f.write(down_sql)
+
+def applied_versions(db_url):
+    db = Database(db_url)
+    conn = db.get_conn()
+    with conn.cursor() as cur:
+        cur.execute("SELECT version, batch FROM schema_migrations ORDER BY version")
+        rows = cur.fetchall()
+    db.close()
+    return [(r['version'], r['batch']) for r in rows]
+
 def test_init_command(runner):
     """Test that init creates the folder and the metadata table."""
     # We use isolated_filesystem so we don't clutter your real project
@@ -87,4 +109,934 @@ def test_transaction_safety(runner):
         assert "syntax error" in result.output.lower()
         
         # Verify Rollback: The table 'should_not_exist' must NOT exist
-        assert not table_exists(os.environ["DATABASE_URL"], "public.should_not_exist")
\ No newline at end of file
+        assert not table_exists(os.environ["DATABASE_URL"], "public.should_not_exist")
+
+def test_up_fans_out_across_targets(runner):
+    """Each target gets its own run; one failing target does not stop the others."""
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        runner.invoke(cli, ['make', 'create_shard_table'])
+
+        files = os.listdir("migrations")
+        up_file = next(f for f in files if f.endswith(".up.sql"))
+        with open(os.path.join("migrations", up_file), "w") as f:
+            f.write("CREATE TABLE shard_table (id int);")
+
+        missing_db_url = os.environ["DATABASE_URL"].rsplit("/", 1)[0] + "/pgmigrate_missing_db"
+        with open("targets.txt", "w") as f:
+            f.write(f"# shards\n{os.environ['DATABASE_URL']}\n{missing_db_url}\n")
+
+        result = runner.invoke(cli, ['up', '--targets-file', 'targets.txt', '--parallel', '2'])
+
+        assert result.exit_code != 0
+        assert "1 succeeded, 1 failed" in result.output
+        assert "pgmigrate_missing_db" in result.output
+        assert table_exists(os.environ["DATABASE_URL"], "public.shard_table")
+
+        # An unreachable target is a failure for status too, not an empty dashboard
+        result = runner.invoke(cli, ['status', '--targets-file', 'targets.txt'])
+        assert result.exit_code != 0
+        assert "1 succeeded, 1 failed" in result.output
+
+def test_single_transaction_applies_batch_atomically(runner):
+    """--single-transaction commits the whole batch, or nothing at all."""
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "first", "BEGIN;\nCREATE TABLE st_first (id int);\nCOMMIT;")
+        write_migration("20250101000001_bbbb", "second", "CREATE TABLE st_second (id int);")
+
+        result = runner.invoke(cli, ['up', '--single-transaction'])
+        assert result.exit_code == 0
+        assert "2 migrations in one transaction" in result.output
+        assert applied_versions(os.environ["DATABASE_URL"]) == [
+            ("20250101000000_aaaa", 1), ("20250101000001_bbbb", 1)]
+
+        write_migration("20250101000002_cccc", "third", "CREATE TABLE st_third (id int);")
+        write_migration("20250101000003_dddd", "broken", "THIS_IS_INVALID_SQL;")
+
+        result = runner.invoke(cli, ['up', '--single-transaction'])
+        assert result.exit_code != 0
+        assert "rolled back" in result.output
+        assert not table_exists(os.environ["DATABASE_URL"], "public.st_third")
+        assert len(applied_versions(os.environ["DATABASE_URL"])) == 2
+
+def test_lock_timeout_retries_then_gives_up(runner):
+    """A migration blocked by another session retries with backoff, then fails cleanly."""
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "hot_table", "CREATE TABLE hot_table (id int);")
+        assert runner.invoke(cli, ['up']).exit_code == 0
+
+        write_migration("20250101000001_bbbb", "alter_hot_table",
+                        "-- migration: lock-timeout=100ms\nALTER TABLE hot_table ADD COLUMN note text;")
+
+        blocker = psycopg2.connect(os.environ["DATABASE_URL"])
+        try:
+            with blocker.cursor() as cur:
+                cur.execute("LOCK TABLE hot_table IN ACCESS SHARE MODE")
+            result = runner.invoke(cli, ['up', '--lock-retries', '1'])
+        finally:
+            blocker.rollback()
+            blocker.close()
+
+        assert result.exit_code != 0
+        assert "lock timeout, retrying" in result.output
+        assert "gave up after 2 attempts" in result.output
+        assert applied_versions(os.environ["DATABASE_URL"]) == [("20250101000000_aaaa", 1)]
+
+def test_statement_timing_report_and_error_location(runner):
+    """Statements run one by one; the report and the error point at the failing line."""
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "multi",
+                        "CREATE TABLE timed (id int);\n"
+                        "INSERT INTO timed SELECT generate_series(1, 5);\n"
+                        "\n"
+                        "SELEC broken;\n")
+
+        result = runner.invoke(cli, ['up', '--verbose', '--report', 'report.json'])
+
+        assert result.exit_code != 0
+        assert "statement 3/3, line 4" in result.output
+        with open("report.json") as f:
+            report = json.load(f)
+        assert report["status"] == "failed"
+        statements = report["migrations"][0]["statements"]
+        assert [s["rowcount"] for s in statements[:2]] == [-1, 5]
+        assert statements[2]["line"] == 4 and statements[2]["error"]
+        assert not table_exists(os.environ["DATABASE_URL"], "public.timed")
+
+def test_metrics_are_recorded_and_old_tables_upgraded(runner):
+    """An old schema_migrations layout is upgraded; up/down record durations and history."""
+    with runner.isolated_filesystem():
+        os.makedirs("migrations")
+        conn = psycopg2.connect(os.environ["DATABASE_URL"])
+        with conn, conn.cursor() as cur:
+            # The original table layout, before execution metrics existed
+            cur.execute("""
+                CREATE TABLE schema_migrations (
+                    version VARCHAR(255) PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    checksum VARCHAR(64) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    batch INTEGER NOT NULL DEFAULT 1
+                )
+            """)
+        conn.close()
+
+        write_migration("20250101000000_aaaa", "metrics", "CREATE TABLE metrics_t (id int);",
+                        "DROP TABLE metrics_t;")
+        result = runner.invoke(cli, ['up'], env={"PGMIGRATE_CLIENT": "ci-runner"})
+        assert result.exit_code == 0
+        assert "Upgraded 'schema_migrations'" in result.output
+        assert runner.invoke(cli, ['down']).exit_code == 0
+        assert runner.invoke(cli, ['up'], env={"PGMIGRATE_CLIENT": "ci-runner"}).exit_code == 0
+
+        db = Database(os.environ["DATABASE_URL"])
+        with db.get_conn().cursor() as cur:
+            cur.execute("SELECT duration_ms, applied_by, tx_mode FROM schema_migrations")
+            row = cur.fetchone()
+            cur.execute("SELECT direction FROM schema_migrations_history ORDER BY id")
+            directions = [r['direction'] for r in cur.fetchall()]
+        db.close()
+        assert row['duration_ms'] is not None
+        assert row['applied_by'] == "ci-runner" and row['tx_mode'] == "tx"
+        assert directions == ["up", "down", "up"]
+
+        result = runner.invoke(cli, ['stats'])
+        assert result.exit_code == 0
+        assert "Slowest migrations" in result.output
+        assert "20250101000000_aaaa" in result.output
+
+def test_backfill_runs_in_chunks_and_resumes(runner):
+    """Backfills run as keyset chunks and pick up from their checkpoint."""
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "big_table",
+                        "CREATE TABLE big_t (id int PRIMARY KEY, flag boolean);\n"
+                        "INSERT INTO big_t SELECT g, false FROM generate_series(1, 25) g;")
+        assert runner.invoke(cli, ['up']).exit_code == 0
+
+        write_migration("20250101000001_bbbb", "backfill_flag",
+                        "-- migration: backfill table=big_t key=id batch-size=10\n"
+                        "UPDATE big_t SET flag = true WHERE id BETWEEN %(start)s AND %(end)s;")
+
+        # Simulate an interrupted run that already finished the first two chunks
+        db = Database(os.environ["DATABASE_URL"])
+        conn = db.get_conn()
+        from src.backfill import ensure_checkpoint_table
+        from src.utils import calculate_file_hash
+        ensure_checkpoint_table(conn)
+        checksum = calculate_file_hash("migrations/20250101000001_bbbb_backfill_flag.up.sql")
+        with conn, conn.cursor() as cur:
+            cur.execute("INSERT INTO schema_migrations_backfill (version, checksum, last_key, rows_done, chunks) "
+                        "VALUES ('20250101000001_bbbb', %s, '20', 20, 2)", (checksum,))
+        db.close()
+
+        result = runner.invoke(cli, ['up'])
+        assert result.exit_code == 0
+        assert "Resuming after id=20" in result.output
+        assert "Backfilled 25 rows in 3 chunks" in result.output
+
+        db = Database(os.environ["DATABASE_URL"])
+        with db.get_conn().cursor() as cur:
+            cur.execute("SELECT array_agg(id ORDER BY id) AS ids FROM big_t WHERE flag")
+            flagged = cur.fetchone()['ids']
+            cur.execute("SELECT COUNT(*) AS n FROM schema_migrations_backfill")
+            checkpoints = cur.fetchone()['n']
+        db.close()
+        # Rows 1-20 were "done" by the interrupted run we faked, so only 21-25 were touched
+        assert flagged == [21, 22, 23, 24, 25]
+        assert checkpoints == 0
+        assert ("20250101000001_bbbb", 2) in applied_versions(os.environ["DATABASE_URL"])
+
+def test_backfill_body_keeps_literal_percent_signs(runner):
+    """A '%' in the backfill body (e.g. in a LIKE pattern) is SQL, not a parameter marker."""
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "names",
+                        "CREATE TABLE names (id int PRIMARY KEY, name text, tagged boolean DEFAULT false);\n"
+                        "INSERT INTO names SELECT g, CASE WHEN g % 2 = 0 THEN 'a' || g ELSE 'b' || g END "
+                        "FROM generate_series(1, 6) g;")
+        write_migration("20250101000001_bbbb", "tag_names",
+                        "-- migration: backfill table=names key=id batch-size=4\n"
+                        "UPDATE names SET tagged = true WHERE id BETWEEN %(start)s AND %(end)s AND name LIKE 'a%';")
+        result = runner.invoke(cli, ['up'])
+        assert result.exit_code == 0, result.output
+
+        db = Database(os.environ["DATABASE_URL"])
+        with db.get_conn().cursor() as cur:
+            cur.execute("SELECT array_agg(id ORDER BY id) AS ids FROM names WHERE tagged")
+            assert cur.fetchone()['ids'] == [2, 4, 6]
+        db.close()
+
+@pytest.mark.skipif(shutil.which("pg_dump") is None, reason="pg_dump not installed")
+def test_squash_baseline_bootstraps_fresh_database(runner):
+    """'squash' snapshots old migrations; a fresh database loads the snapshot in one step."""
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "users", "CREATE TABLE users (id serial PRIMARY KEY);")
+        write_migration("20250101000001_bbbb", "posts",
+                        "CREATE TABLE posts (id int PRIMARY KEY, user_id int REFERENCES users(id));")
+        write_migration("20250101000002_cccc", "tags", "CREATE TABLE tags (id int);")
+
+        result = runner.invoke(cli, ['squash', '--before', '20250101000002_cccc'])
+        assert result.exit_code == 0, result.output
+        assert os.path.exists("migrations/baseline.sql")
+        # The live database was not touched
+        assert applied_versions(os.environ["DATABASE_URL"]) == []
+
+        result = runner.invoke(cli, ['up'])
+        assert result.exit_code == 0, result.output
+        assert "Loading baseline (2 migrations" in result.output
+        assert table_exists(os.environ["DATABASE_URL"], "public.posts")
+        assert table_exists(os.environ["DATABASE_URL"], "public.tags")
+        applied = applied_versions(os.environ["DATABASE_URL"])
+        assert [v for v, _ in applied] == ["20250101000000_aaaa", "20250101000001_bbbb", "20250101000002_cccc"]
+
+        # Editing a covered migration makes the baseline stale: it is ignored, not trusted
+        conn = psycopg2.connect(os.environ["DATABASE_URL"])
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+        conn.close()
+        runner.invoke(cli, ['init'])
+        with open("migrations/20250101000000_aaaa_users.up.sql", "a") as f:
+            f.write("\n-- edited\n")
+        result = runner.invoke(cli, ['up', '--dry-run'])
+        assert "Ignoring stale baseline" in result.output
+
+def test_pytest_plugin_reuses_template_until_migrations_change(runner):
+    """The template is built once per migration set and cloned per test."""
+    from src.pytest_plugin import ensure_template, clone_template, drop_clone
+    server_url = os.environ["DATABASE_URL"]
+
+    def template_oid(name):
+        conn = psycopg2.connect(server_url)
+        with conn.cursor() as cur:
+            cur.execute("SELECT oid FROM pg_database WHERE datname = %s", (name,))
+            row = cur.fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    with runner.isolated_filesystem():
+        write_migration("20250101000000_aaaa", "users", "CREATE TABLE users (id int);")
+        first = ensure_template(server_url)
+        oid = template_oid(first)
+        assert ensure_template(server_url) == first
+        assert template_oid(first) == oid      # Reused, not rebuilt
+
+        clone_url = clone_template(server_url, first)
+        try:
+            assert table_exists(clone_url, "public.users")
+            assert applied_versions(clone_url) == [("20250101000000_aaaa", 1)]
+        finally:
+            drop_clone(server_url, clone_url)
+
+        # Another project's template and another run's in-progress build on the same server
+        from src.db import create_database, drop_database
+        foreign = "pgmigrate_tpl_0000beef_0123456789abcdef"
+        building = f"{first}_abc123"
+        create_database(server_url, foreign)
+        create_database(server_url, building)
+        conn = psycopg2.connect(server_url)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'ALTER DATABASE "{foreign}" IS_TEMPLATE true')
+        conn.close()
+        in_use = psycopg2.connect(url_for_database(server_url, building))
+
+        write_migration("20250101000001_bbbb", "posts", "CREATE TABLE posts (id int);")
+        try:
+            second = ensure_template(server_url)
+            assert second != first
+            assert template_oid(first) is None     # Stale template dropped
+            assert template_oid(foreign) is not None and template_oid(building) is not None
+            assert not in_use.closed and in_use.cursor().execute("SELECT 1") is None
+        finally:
+            in_use.close()
+            conn = psycopg2.connect(server_url)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f'ALTER DATABASE "{foreign}" IS_TEMPLATE false')
+            conn.close()
+            drop_database(server_url, foreign)
+            drop_database(server_url, building)
+        clone_url = clone_template(server_url, second)
+        try:
+            assert table_exists(clone_url, "public.posts")
+        finally:
+            drop_clone(server_url, clone_url)
+            conn = psycopg2.connect(server_url)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f'ALTER DATABASE "{second}" IS_TEMPLATE false')
+                cur.execute(f'DROP DATABASE "{second}"')
+            conn.close()
+
+def test_independent_no_transaction_migrations_run_concurrently(runner):
+    """'-- depends-on:' lets no-transaction migrations overlap; batches stay intact for down."""
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "tables",
+                        "CREATE TABLE a_t (id int);\nCREATE TABLE b_t (id int);")
+        for version, name, table in [("20250101000001_bbbb", "index_a", "a_t"),
+                                     ("20250101000002_cccc", "index_b", "b_t")]:
+            write_migration(version, name,
+                            "-- migration: no-transaction\n"
+                            "-- depends-on: 20250101000000_aaaa\n"
+                            "SELECT pg_sleep(0.6);\n"
+                            f"CREATE INDEX CONCURRENTLY idx_{table} ON {table} (id);",
+                            f"DROP INDEX IF EXISTS idx_{table};")
+        write_migration("20250101000003_dddd", "after", "CREATE TABLE c_t (id int);", "DROP TABLE c_t;")
+
+        result = runner.invoke(cli, ['up', '--concurrency', '2'])
+        assert result.exit_code == 0, result.output
+        applied = applied_versions(os.environ["DATABASE_URL"])
+        assert [batch for _, batch in applied] == [1, 1, 1, 1]
+
+        db = Database(os.environ["DATABASE_URL"])
+        with db.get_conn().cursor() as cur:
+            cur.execute("""
+                SELECT MAX(applied_at) - MIN(applied_at) AS spread FROM schema_migrations
+                WHERE version IN ('20250101000001_bbbb', '20250101000002_cccc')
+            """)
+            spread = cur.fetchone()['spread']
+        db.close()
+        # Run back to back they would finish >= 0.6s apart
+        assert spread.total_seconds() < 0.4
+        assert table_exists(os.environ["DATABASE_URL"], "public.c_t")
+
+        assert runner.invoke(cli, ['down']).exit_code == 0
+        assert applied_versions(os.environ["DATABASE_URL"]) == []
+
+        write_migration("20250101000004_eeee", "bad", "-- depends-on: 20240101000000_zzzz\nSELECT 1;")
+        result = runner.invoke(cli, ['up', '--dry-run'])
+        assert result.exit_code != 0
+        assert "neither applied nor pending" in result.output
+
+def test_fast_up_to_date_check_skips_the_lock(runner):
+    """Once migrated, up and the Python API answer from the stored fingerprint without locking."""
+    from src.api import is_up_to_date, migrate
+    from src.db import ADVISORY_LOCK_ID
+    db_url = os.environ["DATABASE_URL"]
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "users", "CREATE TABLE users (id int);", "DROP TABLE users;")
+        assert not is_up_to_date(db_url)
+        assert migrate(db_url) == ["20250101000000_aaaa"]
+        assert is_up_to_date(db_url)
+
+        # Another process holds the migration lock: up-to-date runs must not wait for it
+        holder = psycopg2.connect(db_url)
+        with holder.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+        try:
+            assert migrate(db_url) == []
+            result = runner.invoke(cli, ['up'])
+            assert result.exit_code == 0 and "up to date" in result.output
+        finally:
+            holder.close()
+
+        write_migration("20250101000001_bbbb", "posts", "CREATE TABLE posts (id int);", "DROP TABLE posts;")
+        assert not is_up_to_date(db_url)
+        assert migrate(db_url) == ["20250101000001_bbbb"]
+        assert runner.invoke(cli, ['down']).exit_code == 0
+        assert not is_up_to_date(db_url)
+
+def test_up_reads_each_pending_file_once(runner):
+    """Checksumming and applying a pending migration share a single read; applied files' text is not kept."""
+    from src import commands, utils
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "users", "CREATE TABLE users (id int);", "DROP TABLE users;")
+        assert runner.invoke(cli, ['up']).exit_code == 0
+        write_migration("20250101000001_bbbb", "posts", "CREATE TABLE posts (id int);", "DROP TABLE posts;")
+        applied = os.path.join("migrations", "20250101000000_aaaa_users.up.sql")
+        pending = os.path.join("migrations", "20250101000001_bbbb_posts.up.sql")
+
+        # A cold cache, as on a fresh checkout
+        cache = utils.ChecksumCache("off")
+        with patch.object(utils, "checksum_cache", cache), patch.object(commands, "checksum_cache", cache), \
+             patch.object(utils, "open_migration", wraps=utils.open_migration) as opened, \
+             patch.object(utils, "read_migration", wraps=utils.read_migration) as read_text:
+            result = runner.invoke(cli, ['up'])
+        assert result.exit_code == 0, result.output
+        assert table_exists(os.environ["DATABASE_URL"], "public.posts")
+        assert [c.args[0] for c in opened.call_args_list].count(pending) == 1
+        # The applied file is only hashed, not read as text
+        assert applied not in [c.args[0] for c in read_text.call_args_list]
+
+def test_lint_flags_blocking_ddl_and_fails_dry_run(runner):
+    """lint reports blocking DDL with pg_class sizes; up --dry-run refuses statements that will fail."""
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "orders",
+                        "CREATE TABLE orders (id int, total int);\n"
+                        "CREATE INDEX idx_new ON orders (id);\n"
+                        "INSERT INTO orders SELECT g, g FROM generate_series(1, 1000) g;\nANALYZE orders;")
+        assert runner.invoke(cli, ['up']).exit_code == 0
+
+        write_migration("20250101000001_bbbb", "alter_orders",
+                        "ALTER TABLE orders ALTER COLUMN total TYPE bigint,\n"
+                        "    ADD CONSTRAINT total_positive CHECK (total > 0);\n"
+                        "CREATE INDEX idx_total ON orders (total);")
+        write_migration("20250101000002_cccc", "concurrent_in_tx",
+                        "BEGIN;\nCREATE INDEX CONCURRENTLY idx_id ON orders (id);\nCOMMIT;")
+
+        result = runner.invoke(cli, ['lint'])
+        assert result.exit_code == 1
+        assert "Linting 2 pending migrations" in result.output
+        assert "[column-type-change]" in result.output
+        assert "[constraint-without-not-valid]" in result.output
+        assert "[index-not-concurrent]" in result.output
+        assert "[concurrently-in-transaction]" in result.output
+        assert "orders: ~1,000 rows" in result.output
+        # Indexing the table created in the same migration is fine
+        assert result.output.count("[index-not-concurrent]") == 1
+
+        result = runner.invoke(cli, ['up', '--dry-run'])
+        assert result.exit_code != 0
+        assert "will fail" in result.output
+        assert applied_versions(os.environ["DATABASE_URL"]) == [("20250101000000_aaaa", 1)]
+
+def test_no_transaction_migration_resumes_and_cleans_invalid_index(runner):
+    """A failed no-tx migration resumes at the failed statement after dropping its INVALID index."""
+    db_url = os.environ["DATABASE_URL"]
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "emails",
+                        "CREATE TABLE emails (id int, email text);\n"
+                        "INSERT INTO emails VALUES (1, 'a'), (2, 'a');")
+        assert runner.invoke(cli, ['up']).exit_code == 0
+
+        write_migration("20250101000001_bbbb", "unique_email",
+                        "-- migration: no-transaction\n"
+                        "CREATE TABLE audit (id int);\n"
+                        "CREATE UNIQUE INDEX CONCURRENTLY idx_email ON emails (email);\n"
+                        "CREATE TABLE audit_2 (id int);")
+        result = runner.invoke(cli, ['up'])
+        assert result.exit_code != 0
+        assert "statement 2/3" in result.output
+
+        conn = psycopg2.connect(db_url)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT statements_done FROM schema_migrations_progress")
+            assert cur.fetchone()[0] == 1
+            cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = 'idx_email'::regclass")
+            assert cur.fetchone()[0] is False
+            cur.execute("DELETE FROM emails WHERE id = 2")
+        conn.close()
+
+        result = runner.invoke(cli, ['up'])
+        assert result.exit_code == 0, result.output
+        assert "Resuming 20250101000001_bbbb at statement 2/3" in result.output
+        assert "Dropping INVALID index public.idx_email" in result.output
+        assert table_exists(db_url, "public.audit_2")
+
+        conn = psycopg2.connect(db_url)
+        with conn.cursor() as cur:
+            cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = 'idx_email'::regclass")
+            assert cur.fetchone()[0] is True
+            cur.execute("SELECT COUNT(*) FROM schema_migrations_progress")
+            assert cur.fetchone()[0] == 0
+        conn.close()
+        assert ("20250101000001_bbbb", 2) in applied_versions(db_url)
+
+def test_native_dump_and_diff_report_drift(runner):
+    """dump reads pg_catalog directly; diff compares object by object against a dump or plain SQL."""
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20250101000000_aaaa", "schema",
+                        "CREATE TABLE users (id serial PRIMARY KEY, email text NOT NULL);\n"
+                        "CREATE INDEX idx_users_email ON users (email);\n"
+                        "CREATE VIEW user_emails AS SELECT email FROM users;")
+        assert runner.invoke(cli, ['up']).exit_code == 0
+
+        result = runner.invoke(cli, ['dump', '--engine', 'native'])
+        assert result.exit_code == 0, result.output
+        with open("schema.sql") as f:
+            dumped = f.read()
+        assert "-- object: table public.users" in dumped
+        assert "schema_migrations" not in dumped
+        # Deterministic: a second dump is byte-for-byte identical
+        runner.invoke(cli, ['dump', '--engine', 'native', '--output', 'again.sql'])
+        with open("again.sql") as f:
+            assert f.read() == dumped
+
+        result = runner.invoke(cli, ['diff'])
+        assert result.exit_code == 0 and "No drift" in result.output
+
+        conn = psycopg2.connect(os.environ["DATABASE_URL"])
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ALTER TABLE users ADD COLUMN nickname text; DROP INDEX idx_users_email;")
+        conn.close()
+        result = runner.invoke(cli, ['diff'])
+        assert result.exit_code == 1
+        assert "~ table public.users (differs)" in result.output
+        assert "+    nickname text" in result.output
+        assert "- index public.idx_users_email (missing from database)" in result.output
+
+        # Plain SQL snapshots are loaded into a scratch database first
+        with open("plain.sql", "w") as f:
+            f.write("CREATE TABLE users (id serial PRIMARY KEY, email text NOT NULL, nickname text);\n"
+                    "CREATE VIEW user_emails AS SELECT email FROM users;\n")
+        result = runner.invoke(cli, ['diff', 'plain.sql'])
+        assert "scratch database" in result.output
+        assert result.exit_code == 0, result.output
+
+def test_tenant_mode_migrates_each_schema_independently(runner):
+    """Every matching schema gets its own schema_migrations; one broken tenant does not stop the rest."""
+    db_url = os.environ["DATABASE_URL"]
+    conn = psycopg2.connect(db_url)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for schema in ("tenant_a", "tenant_b", "tenant_c"):
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema};")
+        # tenant_c already has the table, so its migration fails
+        cur.execute("CREATE TABLE tenant_c.accounts (id int)")
+    try:
+        with runner.isolated_filesystem():
+            runner.invoke(cli, ['init'])
+            write_migration("20240101000000_aaaa", "accounts", "CREATE TABLE accounts (id int);", "DROP TABLE accounts;")
+
+            result = runner.invoke(cli, ['up', '--tenants', 'tenant\\_%', '--parallel', '3'])
+            assert result.exit_code == 1, result.output
+            assert "2 succeeded, 1 failed" in result.output
+            assert "#tenant_c" in result.output
+            assert "#tenant_a " not in result.output    # Successes are left out of the summary
+            assert table_exists(db_url, "tenant_a.accounts")
+            assert table_exists(db_url, "tenant_b.schema_migrations")
+            assert not table_exists(db_url, "public.accounts")
+
+            result = runner.invoke(cli, ['status', '--tenant-query',
+                                         "SELECT nspname FROM pg_namespace WHERE nspname IN ('tenant_a', 'tenant_b')"])
+            assert result.exit_code == 0, result.output
+            assert "2 succeeded, 0 failed" in result.output
+
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM tenant_a.schema_migrations")
+                assert [r[0] for r in cur.fetchall()] == ["20240101000000_aaaa"]
+                cur.execute("SELECT COUNT(*) FROM public.schema_migrations")
+                assert cur.fetchone()[0] == 0
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA IF EXISTS tenant_a, tenant_b, tenant_c CASCADE")
+        conn.close()
+
+def test_tenant_runs_keep_a_bounded_number_of_idle_connections(runner):
+    """More tenants than the pool holds: idle connections are evicted instead of piling up per tenant URL."""
+    from src.db import pool, application_name
+    db_url = os.environ["DATABASE_URL"]
+    schemas = [f"tenant_pool_{i}" for i in range(6)]
+    conn = psycopg2.connect(db_url)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for schema in schemas:
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema};")
+    try:
+        with runner.isolated_filesystem():
+            runner.invoke(cli, ['init'])
+            write_migration("20240101000000_aaaa", "accounts", "CREATE TABLE accounts (id int);")
+            with patch.object(pool, "max_idle", 2):
+                result = runner.invoke(cli, ['up', '--tenants', 'tenant\\_pool\\_%', '--parallel', '3'])
+            assert result.exit_code == 0, result.output
+            assert "6 succeeded, 0 failed" in result.output
+
+            with conn.cursor() as cur:
+                cur.execute("SELECT count(*) FROM pg_stat_activity WHERE application_name = %s", (application_name(),))
+                assert cur.fetchone()[0] <= 2
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {', '.join(schemas)} CASCADE")
+        conn.close()
+
+def test_live_progress_reports_lock_waits_and_streams_events(runner):
+    """A statement stuck behind another session's lock shows up live and in the event stream."""
+    import threading
+    db_url = os.environ["DATABASE_URL"]
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        blocker = psycopg2.connect(db_url)
+        with blocker.cursor() as cur:
+            cur.execute("CREATE TABLE busy (id int)")
+            blocker.commit()
+            cur.execute("LOCK TABLE busy IN ACCESS EXCLUSIVE MODE")
+        release = threading.Timer(1.5, blocker.rollback)
+        release.start()
+        try:
+            write_migration("20240101000000_aaaa", "alter_busy", "ALTER TABLE busy ADD COLUMN note text;")
+            result = runner.invoke(cli, ['up', '--progress-interval', '200ms', '--events', 'events.jsonl'])
+        finally:
+            release.join()
+            blocker.close()
+
+        assert result.exit_code == 0, result.output
+        assert "⏳ [1/1]" in result.output
+        assert "blocked by pid" in result.output
+
+        with open("events.jsonl") as f:
+            events = [json.loads(line) for line in f]
+        kinds = [e["event"] for e in events]
+        assert kinds[0] == "run_started" and kinds[-1] == "run_finished"
+        assert {"migration_started", "statement", "migration_finished"} <= set(kinds)
+        progress = [e for e in events if e["event"] == "progress"]
+        assert progress and progress[0]["version"] == "20240101000000_aaaa"
+        assert progress[0]["blocked_by"] and progress[0]["wait"].startswith("Lock:")
+        assert events[-1]["status"] == "ok" and events[-1]["applied"] == ["20240101000000_aaaa"]
+
+def test_seed_data_is_streamed_with_copy_and_checksummed(runner):
+    """COPY ... FROM 'file' loads from the migration's .data folder; editing the data counts as altering history."""
+    db_url = os.environ["DATABASE_URL"]
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20240101000000_aaaa", "countries",
+                        "CREATE TABLE countries (code text PRIMARY KEY, name text);\n"
+                        "COPY countries (code, name) FROM 'countries.csv' WITH (FORMAT csv, HEADER true);\n"
+                        "CREATE INDEX countries_name ON countries (name);")
+        data_dir = os.path.join("migrations", "20240101000000_aaaa_countries.data")
+        os.makedirs(data_dir)
+        with open(os.path.join(data_dir, "countries.csv"), "w") as f:
+            f.write('code,name\nDE,Germany\nFR,France\nCI,"Cote d\'Ivoire, Republic of"\n')
+
+        result = runner.invoke(cli, ['up', '--verbose'])
+        assert result.exit_code == 0, result.output
+        assert "rows=3" in result.output
+
+        conn = psycopg2.connect(db_url)
+        with conn.cursor() as cur:
+            cur.execute("SELECT name FROM countries WHERE code = 'CI'")
+            assert cur.fetchone()[0] == "Cote d'Ivoire, Republic of"
+        conn.close()
+
+        with open(os.path.join(data_dir, "countries.csv"), "a") as f:
+            f.write("IT,Italy\n")
+        result = runner.invoke(cli, ['up', '--no-fast-check'])
+        assert result.exit_code != 0
+        assert "Checksum mismatch for 20240101000000_aaaa" in result.output
+
+def test_up_pauses_while_replicas_lag(runner):
+    """Migrations wait for replica lag to fall below the threshold, and the pause is reported."""
+    from src import throttle
+    samples = iter([{"standby1": 4000.0}, {"standby1": 2500.0}, {"standby1": 200.0}])
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20240101000000_aaaa", "one", "CREATE TABLE one (id int);")
+        write_migration("20240102000000_bbbb", "two", "CREATE TABLE two (id int);")
+        with patch.object(throttle.ReplicationThrottle, "sample", lambda self: next(samples, {"standby1": 0.0})), \
+             patch.object(throttle, "POLL_INTERVAL", 0.05):
+            result = runner.invoke(cli, ['up', '--max-replica-lag', '1s', '--report', 'report.json'])
+
+        assert result.exit_code == 0, result.output
+        assert "Replica lag standby1 4.0s is above 1.0s; pausing" in result.output
+        assert "Replicas caught up (standby1 200ms)" in result.output
+        assert "Paused 1 time(s)" in result.output
+        assert applied_versions(os.environ["DATABASE_URL"]) == [("20240101000000_aaaa", 1), ("20240102000000_bbbb", 1)]
+        with open("report.json") as f:
+            report = json.load(f)
+        assert report["replica_lag"]["pauses"] == 1
+        assert report["replica_lag"]["max_seen_ms"] == 4000.0
+
+def test_up_gives_up_when_replica_lag_does_not_recover(runner):
+    from src import throttle
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20240101000000_aaaa", "one", "CREATE TABLE one (id int);")
+        with patch.object(throttle.ReplicationThrottle, "sample", lambda self: {"standby1": 90000.0}), \
+             patch.object(throttle, "POLL_INTERVAL", 0.05):
+            result = runner.invoke(cli, ['up', '--max-replica-lag', '1s', '--replica-lag-timeout', '200ms'])
+
+        assert result.exit_code != 0
+        assert "Replica lag stayed above 1.0s" in result.output
+        assert applied_versions(os.environ["DATABASE_URL"]) == []
+
+def test_replica_lag_queries_run_against_a_real_server(runner):
+    """sample() and wait() query the server for real: a primary without standbys never pauses."""
+    from src.throttle import ReplicationThrottle
+    db_url = os.environ["DATABASE_URL"]
+    messages = []
+    throttle = ReplicationThrottle(db_url, 1000)
+    try:
+        assert throttle.sample() == {}
+        assert throttle.wait(lambda message, **kwargs: messages.append(message)) == 0
+        assert messages == [] and throttle.pauses == 0
+    finally:
+        throttle.close()
+
+    # The standby query runs too, and tells a primary given as a replica apart
+    throttle = ReplicationThrottle(db_url, 1000, replica_urls=[db_url])
+    try:
+        with pytest.raises(Exception, match="is not a standby"):
+            throttle.sample()
+    finally:
+        throttle.close()
+
+def test_blockers_abort_or_terminate_before_taking_locks(runner):
+    """An idle-in-transaction session holding a lock the migration needs is found before the ALTER queues behind it."""
+    db_url = os.environ["DATABASE_URL"]
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20240101000000_aaaa", "orders", "CREATE TABLE orders (id int);")
+        assert runner.invoke(cli, ['up']).exit_code == 0
+        write_migration("20240102000000_bbbb", "alter_orders", "ALTER TABLE orders ADD COLUMN note text;")
+
+        blocker = psycopg2.connect(db_url)
+        try:
+            with blocker.cursor() as cur:
+                cur.execute("SELECT pg_backend_pid()")
+                pid = cur.fetchone()[0]
+                cur.execute("SELECT count(*) FROM orders")
+            result = runner.invoke(cli, ['up', '--blockers', 'abort', '--blocker-min-age', '0'])
+            assert result.exit_code != 0
+            assert f"pid {pid}" in result.output
+            assert "holds AccessShareLock on orders" in result.output
+            assert applied_versions(db_url) == [("20240101000000_aaaa", 1)]
+
+            result = runner.invoke(cli, ['up', '--blockers', 'terminate', '--blocker-min-age', '0'])
+            assert result.exit_code == 0, result.output
+            assert f"Terminated pid {pid}" in result.output
+            with pytest.raises(psycopg2.OperationalError):
+                blocker.cursor().execute("SELECT 1")
+        finally:
+            blocker.close()
+        assert applied_versions(db_url)[-1] == ("20240102000000_bbbb", 2)
+
+def test_blockers_leave_background_processes_alone(runner):
+    """Only client backends count as blockers: a walsender holding the same lock is neither reported nor terminated."""
+    from psycopg2.extras import LogicalReplicationConnection
+    from src.blockers import find_blockers
+    db_url = os.environ["DATABASE_URL"]
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20240101000000_aaaa", "orders", "CREATE TABLE orders (id int);")
+        assert runner.invoke(cli, ['up']).exit_code == 0
+
+        client = psycopg2.connect(db_url)
+        walsender = psycopg2.connect(db_url, connection_factory=LogicalReplicationConnection)
+        db = Database(db_url)
+        try:
+            pids = []
+            # Replication connections run in autocommit, so the walsender's transaction is explicit
+            for session, begin in ((client, None), (walsender, "BEGIN ISOLATION LEVEL REPEATABLE READ")):
+                cur = session.cursor()
+                if begin:
+                    cur.execute(begin)
+                cur.execute("SELECT pg_backend_pid()")
+                pids.append(cur.fetchone()[0])
+                cur.execute("SELECT txid_current(), count(*) FROM orders")
+            client_pid, walsender_pid = pids
+
+            found = {b.pid for b in find_blockers(db.get_conn(), {"orders": "AccessExclusiveLock"}, concurrent=True)}
+            assert client_pid in found
+            assert walsender_pid not in found
+        finally:
+            db.close()
+            client.close()
+            walsender.close()
+
+def test_lease_lock_mode_and_connection_reuse(runner):
+    """--lock-mode lease takes a lease row instead of a session lock, waits out a live one and reuses pooled connections."""
+    from src import lease
+    from src.db import pool
+    db_url = os.environ["DATABASE_URL"]
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20240101000000_aaaa", "one", "CREATE TABLE one (id int);")
+        opened = pool.opened
+        result = runner.invoke(cli, ['up', '--lock-mode', 'lease'])
+        assert result.exit_code == 0, result.output
+        # Fast check, lock and migrations all ran on one pooled connection
+        assert pool.opened - opened <= 1
+
+        conn = psycopg2.connect(db_url)
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM schema_migrations_lock")
+            assert cur.fetchone()[0] == 0
+            cur.execute("INSERT INTO schema_migrations_lock (holder, expires_at) "
+                        "VALUES ('other-host:1:abcd', NOW() + INTERVAL '1 minute')")
+
+        write_migration("20240102000000_bbbb", "two", "CREATE TABLE two (id int);")
+        with patch.object(lease, "LEASE_WAIT", 0.2):
+            result = runner.invoke(cli, ['up', '--lock-mode', 'lease'])
+        assert result.exit_code != 0
+        assert "lease held by other-host:1:abcd" in result.output
+
+        # A lease nobody renews expires, and the next run takes it over
+        with conn, conn.cursor() as cur:
+            cur.execute("UPDATE schema_migrations_lock SET expires_at = NOW() - INTERVAL '1 second'")
+        result = runner.invoke(cli, ['up', '--lock-mode', 'lease'])
+        conn.close()
+        assert result.exit_code == 0, result.output
+        assert applied_versions(db_url) == [("20240101000000_aaaa", 1), ("20240102000000_bbbb", 2)]
+
+def test_pooled_connections_come_back_without_session_state(runner):
+    """A connection returned to the pool leaves no settings, temp tables or advisory locks behind."""
+    from src.db import ConnectionPool
+    db_url = os.environ["DATABASE_URL"]
+    pool = ConnectionPool()
+    conn = pool.get(db_url)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SET statement_timeout = '1234ms'")
+        cur.execute("CREATE TEMP TABLE scratch (id int)")
+        cur.execute("SELECT pg_advisory_lock(4242)")
+    pool.put(db_url, conn)
+
+    assert pool.get(db_url) is conn
+    with conn.cursor() as cur:
+        cur.execute("SELECT current_setting('statement_timeout') AS timeout, to_regclass('pg_temp.scratch') AS scratch")
+        row = cur.fetchone()
+        cur.execute("SELECT count(*) AS held FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+        held = cur.fetchone()['held']
+    pool.close_all()
+    conn.close()
+    assert row['timeout'] != '1234ms' and row['scratch'] is None
+    assert held == 0
+
+def test_rehearse_times_pending_migrations_on_a_clone(runner):
+    """rehearse applies pending migrations to a template copy, measures them and leaves the target untouched."""
+    db_url = os.environ["DATABASE_URL"]
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20240101000000_aaaa", "events",
+                        "CREATE TABLE events (id int);\nINSERT INTO events SELECT generate_series(1, 20000);")
+        assert runner.invoke(cli, ['up']).exit_code == 0
+        write_migration("20240102000000_bbbb", "events_note",
+                        "ALTER TABLE events ADD COLUMN note text;\nUPDATE events SET note = 'backfilled';\n"
+                        "SELECT pg_sleep(0.2);")
+
+        for i in range(3):
+            write_migration(f"2024010300000{i}_cccc", f"noop_{i}", "SELECT 1;")
+
+        connect = psycopg2.connect
+        with patch.object(psycopg2, "connect", wraps=connect) as spy:
+            result = runner.invoke(cli, ['rehearse', '--report', 'rehearsal.json'])
+        assert result.exit_code == 0, result.output
+        # The lock sampler reuses one pooled connection instead of opening one per migration
+        clone_connects = [c for c in spy.call_args_list if "pgmigrate_rehearse_" in str(c.args[0])]
+        assert len(clone_connects) <= 3, clone_connects
+        assert "20240102000000_bbbb" in result.output
+        assert "AccessExclusive events" in result.output
+        assert "events +" in result.output
+
+        with open("rehearsal.json") as f:
+            rehearsal = json.load(f)["rehearsal"]
+        assert [r["version"] for r in rehearsal][0] == "20240102000000_bbbb" and len(rehearsal) == 4
+        assert rehearsal[0]["wal_bytes"] > 0 and rehearsal[0]["duration_ms"] >= 200
+        before, after = rehearsal[0]["size_changes"]["events"]
+        assert after > before
+
+        # The target is untouched and the clone is gone
+        assert applied_versions(db_url) == [("20240101000000_aaaa", 1)]
+        conn = psycopg2.connect(db_url)
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM pg_database WHERE datname LIKE 'pgmigrate_rehearse_%'")
+            assert cur.fetchone()[0] == 0
+        conn.close()
+
+def test_budget_applies_what_fits_and_caps_statements(runner):
+    """--budget defers migrations whose recorded durations don't fit; each partial run is its own batch."""
+    import datetime
+    db_url = os.environ["DATABASE_URL"]
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20240101000000_aaaa", "one", "CREATE TABLE one (id int);")
+        write_migration("20240102000000_bbbb", "two", "CREATE TABLE two (id int);")
+        write_migration("20240103000000_cccc", "three", "CREATE TABLE three (id int);")
+        # Durations recorded on another environment, e.g. staging's --report
+        with open("staging.json", "w") as f:
+            json.dump({"migrations": [
+                {"version": "20240101000000_aaaa", "direction": "up", "status": "ok", "duration_ms": 200},
+                {"version": "20240102000000_bbbb", "direction": "up", "status": "ok", "duration_ms": 300},
+                {"version": "20240103000000_cccc", "direction": "up", "status": "ok", "duration_ms": 600000},
+            ]}, f)
+
+        result = runner.invoke(cli, ['up', '--budget', '30s', '--estimates-from', 'staging.json'])
+        assert result.exit_code == 0, result.output
+        assert "Deferring 20240103000000_cccc" in result.output
+        assert applied_versions(db_url) == [("20240101000000_aaaa", 1), ("20240102000000_bbbb", 1)]
+
+        result = runner.invoke(cli, ['up', '--budget', '1h', '--estimates-from', 'staging.json'])
+        assert result.exit_code == 0, result.output
+        assert applied_versions(db_url)[-1] == ("20240103000000_cccc", 2)
+
+        # Outside the window nothing runs at all
+        now = datetime.datetime.now()
+        window = f"{(now + datetime.timedelta(hours=2)):%H:%M}-{(now + datetime.timedelta(hours=3)):%H:%M}"
+        write_migration("20240104000000_dddd", "slow", "SELECT pg_sleep(5);")
+        result = runner.invoke(cli, ['up', '--window', window])
+        assert result.exit_code == 0, result.output
+        assert "Outside the maintenance window" in result.output
+        assert len(applied_versions(db_url)) == 3
+
+        # A statement that outlasts the budget is cancelled by statement_timeout
+        result = runner.invoke(cli, ['up', '--budget', '1s', '--default-estimate', '10ms'])
+        assert result.exit_code != 0
+        assert "statement timeout" in result.output
+        assert len(applied_versions(db_url)) == 3
+
+def test_budget_recomputes_statement_timeout_before_each_statement(runner):
+    """Every statement is capped at the time left when it starts, in and outside transactions."""
+    db_url = os.environ["DATABASE_URL"]
+    record = "INSERT INTO seen SELECT '{}', setting::int FROM pg_settings WHERE name = 'statement_timeout';"
+    with runner.isolated_filesystem():
+        runner.invoke(cli, ['init'])
+        write_migration("20240101000000_aaaa", "tx",
+                        "CREATE TABLE seen (label text, timeout_ms int);\n"
+                        f"{record.format('tx 1')}\nSELECT pg_sleep(0.2);\n{record.format('tx 2')}")
+        write_migration("20240102000000_bbbb", "notx",
+                        f"-- migration: no-transaction\n{record.format('no-tx 1')}\n"
+                        f"SELECT pg_sleep(0.2);\n{record.format('no-tx 2')}")
+
+        result = runner.invoke(cli, ['up', '--budget', '1h', '--default-estimate', '10ms'])
+        assert result.exit_code == 0, result.output
+
+        conn = psycopg2.connect(db_url)
+        with conn.cursor() as cur:
+            cur.execute("SELECT label, timeout_ms FROM seen")
+            seen = dict(cur.fetchall())
+        conn.close()
+        assert 0 < seen["tx 2"] <= seen["tx 1"] - 200 and seen["tx 1"] <= 3600000
+        assert 0 < seen["no-tx 2"] <= seen["no-tx 1"] - 200 < seen["tx 2"]
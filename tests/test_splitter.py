@@ -0,0 +1,40 @@
+from src.splitter import split_statements
+
+def test_splits_on_top_level_semicolons_only():
+    """Semicolons inside strings, identifiers, comments and dollar quotes don't split."""
+    sql = (
+        "-- migration: no-transaction\n"
+        "CREATE TABLE a (note text DEFAULT 'it''s; fine');  /* one; /* nested; */ */\n"
+        "CREATE FUNCTION f() RETURNS int AS $body$ BEGIN RETURN 1; END; $body$ LANGUAGE plpgsql;\n"
+        "SELECT E'back\\'slash;', \"odd;\"\"name\" FROM a;\n"
+        "-- trailing comment only\n"
+    )
+    statements = split_statements(sql)
+
+    assert [s.preview.split()[0] for s in statements] == ["CREATE", "CREATE", "SELECT"]
+    assert statements[1].sql.endswith("LANGUAGE plpgsql")
+    assert statements[2].sql == "SELECT E'back\\'slash;', \"odd;\"\"name\" FROM a"
+
+def test_reports_line_of_first_code_character():
+    """Line numbers point at the statement, not at the comments before it."""
+    sql = "BEGIN;\n\n-- the table\nCREATE TABLE t (id int);\nSELECT 1; SELECT 2;"
+    assert [(s.index, s.line) for s in split_statements(sql)] == [(1, 1), (2, 4), (3, 5), (4, 5)]
+
+def test_begin_atomic_body_is_one_statement():
+    """SQL-standard function bodies contain semicolons that end at the closing END."""
+    sql = ("CREATE FUNCTION g() RETURNS int LANGUAGE sql\n"
+           "BEGIN ATOMIC SELECT CASE WHEN true THEN 1 END; SELECT 2; END;\n"
+           "SELECT g();")
+    statements = split_statements(sql)
+    assert len(statements) == 2
+    assert statements[1].sql == "SELECT g()"
+
+def test_semicolons_inside_parentheses_do_not_split():
+    """Multi-action rules wrap their statements in parentheses, which psql keeps together."""
+    sql = ("CREATE RULE r AS ON INSERT TO t DO ALSO (INSERT INTO a VALUES (1); INSERT INTO b VALUES (2));\n"
+           "SELECT (1);")
+    statements = split_statements(sql)
+    assert [s.sql for s in statements] == [
+        "CREATE RULE r AS ON INSERT TO t DO ALSO (INSERT INTO a VALUES (1); INSERT INTO b VALUES (2))",
+        "SELECT (1)",
+    ]
@@ -0,0 +1,139 @@
+import os
+import time
+import pytest
+from unittest.mock import patch
+from src import utils
+from src.utils import ChecksumCache, calculate_file_hash
+
+def write_file(path, content, age_seconds=60):
+    """Writes a file and backdates its mtime so it is not considered 'racy'."""
+    with open(path, "w") as f:
+        f.write(content)
+    past = time.time() - age_seconds
+    os.utime(path, (past, past))
+
+def test_checksum_cache_hashes_each_file_once(tmp_path):
+    """Repeated lookups of an unchanged file must not re-read it."""
+    sql_file = tmp_path / "a.up.sql"
+    write_file(sql_file, "CREATE TABLE a (id int);")
+    cache = ChecksumCache(str(tmp_path / "cache.json"))
+
+    with patch.object(utils, "calculate_file_hash", wraps=calculate_file_hash) as spy:
+        first = cache.get(str(sql_file))
+        second = cache.get(str(sql_file))
+
+    assert first == second == calculate_file_hash(str(sql_file))
+    assert spy.call_count == 1
+
+def test_checksum_cache_persists_and_invalidates(tmp_path):
+    """Entries survive a new process but are dropped when the file changes."""
+    sql_file = tmp_path / "a.up.sql"
+    cache_path = str(tmp_path / "cache.json")
+    write_file(sql_file, "CREATE TABLE a (id int);")
+
+    cache = ChecksumCache(cache_path)
+    cache.warm([str(sql_file)])
+    cache.save()
+    assert os.path.exists(cache_path)
+
+    # A fresh cache (new process) reads from disk without hashing
+    with patch.object(utils, "calculate_file_hash") as spy:
+        ChecksumCache(cache_path).get(str(sql_file))
+    assert spy.call_count == 0
+
+    # Editing the file invalidates the entry
+    write_file(sql_file, "CREATE TABLE b (id int);", age_seconds=30)
+    assert ChecksumCache(cache_path).get(str(sql_file)) == calculate_file_hash(str(sql_file))
+
+def test_checksum_cache_does_not_persist_racy_entries(tmp_path):
+    """Files modified just now are hashed but not written to disk."""
+    sql_file = tmp_path / "a.up.sql"
+    sql_file.write_text("CREATE TABLE a (id int);")
+    cache_path = str(tmp_path / "cache.json")
+
+    cache = ChecksumCache(cache_path)
+    cache.get(str(sql_file))
+    cache.save()
+
+    with patch.object(utils, "calculate_file_hash", return_value="x") as spy:
+        ChecksumCache(cache_path).get(str(sql_file))
+    assert spy.call_count == 1
+
+def test_parse_directives_and_durations():
+    """Header directives accept flags and key=value pairs."""
+    sql = "-- migration: no-transaction\n-- Migration: lock-timeout=2s\nSELECT 1;"
+    assert utils.parse_directives(sql) == {"no-transaction": "", "lock-timeout": "2s"}
+    assert utils.parse_duration("2s") == 2000
+    assert utils.parse_duration("500ms") == 500
+    assert utils.parse_duration("1.5m") == 90_000
+    assert utils.parse_duration("3") == 3000
+
+def backdate(path, age_seconds=60):
+    past = time.time() - age_seconds
+    os.utime(path, (past, past))
+
+def test_get_migrations_walks_subdirectories_and_reuses_manifest(tmp_path):
+    """Per-year folders are discovered; unchanged folders are not listed again."""
+    root = tmp_path / "migrations"
+    (root / "2024").mkdir(parents=True)
+    (root / "2025").mkdir()
+    write_file(root / "2024" / "20240101000000_aaaa_first.up.sql", "SELECT 1;")
+    write_file(root / "2025" / "20250101000000_bbbb_second.up.sql", "SELECT 2;")
+    write_file(root / "20230101000000_cccc_flat.up.sql", "SELECT 3;")
+    for d in (root / "2024", root / "2025", root):
+        backdate(d)
+    manifest_path = str(tmp_path / "manifest.json")
+
+    migrations = utils.get_migrations(str(root), utils.MigrationManifest(manifest_path))
+    assert sorted(migrations) == ["20230101000000_cccc", "20240101000000_aaaa", "20250101000000_bbbb"]
+    assert migrations["20250101000000_bbbb"].up_path == str(root / "2025" / "20250101000000_bbbb_second.up.sql")
+
+    # A fresh manifest (new process) lists nothing while the folders are unchanged
+    with patch.object(utils.os, "scandir", wraps=os.scandir) as spy:
+        assert sorted(utils.get_migrations(str(root), utils.MigrationManifest(manifest_path))) == sorted(migrations)
+    assert spy.call_count == 0
+
+    # Adding a file relists only the folder it landed in
+    write_file(root / "2025" / "20250201000000_dddd_third.up.sql", "SELECT 4;")
+    backdate(root / "2025", age_seconds=30)
+    with patch.object(utils.os, "scandir", wraps=os.scandir) as spy:
+        migrations = utils.get_migrations(str(root), utils.MigrationManifest(manifest_path))
+    assert "20250201000000_dddd" in migrations
+    assert [c.args[0] for c in spy.call_args_list] == [str(root / "2025")]
+
+def test_get_migrations_rejects_duplicate_versions_across_folders(tmp_path):
+    root = tmp_path / "migrations"
+    (root / "a").mkdir(parents=True)
+    (root / "b").mkdir()
+    write_file(root / "a" / "20240101000000_aaaa_one.up.sql", "SELECT 1;")
+    write_file(root / "b" / "20240101000000_aaaa_two.up.sql", "SELECT 2;")
+
+    with pytest.raises(Exception, match="Duplicate up migration for 20240101000000_aaaa"):
+        utils.get_migrations(str(root), utils.MigrationManifest("off"))
+
+def test_compressed_migrations_keep_the_plain_checksum_and_load_in_one_pass(tmp_path):
+    """Gzipping a migration does not alter history, and loading it also checksums it."""
+    import gzip
+    sql = "CREATE TABLE a (id int);\nINSERT INTO a VALUES (1);\n"
+    plain = tmp_path / "plain" / "20240101000000_aaaa_a.up.sql"
+    plain.parent.mkdir()
+    write_file(plain, sql)
+    root = tmp_path / "migrations"
+    root.mkdir()
+    compressed = root / "20240101000000_aaaa_a.up.sql.gz"
+    with gzip.open(compressed, "wt") as f:
+        f.write(sql)
+    backdate(compressed)
+    backdate(root)
+
+    migration = utils.get_migrations(str(root), utils.MigrationManifest("off"))["20240101000000_aaaa"]
+    assert migration.up_path == str(compressed)
+
+    cache = ChecksumCache("off")
+    with patch.object(utils, "checksum_cache", cache), \
+         patch.object(utils, "calculate_file_hash", wraps=calculate_file_hash) as spy:
+        script = migration.load("up")
+        checksum = migration.up_checksum
+    assert script.sql == sql
+    assert checksum == calculate_file_hash(str(plain))
+    assert spy.call_count == 0